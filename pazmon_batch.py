@@ -0,0 +1,239 @@
+"""盤面をまとめて評価する NumPy 版エンジン
+
+(N, 14) の int8 配列（宝石コード）に対して、いちばん左の 3 つ以上の並びの検出、
+左詰め、補充、連鎖を全行いっぺんに進める。結果は pazmon_engine の
+leftmost_run / collapse_left / fill_random を一盤面ずつ回した時と同じになる
+（check_parity で確かめられる）。
+
+    python pazmon_batch.py --parity 20000
+"""
+import argparse
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+import pazmon_engine as engine
+
+# 宝石コード：engine.GEMS の並び順、空きは 5
+GEM_CODES = {g: i for i, g in enumerate(engine.GEMS)}
+EMPTY = len(engine.GEMS)
+CODE_GEMS = engine.GEMS + [engine.EMPTY]
+
+
+def encode(fields: List[List[str]]) -> np.ndarray:
+    """盤面（文字のリスト）の列を (N, W) の int8 配列にする"""
+    table = dict(GEM_CODES)
+    table[engine.EMPTY] = EMPTY
+    return np.array([[table[e] for e in f] for f in fields], dtype=np.int8)
+
+
+def decode(boards: np.ndarray) -> List[List[str]]:
+    return [[CODE_GEMS[c] for c in row] for row in boards.tolist()]
+
+
+def random_boards(n: int, rng: np.random.Generator, width: int = engine.SLOT_COUNT) -> np.ndarray:
+    return rng.integers(0, EMPTY, size=(n, width), dtype=np.int8)
+
+
+def leftmost_runs(boards: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """各行のいちばん左の 3 つ以上の並び (start, length)。無ければ (-1, 0)
+
+    いちばん左の「3 つ同じ」が始まる位置は、必ずその並びの先頭になる。
+    """
+    n, w = boards.shape
+    triple = ((boards[:, :-2] == boards[:, 1:-1])
+              & (boards[:, 1:-1] == boards[:, 2:])
+              & (boards[:, :-2] < EMPTY))
+    has = triple.any(axis=1)
+    start = np.argmax(triple, axis=1)
+
+    # 先頭から同じ宝石が続く長さ
+    first = np.take_along_axis(boards, start[:, None], axis=1)
+    idx = np.arange(w)
+    stop = (boards != first) & (idx[None, :] >= start[:, None])
+    end = np.where(stop.any(axis=1), np.argmax(stop, axis=1), w)
+
+    length = np.where(has, end - start, 0)
+    start = np.where(has, start, -1)
+    return start, length
+
+
+def collapse(boards: np.ndarray, start: np.ndarray, length: np.ndarray) -> np.ndarray:
+    """[start, start+length) を消して左詰めにした新しい配列を返す
+
+    消した分の空きは右端に並ぶ。盤面に元から空きが無いこと（プレイ中は常にそう）を前提にする。
+    """
+    idx = np.arange(boards.shape[1])
+    clear = (idx[None, :] >= start[:, None]) & (idx[None, :] < (start + length)[:, None])
+    out = np.where(clear, np.int8(EMPTY), boards)
+    order = np.argsort(out == EMPTY, axis=1, kind="stable")
+    return np.take_along_axis(out, order, axis=1)
+
+
+def refill(boards: np.ndarray, draws: np.ndarray) -> np.ndarray:
+    """空きを draws の同じ位置の宝石で埋める"""
+    return np.where(boards == EMPTY, draws, boards).astype(np.int8)
+
+
+def drag(boards: np.ndarray, src: np.ndarray, dst: np.ndarray) -> np.ndarray:
+    """各行で src の宝石を dst まで隣と入れ替えながら動かした盤面"""
+    n, w = boards.shape
+    base = np.broadcast_to(np.arange(w), (n, w))
+    s = np.asarray(src)[:, None]
+    d = np.asarray(dst)[:, None]
+    fwd = (s < d) & (base >= s) & (base < d)
+    bwd = (s > d) & (base > d) & (base <= s)
+    idx = base + fwd - bwd
+    idx = np.where(base == d, s, idx)
+    return np.take_along_axis(boards, idx, axis=1)
+
+
+def cascade(boards: np.ndarray, rng: Optional[np.random.Generator] = None,
+            draws: Optional[np.ndarray] = None, max_steps: int = 64) -> dict:
+    """全行の連鎖を止まるまで（最大 max_steps 回）進める
+
+    draws を渡すと t 回目の補充に draws[t] を使う（パリティ確認用）。
+    戻り値:
+        boards : 連鎖後の盤面
+        combos : 行ごとのコンボ数
+        elems  : (max_steps, N) 各段で消えた宝石コード（無ければ -1）
+        lengths: (max_steps, N) 各段で消えた個数
+    """
+    if rng is None and draws is None:
+        rng = np.random.default_rng()
+    b = boards.astype(np.int8, copy=True)
+    n = b.shape[0]
+    combos = np.zeros(n, dtype=np.int32)
+    elems = np.full((max_steps, n), -1, dtype=np.int8)
+    lengths = np.zeros((max_steps, n), dtype=np.int8)
+
+    active = np.arange(n)
+    for t in range(max_steps):
+        if active.size == 0:
+            break
+        sub = b[active]
+        start, length = leftmost_runs(sub)
+        hit = length > 0
+        active, sub, start, length = active[hit], sub[hit], start[hit], length[hit]
+        if active.size == 0:
+            break
+        elems[t, active] = sub[np.arange(active.size), start]
+        lengths[t, active] = length
+        combos[active] += 1
+
+        sub = collapse(sub, start, length)
+        if draws is not None:
+            d = draws[t][active]
+        else:
+            d = rng.integers(0, EMPTY, size=sub.shape, dtype=np.int8)
+        b[active] = refill(sub, d)
+    return {"boards": b, "combos": combos, "elems": elems, "lengths": lengths}
+
+
+def expected_damage(res: dict, rules: engine.Ruleset, party: engine.Party, monster: engine.Enemy) -> Tuple[np.ndarray, np.ndarray]:
+    """cascade の結果から行ごとのダメージ合計と回復量合計（ぶれを入れる前の値）
+
+    倍率は rules の表を配列にして引くだけなので、盤面の数によらず表は一度しか作らない。
+    """
+    enemy_code = rules.code.get(monster.element, -1)
+    # 宝石コード → 3 つ消えた時の基本ダメージ。最後の要素は「消えていない」用の 0
+    gain = np.array([rules.attack_value(c, 3, 0, party, monster, enemy_code) for c in range(EMPTY)]
+                    + [0.0])
+    combo_table = np.array(rules.combo_table)
+    heal_table = np.array(rules.heal_table)
+
+    elems = res["elems"].astype(np.int64)
+    steps = elems.shape[0]
+    k = res["lengths"].astype(np.int64) - 3 + np.arange(1, steps + 1)[:, None]
+    k = np.clip(k, 0, len(combo_table) - 1)
+    hit = elems >= 0
+    life = hit & (elems == rules.life)
+    code = np.where(hit & ~life, elems, EMPTY)
+    dmg = (gain[code] * combo_table[k]).sum(axis=0)
+    heal = np.where(life, heal_table[k], 0.0).sum(axis=0)
+    return dmg, heal
+
+
+# ---------------- 一盤面ずつの版との突き合わせ ----------------
+
+def _scalar_cascade(field: List[str], draws: np.ndarray, row: int):
+    steps = []
+    t = 0
+    while True:
+        run = engine.leftmost_run(field)
+        if not run:
+            break
+        start, L = run
+        steps.append((GEM_CODES[field[start]], L))
+        engine.collapse_left(field, start, L)
+        for i, e in enumerate(field):
+            if e == engine.EMPTY:
+                field[i] = CODE_GEMS[draws[t][row][i]]
+        t += 1
+    return field, steps
+
+
+def check_parity(n: int = 10000, seed: int = 0, max_steps: int = 64) -> int:
+    """ランダムな盤面とドラッグで、一盤面ずつの版と結果を突き合わせる（不一致の数を返す）"""
+    rng = np.random.default_rng(seed)
+    boards = random_boards(n, rng)
+    src = rng.integers(0, engine.SLOT_COUNT, size=n)
+    dst = rng.integers(0, engine.SLOT_COUNT, size=n)
+    draws = rng.integers(0, EMPTY, size=(max_steps,) + boards.shape, dtype=np.int8)
+
+    moved = drag(boards, src, dst)
+    res = cascade(moved, draws=draws, max_steps=max_steps)
+    starts, lengths = leftmost_runs(boards)
+
+    mismatches = 0
+    for r, field in enumerate(decode(boards)):
+        # 一段だけ
+        run = engine.leftmost_run(field)
+        expect = run if run else (-1, 0)
+        if (int(starts[r]), int(lengths[r])) != expect:
+            mismatches += 1
+            continue
+        if run:
+            one = list(field)
+            engine.collapse_left(one, *run)
+            got = decode(collapse(boards[r:r+1], starts[r:r+1], lengths[r:r+1]))[0]
+            if got != one:
+                mismatches += 1
+                continue
+
+        # ドラッグ + 連鎖
+        for k, nxt in engine.drag_path(int(src[r]), int(dst[r])):
+            field[k], field[nxt] = field[nxt], field[k]
+        field, steps = _scalar_cascade(field, draws, r)
+        c = int(res["combos"][r])
+        got_steps = list(zip(res["elems"][:c, r].tolist(), res["lengths"][:c, r].tolist()))
+        if field != decode(res["boards"][r:r+1])[0] or steps != got_steps:
+            mismatches += 1
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NumPy 版の盤面評価")
+    parser.add_argument("--parity", type=int, default=0, help="突き合わせる盤面の数")
+    parser.add_argument("--bench", type=int, default=0, help="連鎖を回す盤面の数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.parity:
+        bad = check_parity(args.parity, args.seed)
+        print(f"parity: {args.parity} boards, {bad} mismatches")
+        if bad:
+            raise SystemExit(1)
+    if args.bench:
+        rng = np.random.default_rng(args.seed)
+        boards = random_boards(args.bench, rng)
+        t = time.perf_counter()
+        res = cascade(boards, rng)
+        dt = time.perf_counter() - t
+        print(f"cascade: {args.bench} boards in {dt:.3f}s ({args.bench / dt:,.0f} boards/s), "
+              f"mean combo {res['combos'].mean():.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""描画とロジックの重い所のベンチマーク（SDL の dummy ドライバで回す）
+
+描画は draw_top・draw_field（ドラッグの影あり/なし）・hp_bar_surf・sp_bar_surf・
+Item.draw_item_surface、ロジックは leftmost_run・collapse_left・fill_random・
+party_attack_from_gems・Skill.execute・W×H の盤面の消えるまとまりの検出
+（6x5 と 64x64）を一回あたりの時間で測る。main_frame は
+本物の main() を決まった入力で回したときの 1 フレームの時間。
+結果は JSON に書け、前に保存した結果（ベースライン）より threshold 以上
+遅くなった項目があれば終了コード 1 で知らせる。
+
+    python pazmon_bench.py --json bench.json
+    python pazmon_bench.py --baseline bench.json --threshold 0.15
+    python pazmon_bench.py --only draw_ --quick
+"""
+import os
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import argparse
+import json
+import platform
+import random
+import statistics
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pygame as pg
+
+import pazmon_engine as engine
+import pazmonfree as gui
+
+# 一回の計測（loops 回まとめて呼ぶ）がこれより短くならないように loops を増やす
+MIN_BATCH = 0.02
+MAIN_FRAMES = 400
+
+
+def _timed(fn: Callable, loops: int) -> float:
+    t = time.perf_counter()
+    for _ in range(loops):
+        fn()
+    return time.perf_counter() - t
+
+
+def measure(fn: Callable, repeat: int = 5, min_batch: float = MIN_BATCH) -> dict:
+    """一回あたりの時間（ns）。repeat 回測った中央値と最小値"""
+    loops = 1
+    while _timed(fn, loops) < min_batch:
+        loops *= 2
+    per_call = [_timed(fn, loops) / loops for _ in range(repeat)]
+    return {"ns": statistics.median(per_call) * 1e9, "min_ns": min(per_call) * 1e9,
+            "loops": loops, "repeat": repeat}
+
+
+# ---------------- 計測する物 ----------------
+
+class _Scene:
+    """ベンチマーク用の画面・フォント・戦闘の状態（決まった種で作る）"""
+
+    def __init__(self, seed: int = 0):
+        pg.init()
+        self.screen = pg.display.set_mode((980, 720))
+        self.gss = gui.GameSystemSettings()
+        self.font = self.gss.get_jp_font(30)
+        self.weak = self.gss.get_jp_font(17)
+        self.rng = random.Random(seed)
+        self.state = engine.new_battle(self.rng)
+        self.item = gui.Item(self.state.items)
+        self.item.build_atlas()
+        # 並びが一つある盤面（collapse_left / fill_random はその写しに使う）
+        field = engine.init_field(self.rng)
+        field[3:6] = ["火"] * 3
+        self.field = field
+        self.collapsed = list(field)
+        engine.collapse_left(self.collapsed, 3, 3)
+        # W×H の盤面（乱数で埋めたままなので消えるまとまりがいくつもある）
+        self.grids = {(w, h): (engine.Grid(w, h), engine.init_field(self.rng, w * h))
+                      for w, h in ((6, 5), (64, 64))}
+
+
+def render_benches(sc: _Scene) -> Dict[str, Callable]:
+    gss, screen, font, weak = sc.gss, sc.screen, sc.font, sc.weak
+    party, enemy, field = sc.state.party, sc.state.enemy, sc.state.field
+    names, holds = sc.state.items["name"], sc.state.items["max_hold"]
+    return {
+        "draw_top": lambda: gss.draw_top(screen, enemy, party, font, weak),
+        "draw_field": lambda: gss.draw_field(screen, field, font),
+        "draw_field_drag": lambda: gss.draw_field(screen, field, font, 3, 3, field[3]),
+        "hp_bar_surf": lambda: gss.hp_bar_surf(420, 600, 300, 20),
+        "sp_bar_surf": lambda: gss.sp_bar_surf(3, 6, (240, 220, 60), 300, 40),
+        # 値が変わらない時のキャッシュ済みバー（draw_top が毎フレーム通る道）
+        "hp_bar_widget": lambda: gui.BARS.hp("bench", 420, 600, 300, 20),
+        "draw_item_surface": lambda: sc.item.draw_item_surface(screen, font, names, holds),
+    }
+
+
+def logic_benches(sc: _Scene) -> Dict[str, Callable]:
+    rng = sc.rng
+    field, collapsed = sc.field, sc.collapsed
+    party, enemy = sc.state.party, sc.state.enemy
+    skill = next(a.skill for a in party.allies if a.skill is not None)
+    small, small_field = sc.grids[(6, 5)]
+    large, large_field = sc.grids[(64, 64)]
+
+    def collapse():
+        # 写しを作る分も入る（fill_random も同じ）
+        engine.collapse_left(list(field), 3, 3)
+
+    def fill():
+        engine.fill_random(list(collapsed), rng)
+
+    def execute():
+        enemy.hp = enemy.max_hp
+        skill.execute(party, enemy, rng)
+
+    return {
+        "leftmost_run": lambda: engine.leftmost_run(field),
+        "collapse_left": collapse,
+        "fill_random": fill,
+        "party_attack_from_gems": lambda: engine.party_attack_from_gems("火", 4, 2, party, enemy, rng),
+        "skill_execute": execute,
+        "grid_matches_6x5": lambda: small.matches(small_field),
+        "grid_matches_64x64": lambda: large.matches(large_field),
+    }
+
+
+class _ScriptedInput(gui.LiveInput):
+    """main_frame 用の決まった入力：スタートして、数フレームごとにドラッグする"""
+    headless = True
+
+    def __init__(self, frames: int, seed: int = 0, every: int = 6):
+        self.seed = seed
+        self.frames = frames
+        self.every = every
+        self.frame = 0
+        self.times: List[float] = []
+        self._gss = gui.GameSystemSettings()
+        self._t = time.perf_counter()
+
+    def _slot_pos(self, i: int) -> Tuple[int, int]:
+        return self._gss.slot_rect(i % self._gss.SLOT_COUNT).center
+
+    def events(self) -> list:
+        pg.event.pump()
+        f = self.frame
+        k, phase = divmod(f, self.every)
+        if f < 2 or phase > 1:
+            return []
+        if phase == 0:
+            return [pg.event.Event(pg.MOUSEBUTTONDOWN, button=1, pos=self._slot_pos(k))]
+        return [pg.event.Event(pg.MOUSEBUTTONUP, button=1, pos=self._slot_pos(k * 5 + 3))]
+
+    def decide(self, kind: str, fn: Callable):
+        if kind == "keys":
+            if self.frame >= self.frames:
+                return gui.HELD_ESC
+            return gui.HELD_START if self.frame == 1 else 0
+        return fn() if kind == "item" else False
+
+    def tick(self, pacer, idle: bool = False) -> float:
+        now = time.perf_counter()
+        self.times.append(now - self._t)
+        self._t = now
+        self.frame += 1
+        return 1 / 60
+
+
+def measure_main(frames: int = MAIN_FRAMES, seed: int = 0) -> dict:
+    """main() の 1 フレームの時間（起動直後の 2 フレームは除く）
+
+    ターンのあるフレームと無いフレームが混ざるので、比べる値（ns）は平均にする。
+    """
+    inputs = _ScriptedInput(frames, seed)
+    try:
+        gui.main(inputs)
+    except SystemExit:
+        pass
+    times = sorted(inputs.times[2:])
+    return {"ns": statistics.fmean(times) * 1e9, "median_ns": statistics.median(times) * 1e9,
+            "p95_ns": times[int(len(times) * 0.95)] * 1e9, "frames": len(times)}
+
+
+def run_benches(only: Optional[str] = None, repeat: int = 5, min_batch: float = MIN_BATCH,
+                frames: int = MAIN_FRAMES) -> Dict[str, dict]:
+    sc = _Scene()
+    benches = dict(render_benches(sc))
+    benches.update(logic_benches(sc))
+    results = {}
+    for name, fn in benches.items():
+        if only is None or only in name:
+            results[name] = measure(fn, repeat, min_batch)
+    if only is None or only in "main_frame":
+        # main() は最後に pg.quit() するので一番最後に測る
+        results["main_frame"] = measure_main(frames)
+    return results
+
+
+# ---------------- ベースラインとの比較 ----------------
+
+def compare(results: Dict[str, dict], baseline: Dict[str, dict], threshold: float) -> List[Tuple[str, float, bool]]:
+    """(名前, 新/旧 の比, 遅くなりすぎたか)。両方にある項目だけ比べる"""
+    out = []
+    for name, r in results.items():
+        base = baseline.get(name)
+        if base is None or not base.get("ns"):
+            continue
+        ratio = r["ns"] / base["ns"]
+        out.append((name, ratio, ratio > 1 + threshold))
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description="描画とロジックのベンチマーク")
+    parser.add_argument("--json", help="結果を書き出すパス")
+    parser.add_argument("--baseline", help="比べる前回の結果（--json で書いたもの）")
+    parser.add_argument("--threshold", type=float, default=0.10, help="これ以上遅くなったら失敗（0.10 = 10%%）")
+    parser.add_argument("--only", help="名前にこの文字列を含む項目だけ")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--quick", action="store_true", help="計測を短くする（目安を見る用）")
+    args = parser.parse_args()
+
+    min_batch = MIN_BATCH / 4 if args.quick else MIN_BATCH
+    frames = MAIN_FRAMES // 4 if args.quick else MAIN_FRAMES
+    results = run_benches(args.only, args.repeat, min_batch, frames)
+
+    for name, r in results.items():
+        print(f"{name:24s} {r['ns'] / 1000:10.2f} us")
+    report = {
+        "meta": {"python": platform.python_version(), "pygame": pg.version.ver,
+                 "platform": platform.platform(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                 "quick": args.quick},
+        "results": results,
+    }
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        rows = compare(results, baseline, args.threshold)
+        print(f"\nbaseline {args.baseline}（{args.threshold:.0%} より遅いと失敗）")
+        for name, ratio, bad in rows:
+            print(f"{name:24s} x{ratio:5.2f}{'  遅くなった' if bad else ''}")
+        if any(bad for _, _, bad in rows):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
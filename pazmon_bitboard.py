@@ -0,0 +1,259 @@
+"""盤面を一つの整数に詰めた表現（1 スロット 3 ビット）
+
+スロット i は下から 3i ビット目に入る。宝石コードは engine.GEMS の並び順、空きは 5。
+並びの検出はビット演算で全スロット同時に行い、左詰めはシフトとマスクだけで行う。
+リスト形式（GUI が描く形）とは from_list / to_list で行き来できる。
+
+    python pazmon_bitboard.py --parity 20000
+"""
+import argparse
+import random
+import time
+from typing import List, Optional, Tuple
+
+import pazmon_engine as engine
+
+BITS = 3
+MASK = 0b111
+EMPTY = len(engine.GEMS)
+GEM_CODES = {g: i for i, g in enumerate(engine.GEMS)}
+CODE_GEMS = engine.GEMS + [engine.EMPTY]
+_TO_CODE = dict(GEM_CODES)
+_TO_CODE[engine.EMPTY] = EMPTY
+
+
+class _Masks:
+    """盤面の幅ごとのマスク（最初に使った時に作って使い回す）"""
+    __slots__ = ("n", "full", "low", "low_next", "empty_pat")
+
+    def __init__(self, n: int):
+        self.n = n
+        self.full = (1 << (BITS * n)) - 1
+        # 各スロットの最下位ビット
+        self.low = sum(1 << (BITS * i) for i in range(n))
+        # 右隣があるスロット（0..n-2）の最下位ビット
+        self.low_next = self.low & ~(1 << (BITS * (n - 1)))
+        self.empty_pat = self.low * EMPTY
+
+
+_MASKS = {}
+
+
+def masks(n: int = engine.SLOT_COUNT) -> _Masks:
+    m = _MASKS.get(n)
+    if m is None:
+        m = _MASKS[n] = _Masks(n)
+    return m
+
+
+# ---------------- 変換 ----------------
+
+def from_list(field: List[str]) -> int:
+    b = 0
+    for e in reversed(field):
+        b = (b << BITS) | _TO_CODE[e]
+    return b
+
+
+def to_list(b: int, n: int = engine.SLOT_COUNT) -> List[str]:
+    return [CODE_GEMS[(b >> (BITS * i)) & MASK] for i in range(n)]
+
+
+def get(b: int, i: int) -> int:
+    return (b >> (BITS * i)) & MASK
+
+
+def put(b: int, i: int, code: int) -> int:
+    s = BITS * i
+    return (b & ~(MASK << s)) | (code << s)
+
+
+# ---------------- 並びの検出 ----------------
+
+def _zero_fields(x: int, low: int) -> int:
+    """値が 0 のスロットの最下位ビットだけが立ったマスク"""
+    return ~(x | (x >> 1) | (x >> 2)) & low
+
+
+def run_starts(b: int, n: int = engine.SLOT_COUNT) -> int:
+    """同じ宝石が 3 つ以上続く位置（その 3 つの先頭）のマスク"""
+    m = _MASKS.get(n) or masks(n)
+    x = b ^ (b >> BITS)
+    eq = ~(x | (x >> 1) | (x >> 2)) & m.low_next       # スロット i と i+1 が同じ
+    y = b ^ m.empty_pat
+    gem = (y | (y >> 1) | (y >> 2)) & m.low             # 空きでない
+    return eq & (eq >> BITS) & gem                      # i, i+1, i+2 が同じ宝石
+
+
+def leftmost_run(b: int, n: int = engine.SLOT_COUNT) -> Optional[Tuple[int, int]]:
+    """いちばん左の 3 つ以上の並び (start, length)（engine.leftmost_run と同じ結果）"""
+    m = _MASKS.get(n) or masks(n)
+    x = b ^ (b >> BITS)
+    eq = ~(x | (x >> 1) | (x >> 2)) & m.low_next
+    y = b ^ m.empty_pat
+    starts = eq & (eq >> BITS) & (y | (y >> 1) | (y >> 2))
+    if not starts:
+        return None
+    start = ((starts & -starts).bit_length() - 1) // BITS
+    # 先頭から「右隣と同じ」が途切れる所まで
+    stop = ~(eq >> (BITS * start)) & m.low
+    return start, ((stop & -stop).bit_length() - 1) // BITS + 1
+
+
+def empties(b: int, n: int = engine.SLOT_COUNT) -> int:
+    """空きスロットの最下位ビットだけが立ったマスク"""
+    m = _MASKS.get(n) or masks(n)
+    return _zero_fields(b ^ m.empty_pat, m.low)
+
+
+# ---------------- 盤面の操作 ----------------
+
+def collapse(b: int, start: int, length: int, n: int = engine.SLOT_COUNT) -> int:
+    """[start, start+length) を消して左詰め、右端に空きを並べる
+
+    盤面に元から空きが無いこと（プレイ中は常にそう）を前提にする。
+    """
+    s = BITS * start
+    kept = (b & ((1 << s) - 1)) | ((b >> (BITS * (start + length))) << s)
+    top = BITS * (n - length)
+    return kept | (((_MASKS.get(n) or masks(n)).empty_pat >> top) << top)
+
+
+def fill(b: int, codes: List[int], n: int = engine.SLOT_COUNT) -> int:
+    """空きを左から順に codes で埋める"""
+    e = empties(b, n)
+    for c in codes:
+        if not e:
+            break
+        bit = e & -e
+        b ^= (c ^ EMPTY) * bit   # EMPTY → c に書き換え
+        e ^= bit
+    return b
+
+
+def fill_random(b: int, rng=random, n: int = engine.SLOT_COUNT) -> int:
+    e = empties(b, n)
+    k = len(engine.GEMS)
+    while e:
+        bit = e & -e
+        b ^= (EMPTY ^ rng.randrange(k)) * bit
+        e ^= bit
+    return b
+
+
+def swap(b: int, i: int, j: int) -> int:
+    x = ((b >> (BITS * i)) ^ (b >> (BITS * j))) & MASK
+    return b ^ (x << (BITS * i)) ^ (x << (BITS * j))
+
+
+def drag(b: int, src: int, dst: int) -> int:
+    """src の宝石を隣と入れ替えながら dst まで運ぶ（= 抜いて差し込む）"""
+    if src == dst:
+        return b
+    v = (b >> (BITS * src)) & MASK
+    s = BITS * src
+    removed = (b & ((1 << s) - 1)) | ((b >> (s + BITS)) << s)
+    d = BITS * dst
+    return (removed & ((1 << d) - 1)) | (v << d) | ((removed >> d) << (d + BITS))
+
+
+class BitBoard:
+    """整数盤面の薄いラッパー（速さが要る所では関数を直接使う）"""
+    __slots__ = ("bits", "n")
+
+    def __init__(self, bits: int = 0, n: int = engine.SLOT_COUNT):
+        self.bits = bits
+        self.n = n
+
+    @classmethod
+    def from_list(cls, field: List[str]) -> "BitBoard":
+        return cls(from_list(field), len(field))
+
+    def to_list(self) -> List[str]:
+        return to_list(self.bits, self.n)
+
+    def leftmost_run(self) -> Optional[Tuple[int, int]]:
+        return leftmost_run(self.bits, self.n)
+
+    def collapse_left(self, start: int, length: int):
+        self.bits = collapse(self.bits, start, length, self.n)
+
+    def fill_random(self, rng=random):
+        self.bits = fill_random(self.bits, rng, self.n)
+
+    def __eq__(self, other):
+        return isinstance(other, BitBoard) and self.bits == other.bits and self.n == other.n
+
+    def __hash__(self):
+        return hash((self.bits, self.n))
+
+
+# ---------------- リスト版との突き合わせ ----------------
+
+def _same_cascade(field: List[str], b: int, rng) -> bool:
+    """リスト版と整数版で同じ補充を使って連鎖させ、毎段の結果が一致するか"""
+    while True:
+        run = engine.leftmost_run(field)
+        if run != leftmost_run(b):
+            return False
+        if run is None:
+            return to_list(b) == field
+        engine.collapse_left(field, *run)
+        b = collapse(b, *run)
+        codes = [rng.randrange(len(engine.GEMS)) for _ in range(run[1])]
+        draw = iter(codes)
+        for i, e in enumerate(field):
+            if e == engine.EMPTY:
+                field[i] = CODE_GEMS[next(draw)]
+        b = fill(b, codes)
+        if to_list(b) != field:
+            return False
+
+
+def check_parity(n: int = 10000, seed: int = 0) -> int:
+    """ランダムな盤面とドラッグで、リスト版と結果を突き合わせる（不一致の数を返す）"""
+    rng = random.Random(seed)
+    bad = 0
+    for _ in range(n):
+        field = engine.init_field(rng)
+        b = from_list(field)
+        if to_list(b) != field or leftmost_run(b) != engine.leftmost_run(field):
+            bad += 1
+            continue
+        src, dst = rng.randrange(engine.SLOT_COUNT), rng.randrange(engine.SLOT_COUNT)
+        for k, nxt in engine.drag_path(src, dst):
+            field[k], field[nxt] = field[nxt], field[k]
+        b = drag(b, src, dst)
+        if to_list(b) != field or not _same_cascade(field, b, rng):
+            bad += 1
+    return bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description="整数盤面の確認とベンチマーク")
+    parser.add_argument("--parity", type=int, default=0, help="突き合わせる盤面の数")
+    parser.add_argument("--bench", type=int, default=0, help="並びの検出を回す盤面の数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    if args.parity:
+        bad = check_parity(args.parity, args.seed)
+        print(f"parity: {args.parity} boards, {bad} mismatches")
+        if bad:
+            raise SystemExit(1)
+    if args.bench:
+        rng = random.Random(args.seed)
+        fields = [engine.init_field(rng) for _ in range(args.bench)]
+        boards = [from_list(f) for f in fields]
+        t = time.perf_counter()
+        for f in fields:
+            engine.leftmost_run(f)
+        t_list = time.perf_counter() - t
+        t = time.perf_counter()
+        for b in boards:
+            leftmost_run(b)
+        t_bits = time.perf_counter() - t
+        print(f"leftmost_run: list {t_list / args.bench * 1e9:.0f} ns, bits {t_bits / args.bench * 1e9:.0f} ns")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+"""オートバトル：別プロセスでモンテカルロ木探索（MCTS）を回し、最善手を流し続ける
+
+メインループと同じスレッドで探索すると、その間は描画も入力も止まる。
+ここでは局面の写し（BattleState.clone）をワーカープロセスに送り、持ち時間の
+間 MCTS で考えさせて、その時点の最善手を STREAM_EVERY 秒ごとに送り返させる。
+メインループは毎フレーム AutoBattle.poll() で受け取るだけなので止まらず、
+手を指すのはアニメーションが終わって持ち時間が過ぎた時だけ。その間に
+プレイヤーが宝石を動かしたりスキルを使ったりすると局面が変わるので、
+古い探索は捨てて新しい局面から考え直す（手動の割り込み）。
+
+- 手は「ドラッグ (src, dst)」と「SP が溜まった味方のスキル（Skill.execute）」
+- 補充・ダメージのぶれ・敵の攻撃は毎回新しい乱数で写しの上で回す
+  （開ループの木：枝は手の列で、局面そのものは覚えない）
+- ドラッグは Solver の深さ 0 の順位で並べ、訪問数の平方根に応じて
+  上から広げる（progressive widening）。スキルは先に試す
+- 葉からはスキルと、でたらめな ROLLOUT_SAMPLES 個のドラッグで一番良いもの
+  （Solver.sampled_move）で ROLLOUT_TURNS ターン進め、
+  敵の HP を削った割合・倒した数・パーティの HP の増減で評価する
+
+    python pazmon_bot.py --seed 3 --budget 1.0
+    python pazmon_bot.py --seed 3 --budget 0.5 --grid 6x5
+"""
+import argparse
+import math
+import multiprocessing as mp
+import random
+import time
+from typing import Callable, List, Optional, Tuple
+
+import pazmon_engine as engine
+from pazmon_solver import Solver
+
+# 手の種類（手は (種類, a, b)：ドラッグなら (MOVE, src, dst)、スキルなら (SKILL, 味方, 0)）
+MOVE, SKILL = 0, 1
+Action = Tuple[int, int, int]
+
+# 途中経過を送る間隔（秒）。新しい局面が来ていないかもこの間隔で見る
+STREAM_EVERY = 0.05
+# 持ち時間を過ぎても最後の結果が届かなければ、これだけ待ってから途中の最善手を使う
+GRACE = 0.25
+# 木の深さ（ターン数）、葉から先に進めるターン数
+TREE_DEPTH = 3
+ROLLOUT_TURNS = 2
+# 葉から先のドラッグは、でたらめなこれだけの中から最初に消える分が一番大きいもの
+ROLLOUT_SAMPLES = 16
+# 子を増やす目安：WIDEN + sqrt(訪問数) 個まで
+WIDEN = 4
+EXPLORE = 0.5
+# 評価でのパーティの HP の重み（敵一体を倒す = 1）
+HP_WEIGHT = 0.5
+
+
+def score(state: engine.BattleState) -> float:
+    """局面の良さ：倒した敵の数 + 今の敵を削った割合 + HP_WEIGHT × 残り HP の割合"""
+    if state.cleared:
+        progress = float(len(state.enemies))
+    else:
+        en = state.enemy
+        progress = state.enemy_idx + 1.0 - en.hp / en.max_hp
+    party = state.party
+    hp = party.hp / party.max_hp if party.hp > 0 else -1.0
+    return progress + HP_WEIGHT * hp
+
+
+def apply_action(state: engine.BattleState, action: Action) -> List[dict]:
+    kind, a, b = action
+    if kind == SKILL:
+        return engine.use_skill(state, a)
+    return engine.play_turn(state, a, b)
+
+
+def ready_skills(state: engine.BattleState) -> List[Action]:
+    return [(SKILL, i, 0) for i, ally in enumerate(state.party.allies)
+            if ally.skill is not None and ally.sp >= ally.skill.need_sp]
+
+
+def describe(action: Optional[Action], state: engine.BattleState) -> str:
+    if action is None:
+        return "-"
+    kind, a, b = action
+    if kind == SKILL:
+        ally = state.party.allies[a]
+        return f"{ally.name}のスキル"
+    grid = state.grid
+    return f"{grid.label(a)}→{grid.label(b)}"
+
+
+# ---------------- 探索 ----------------
+
+class _Node:
+    __slots__ = ("action", "children", "untried", "visits", "total")
+
+    def __init__(self, action: Optional[Action]):
+        self.action = action
+        self.children: List["_Node"] = []
+        self.untried: Optional[List[Action]] = None
+        self.visits = 0
+        self.total = 0.0
+
+
+class MCTS:
+    """局面 state からの開ループ MCTS（step() を回すほど良くなる）"""
+
+    def __init__(self, state: engine.BattleState, rng=None, depth: int = TREE_DEPTH,
+                 rollout: int = ROLLOUT_TURNS):
+        self.state = state
+        self.rng = rng if rng is not None else random.Random()
+        self.depth = depth
+        self.rollout_turns = rollout
+        self.solver = Solver(depth=0, rng=self.rng)
+        self.root = _Node(None)
+        self.iterations = 0
+        self._base = score(state)
+
+    def actions(self, state: engine.BattleState) -> List[Action]:
+        """試す順に並べた手（スキルが先、ドラッグは見込みの大きい順）"""
+        moves = [(MOVE, src, dst) for _, (src, dst) in self.solver.rank(state, 0)]
+        return ready_skills(state) + moves
+
+    def _rollout(self, st: engine.BattleState):
+        solver = self.solver
+        for _ in range(self.rollout_turns):
+            for action in ready_skills(st):
+                apply_action(st, action)
+                if st.finished:
+                    return
+            src, dst = solver.sampled_move(st, ROLLOUT_SAMPLES)
+            engine.play_turn(st, src, dst)
+            if st.finished:
+                return
+
+    def _select(self, node: _Node) -> _Node:
+        log_n = math.log(node.visits)
+        c = EXPLORE
+        return max(node.children,
+                   key=lambda ch: ch.total / ch.visits + c * math.sqrt(log_n / ch.visits))
+
+    def step(self):
+        """一回分：選んで・広げて・先まで進めて・評価を戻す"""
+        st = self.state.clone(rng=self.rng)
+        node = self.root
+        path = [node]
+        turns = st.turns
+        while not st.finished and st.turns - turns < self.depth:
+            if node.untried is None:
+                node.untried = self.actions(st)
+            if node.untried and len(node.children) < WIDEN + math.isqrt(node.visits):
+                child = _Node(node.untried.pop(0))
+                node.children.append(child)
+                apply_action(st, child.action)
+                path.append(child)
+                break
+            if not node.children:
+                break
+            node = self._select(node)
+            apply_action(st, node.action)
+            path.append(node)
+        if not st.finished:
+            self._rollout(st)
+        reward = score(st) - self._base
+        for n in path:
+            n.visits += 1
+            n.total += reward
+        self.iterations += 1
+
+    def best(self) -> Optional[Action]:
+        """今の最善手（一番多く試した手）"""
+        if not self.root.children:
+            return None
+        return max(self.root.children, key=lambda ch: ch.visits).action
+
+    def value(self) -> float:
+        if not self.root.children:
+            return 0.0
+        ch = max(self.root.children, key=lambda ch: ch.visits)
+        return ch.total / ch.visits
+
+    def run(self, budget: float, report: Optional[Callable[[bool], None]] = None,
+            interrupted: Optional[Callable[[], bool]] = None) -> bool:
+        """budget 秒探索する。途中で interrupted() が真なら止めて False を返す"""
+        if self.state.finished:
+            return True
+        now = time.perf_counter()
+        deadline = now + budget
+        next_report = now + STREAM_EVERY
+        while True:
+            self.step()
+            now = time.perf_counter()
+            if now >= deadline:
+                return True
+            if now >= next_report:
+                if interrupted is not None and interrupted():
+                    return False
+                if report is not None:
+                    report(False)
+                next_report = now + STREAM_EVERY
+
+
+def _serve(conn):
+    """ワーカープロセス：("search", 番号, 局面, 持ち時間) を受けて考え、途中経過と結果を返す
+
+    返すのは ("best", 番号, 手, 回数, 評価, 最後か)。新しいメッセージが来たら
+    今の探索はやめる（None で終わる）。
+    """
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            return
+        if msg is None:
+            return
+        if msg[0] != "search":
+            continue
+        _, job, state, budget = msg
+        search = MCTS(state, rng=state.rng)
+
+        def report(final: bool, job=job, search=search):
+            conn.send(("best", job, search.best(), search.iterations, search.value(), final))
+        if search.run(budget, report, conn.poll):
+            report(True)
+
+
+# ---------------- メインループ側 ----------------
+
+def state_key(state: engine.BattleState) -> tuple:
+    """局面が変わったかを見るためのキー"""
+    return (state.turns, state.enemy_idx, tuple(state.field), state.party.hp, state.enemy.hp,
+            tuple(a.sp for a in state.party.allies), state.power)
+
+
+class AutoBattle:
+    """探索プロセスに局面を送り、毎フレーム途中経過と結果を受け取る（待たない）
+
+    poll(state, ready) は局面が変わっていれば新しく考えさせ、ready で考え終わって
+    いれば（持ち時間が過ぎていれば）指す手を返す。それ以外は None。
+    best / iterations / value は届いた中で最新の途中経過。ワーカーが落ちたら
+    起こし直さず error に理由を入れ、それからは None しか返さない。
+    """
+
+    def __init__(self, budget: float = 1.0, seed: Optional[int] = None):
+        self.budget = budget
+        self.best: Optional[Action] = None
+        self.iterations = 0
+        self.value = 0.0
+        self._rng = random.Random(seed)
+        self._proc = None
+        self._conn = None
+        self._job = 0
+        self._key = None
+        self._final: Optional[Action] = None
+        self._deadline = 0.0
+        self.error: Optional[str] = None
+
+    def start(self):
+        # pygame を初期化した親を fork しないように spawn で起こす
+        ctx = mp.get_context("spawn")
+        self._conn, child = ctx.Pipe()
+        self._proc = ctx.Process(target=_serve, args=(child,), daemon=True)
+        self._proc.start()
+        child.close()
+
+    def submit(self, state: engine.BattleState):
+        """state から考え直させる（前の探索は捨てる）"""
+        if self._proc is None:
+            self.start()
+        self._job += 1
+        self._key = state_key(state)
+        self.best = self._final = None
+        self.iterations = 0
+        self.value = 0.0
+        self._deadline = time.perf_counter() + self.budget + GRACE
+        snap = state.clone(rng=random.Random(self._rng.randrange(1 << 63)))
+        try:
+            self._conn.send(("search", self._job, snap, self.budget))
+        except OSError as e:
+            self._fail(e)
+
+    def _drain(self):
+        conn = self._conn
+        try:
+            while conn.poll():
+                _, job, action, iterations, value, final = conn.recv()
+                if job != self._job:
+                    continue
+                self.best, self.iterations, self.value = action, iterations, value
+                if final:
+                    self._final = action
+        except (EOFError, OSError) as e:
+            self._fail(e)
+
+    def _fail(self, e: Exception):
+        # ワーカーが落ちた（毎フレーム起こし直すとメインループが詰まるのでやめる）
+        self.error = f"探索プロセスが止まった（{type(e).__name__}）"
+        self.best = self._final = None
+        self.close()
+
+    def poll(self, state: engine.BattleState, ready: bool = True) -> Optional[Action]:
+        if self.error is not None:
+            return None
+        if state_key(state) != self._key:
+            self.submit(state)
+        if self._conn is not None:
+            self._drain()
+        if not ready or self.error is not None:
+            return None
+        action = self._final
+        if action is None and self.best is not None and time.perf_counter() >= self._deadline:
+            action = self.best
+        if action is not None:
+            # 同じ局面のままでも次は考え直す（効かなかったスキルを繰り返さない）
+            self._key = None
+        return action
+
+    def cancel(self):
+        """今の探索をやめさせる（オートバトルを切った時）"""
+        if self._conn is not None:
+            try:
+                self._conn.send(("stop",))
+            except OSError as e:
+                self._fail(e)
+        self._key = None
+        self.best = self._final = None
+
+    def close(self):
+        if self._proc is None:
+            return
+        try:
+            self._conn.send(None)
+        except OSError:
+            pass
+        self._proc.join(timeout=1.0)
+        if self._proc.is_alive():
+            self._proc.terminate()
+        self._proc = self._conn = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="別プロセスの MCTS でオートバトルの手を考える")
+    parser.add_argument("--seed", type=int, default=0, help="盤面を作る乱数の種")
+    parser.add_argument("--budget", type=float, default=1.0, help="一手の持ち時間（秒）")
+    parser.add_argument("--grid", default=None, help="盤面の形（20 や 6x5）")
+    parser.add_argument("--turns", type=int, default=3, help="何手指すか")
+    args = parser.parse_args()
+
+    grid = engine.Grid.parse(args.grid) if args.grid else None
+    state = engine.new_battle(random.Random(args.seed), snapshots=False, grid=grid)
+    bot = AutoBattle(args.budget, args.seed)
+    try:
+        for _ in range(args.turns):
+            if state.finished:
+                break
+            print("".join(state.field), f"（{state.enemy.name} HP {state.enemy.hp}）")
+            # 60 FPS のメインループのつもりで poll し、一フレームの長さの最大を見る
+            t0 = last = time.perf_counter()
+            worst = 0.0
+            frames = 0
+            while True:
+                action = bot.poll(state)
+                now = time.perf_counter()
+                worst = max(worst, now - last)
+                last = now
+                frames += 1
+                if action is not None:
+                    break
+                time.sleep(1 / 60)
+            print(f"  {describe(action, state)}  value {bot.value:+.3f}  {bot.iterations} iterations  "
+                  f"{now - t0:.2f} s, {frames} frames, worst frame {(worst) * 1000:.1f} ms")
+            apply_action(state, action)
+    finally:
+        bot.close()
+
+
+if __name__ == "__main__":
+    main()
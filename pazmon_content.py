@@ -0,0 +1,322 @@
+"""コンテンツパック（パーティ・スキル・敵・ダンジョン・アイテム）の読み込み
+
+content/*.json を読み、形を確かめてから、すぐ組み立てられる形に直して返す。
+確かめた結果はファイルの中身のハッシュをキーに content/.cache/ へ pickle で
+書き出し、次からは JSON の読み込みと確認を飛ばす。
+GUI・エンジン・シミュレータは同じ default_pack() を使う（環境変数
+PAZMON_CONTENT で別のパックに差し替えられる）。
+
+    python pazmon_content.py content/default.json
+    python pazmon_content.py --check        # スキル無しの味方でも戦えるか
+"""
+import argparse
+import hashlib
+import json
+import os
+import pickle
+import sys
+import time
+from typing import Dict, List, Optional
+
+from pazmon_entities import Ally, Enemy, Party, Skill
+
+CONTENT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "content")
+DEFAULT_PACK = os.path.join(CONTENT_DIR, "default.json")
+CACHE_DIR = os.path.join(CONTENT_DIR, ".cache")
+# 形式や組み立て方を変えたら上げる（古いキャッシュを読まないように）
+SCHEMA_VERSION = 2
+
+ELEMENTS = ("火", "水", "風", "土")
+ITEM_TYPES = ("ATK", "RBRTH", "LIFE", "SHUFFLE")
+# value を使う種類（LIFE は回復量）と、省いた時の値
+ITEM_VALUES = {"LIFE": 25}
+
+
+class ContentError(ValueError):
+    """パックの形がおかしい（どこがおかしいかをメッセージに入れる）"""
+
+
+# ---------------- 形の確認 ----------------
+
+def _need(obj: dict, key: str, kinds, where: str):
+    if not isinstance(obj, dict):
+        raise ContentError(f"{where}: オブジェクトではない")
+    if key not in obj:
+        raise ContentError(f"{where}.{key}: ない")
+    v = obj[key]
+    # bool は int の仲間なので別に弾く
+    if isinstance(v, bool) or not isinstance(v, kinds):
+        raise ContentError(f"{where}.{key}: 型が違う（{type(v).__name__}）")
+    return v
+
+
+def _opt(obj: dict, key: str, kinds, where: str, default=None):
+    if key not in obj or obj[key] is None:
+        return default
+    return _need(obj, key, kinds, where)
+
+
+def _positive(v, where: str):
+    if v <= 0:
+        raise ContentError(f"{where}: 0 より大きくないといけない（{v}）")
+    return v
+
+
+def _skill_args(sk: dict, where: str) -> tuple:
+    """Skill(...) の引数（dmg は ratio ならタプル、range ならリスト）"""
+    name = _need(sk, "name", str, where)
+    need_sp = _positive(_need(sk, "need_sp", int, where), f"{where}.need_sp")
+    dmg = None
+    if "dmg" in sk:
+        d = _need(sk, "dmg", dict, where)
+        kind = _need(d, "kind", str, f"{where}.dmg")
+        if kind == "ratio":
+            dmg = (_need(d, "base", (int, float), f"{where}.dmg"),
+                   _need(d, "ratio", (int, float), f"{where}.dmg"))
+        elif kind == "range":
+            lo = _need(d, "min", int, f"{where}.dmg")
+            hi = _need(d, "max", int, f"{where}.dmg")
+            if lo > hi:
+                raise ContentError(f"{where}.dmg: min > max")
+            dmg = [lo, hi]
+        else:
+            raise ContentError(f"{where}.dmg.kind: ratio / range のどちらか（{kind}）")
+    return (name, need_sp, dmg,
+            _opt(sk, "debuff_ratio", (int, float), where),
+            _opt(sk, "debuff_turns", int, where),
+            _opt(sk, "stun_turns", int, where),
+            _opt(sk, "heal", int, where))
+
+
+def _element(obj: dict, where: str) -> str:
+    e = _need(obj, "element", str, where)
+    if e not in ELEMENTS:
+        raise ContentError(f"{where}.element: {'/'.join(ELEMENTS)} のどれか（{e}）")
+    return e
+
+
+def validate(data: dict) -> dict:
+    """JSON を確かめ、組み立て用の形（タプルのリスト）にして返す"""
+    if _need(data, "version", int, "pack") != 1:
+        raise ContentError("pack.version: 1 だけ読める")
+
+    skills = {}
+    for sid, sk in _need(data, "skills", dict, "pack").items():
+        skills[sid] = _skill_args(sk, f"skills.{sid}")
+
+    party = _need(data, "party", dict, "pack")
+    allies = []
+    for i, a in enumerate(_need(party, "allies", list, "party")):
+        where = f"party.allies[{i}]"
+        sid = _opt(a, "skill", str, where)
+        if sid is not None and sid not in skills:
+            raise ContentError(f"{where}.skill: skills に無い（{sid}）")
+        hp = _positive(_need(a, "hp", int, where), f"{where}.hp")
+        allies.append((_need(a, "name", str, where), _element(a, where), hp, hp,
+                       _need(a, "ap", int, where), _need(a, "dp", int, where), sid))
+    if not allies:
+        raise ContentError("party.allies: 一人もいない")
+    party_hp = _opt(party, "hp", int, "party", sum(a[2] for a in allies))
+    compiled_party = (_opt(party, "player_name", str, "party", "Player"), allies,
+                      _positive(party_hp, "party.hp"), sum(a[5] for a in allies)/len(allies))
+
+    enemies = {}
+    images = {}
+    for name, en in _need(data, "enemies", dict, "pack").items():
+        where = f"enemies.{name}"
+        hp = _positive(_need(en, "hp", int, where), f"{where}.hp")
+        enemies[name] = (name, _element(en, where), hp, hp,
+                         _need(en, "ap", int, where), _need(en, "dp", int, where))
+        # assets/monsters/ の中のファイル名（無ければ GUI は灰色の四角を出す）
+        image = _opt(en, "image", str, where)
+        if image is not None:
+            images[name] = image
+
+    dungeons = {}
+    for dname, roster in _need(data, "dungeons", dict, "pack").items():
+        where = f"dungeons.{dname}"
+        if not isinstance(roster, list) or not roster:
+            raise ContentError(f"{where}: 敵の名前のリストがいる")
+        for name in roster:
+            if name not in enemies:
+                raise ContentError(f"{where}: enemies に無い（{name}）")
+        dungeons[dname] = list(roster)
+    if "default" not in dungeons:
+        raise ContentError("dungeons.default: ない")
+
+    items = []
+    for i, it in enumerate(_need(data, "items", list, "pack")):
+        where = f"items[{i}]"
+        kind = _need(it, "type", str, where)
+        if kind not in ITEM_TYPES:
+            raise ContentError(f"{where}.type: {'/'.join(ITEM_TYPES)} のどれか（{kind}）")
+        value = _opt(it, "value", int, where)
+        if kind not in ITEM_VALUES:
+            if value is not None:
+                raise ContentError(f"{where}.value: {kind} は value を使わない")
+        elif value is None:
+            value = ITEM_VALUES[kind]
+        items.append((_need(it, "name", str, where), kind,
+                      _need(it, "max_hold", int, where), value))
+    if not items:
+        raise ContentError("items: 一つもない")
+
+    return {"skills": skills, "party": compiled_party, "enemies": enemies, "images": images,
+            "dungeons": dungeons, "items": items}
+
+
+# ---------------- パック ----------------
+
+class ContentPack:
+    """確かめ済みのパック。new_* は呼ぶたびに新しいオブジェクトを作る"""
+
+    def __init__(self, compiled: dict, source: str = "", digest: str = "", cached: bool = False):
+        self.source = source
+        self.digest = digest
+        self.cached = cached   # キャッシュから読んだか
+        self._c = compiled
+        # Skill は書き換えられないのでパックで一つずつ持って使い回す
+        self.skills: Dict[str, Skill] = {sid: Skill(*args) for sid, args in compiled["skills"].items()}
+
+    @property
+    def dungeons(self) -> List[str]:
+        return list(self._c["dungeons"])
+
+    def new_party(self) -> Party:
+        name, allies, hp, dp = self._c["party"]
+        return Party(name, [Ally(n, e, h, mh, ap, adp, self.skills.get(sid))
+                            for n, e, h, mh, ap, adp, sid in allies],
+                     hp=hp, max_hp=hp, dp=dp)
+
+    @property
+    def enemy_images(self) -> Dict[str, str]:
+        """敵の名前 → assets/monsters/ の画像ファイル名"""
+        return dict(self._c["images"])
+
+    def new_enemies(self, dungeon: str = "default") -> List[Enemy]:
+        table = self._c["enemies"]
+        return [Enemy(*table[name]) for name in self._c["dungeons"][dungeon]]
+
+    def new_items(self) -> dict:
+        """GUI とエンジンが使う 番号(1..)→値 の dict の形"""
+        out = {"name": {}, "type": {}, "max_hold": {}, "value": {}}
+        for no, (name, kind, hold, value) in enumerate(self._c["items"], start=1):
+            out["name"][no] = name
+            out["type"][no] = kind
+            out["max_hold"][no] = hold
+            out["value"][no] = value
+        return out
+
+
+def _cache_path(digest: str, cache_dir: str) -> str:
+    return os.path.join(cache_dir, f"{digest}.pickle")
+
+
+def load_pack(path: Optional[str] = None, cache_dir: Optional[str] = CACHE_DIR) -> ContentPack:
+    """パックを読む。cache_dir=None ならキャッシュを使わない"""
+    path = path or DEFAULT_PACK
+    with open(path, "rb") as f:
+        raw = f.read()
+    digest = hashlib.sha256(raw + f":{SCHEMA_VERSION}".encode()).hexdigest()[:32]
+
+    if cache_dir is not None:
+        try:
+            with open(_cache_path(digest, cache_dir), "rb") as f:
+                return ContentPack(pickle.load(f), path, digest, cached=True)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            pass
+
+    try:
+        data = json.loads(raw.decode("utf-8"))
+    except ValueError as e:
+        raise ContentError(f"{path}: JSON として読めない（{e}）") from e
+    compiled = validate(data)
+
+    if cache_dir is not None:
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp = _cache_path(digest, cache_dir) + f".{os.getpid()}.tmp"
+            with open(tmp, "wb") as f:
+                pickle.dump(compiled, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, _cache_path(digest, cache_dir))
+        except OSError:
+            # 書けない場所でも遊べるようにする（次も JSON から読むだけ）
+            pass
+    return ContentPack(compiled, path, digest)
+
+
+_PACKS: Dict[str, ContentPack] = {}
+
+
+def pack_path(path: Optional[str] = None) -> str:
+    """使うパックのパス（path、無ければ PAZMON_CONTENT、それも無ければ既定のパック）"""
+    return path or os.environ.get("PAZMON_CONTENT") or DEFAULT_PACK
+
+
+def default_pack() -> ContentPack:
+    """プロセスで一度だけ読むパック（PAZMON_CONTENT があればそれ）"""
+    path = pack_path()
+    pack = _PACKS.get(path)
+    if pack is None:
+        pack = _PACKS[path] = load_pack(path)
+    return pack
+
+
+def check(path: Optional[str] = None, turns: int = 300, seed: int = 0) -> int:
+    """パックの味方を一人ずつスキル無しにして戦わせ、落ちないかを確かめる
+
+    スキル無しの味方に SP がたまったり、スキルが発動したりした数を返す。
+    """
+    # エンジンはこのモジュールを読むので、ここで読む
+    import random
+    import pazmon_engine as engine
+
+    with open(path or DEFAULT_PACK, "rb") as f:
+        data = json.loads(f.read().decode("utf-8"))
+    bad = 0
+    for k in range(len(data["party"]["allies"])):
+        variant = json.loads(json.dumps(data))
+        variant["party"]["allies"][k].pop("skill", None)
+        pack = ContentPack(validate(variant), f"<allies[{k}] にスキル無し>")
+        rng = random.Random(seed * 1000 + k)
+        state = engine.new_battle(rng, snapshots=False, pack=pack)
+        n = len(state.field)
+        skipped = sum(k in c for c in state.rules.chargers)
+        used = 0
+        while not state.finished and state.turns < turns:
+            for i in range(len(state.party.allies)):
+                for ev in engine.use_skill(state, i):
+                    used += ev["type"] == "skill" and ev["ally"] == k
+            if state.finished:
+                break
+            src, dst = rng.randrange(n), rng.randrange(n - 1)
+            engine.play_turn(state, src, dst + (dst >= src))
+        sp = state.party.allies[k].sp
+        ok = not skipped and not used and not sp
+        bad += not ok
+        print(f"allies[{k}] ({state.party.allies[k].name}): {state.turns} turns, "
+              f"sp {sp}, skill {used}{'' if ok else ' ずれ'}")
+    return bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description="コンテンツパックの確認とキャッシュ作成")
+    parser.add_argument("path", nargs="?", default=DEFAULT_PACK)
+    parser.add_argument("--no-cache", action="store_true", help="キャッシュを読み書きしない")
+    parser.add_argument("--check", action="store_true", help="味方をスキル無しにして戦えるか確かめる")
+    args = parser.parse_args()
+    if args.check:
+        sys.exit(1 if check(args.path) else 0)
+    t = time.perf_counter()
+    pack = load_pack(args.path, None if args.no_cache else CACHE_DIR)
+    dt = time.perf_counter() - t
+    party = pack.new_party()
+    print(f"{args.path}: ok ({'cache' if pack.cached else 'json'}, {dt * 1000:.2f} ms)")
+    print(f"  party  : {', '.join(a.name for a in party.allies)}")
+    for d in pack.dungeons:
+        print(f"  dungeon {d}: {', '.join(en.name for en in pack.new_enemies(d))}")
+    print(f"  items  : {', '.join(pack.new_items()['name'].values())}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,886 @@
+"""Puzzle & Monsters の戦闘エンジン（pygame を使わない）
+
+盤面の消去・左詰め・補充、ダメージ計算、スキル、状態異常、アイテムを
+BattleState に対する関数として持つ。GUI（pazmonfree.py）もシミュレータも
+ここを呼び、返ってくるイベントの列を見て描画や集計をする。
+"""
+import random
+from bisect import bisect_right
+from typing import Iterable, List, Optional, Tuple
+
+import pazmon_content as content
+from pazmon_entities import Ally, Enemy, Party, Skill, StatusEffect
+
+GEMS = ["火", "水", "風", "土", "命"]
+EMPTY = "無"
+SLOT_COUNT = 14
+# これ以上のスロット数の盤面では RunTracker で差分だけ調べ直す
+# （CPython では区間の付け替えの手間が効いて、小さい盤面は毎回全部見た方が速い）
+TRACK_MIN_SLOTS = 192
+# 倍率の指数の上限（大きい盤面の大連鎖で float があふれないように）
+MAX_COMBO_EXP = 1000
+
+# 属性の相性（キーがバリューに強い）
+ELEMENT_CYCLE = {"火": "風", "風": "土", "土": "水", "水": "火"}
+
+
+# ---------------- 盤面ロジック ----------------
+
+def init_field(rng=random, n: int = SLOT_COUNT, gems: List[str] = GEMS) -> List[str]:
+    return [rng.choice(gems) for _ in range(n)]
+
+
+def death_field(n: int = SLOT_COUNT) -> List[str]:
+    return [EMPTY for _ in range(n)]
+
+
+def leftmost_run(field: List[str], gems: List[str] = GEMS) -> Optional[Tuple[int, int]]:
+    n = len(field)
+    i = 0
+    while i < n:
+        j = i+1
+        while j < n and field[j] == field[i]:
+            j += 1
+        L = j-i
+        if L >= 3 and field[i] in gems:
+            return (i, L)
+        i = j
+    return None
+
+
+def collapse_left(field: List[str], start: int, length: int):
+    # 消滅部分を '無' にしてから左詰め（簡略：一気に詰める）
+    for k in range(start, start+length):
+        field[k] = EMPTY
+    rest = [e for e in field if e != EMPTY]
+    field[:] = rest + [EMPTY]*length
+
+
+def fill_random(field: List[str], rng=random, gems: List[str] = GEMS):
+    for i, e in enumerate(field):
+        if e == EMPTY:
+            field[i] = rng.choice(gems)
+
+
+def drag_path(src: int, dst: int) -> List[Tuple[int, int]]:
+    """src から dst へ一つずつ隣と入れ替えていく時の (k, k+step) の列"""
+    if src == dst:
+        return []
+    step = 1 if dst > src else -1
+    return [(k, k + step) for k in range(src, dst, step)]
+
+
+class RunTracker:
+    """盤面を「同じ宝石が続く区間」の列として覚えておき、変わった所だけ調べ直す
+
+    swap / collapse / fill は field（共有のリスト）を書き換えたうえで、
+    変わったスロットの前後の区間だけを走査し直し、そこで新しく 3 つ以上に
+    なった並び (start, length) のリストを返す。leftmost() は
+    leftmost_run(field) と同じ結果になる。
+    """
+
+    def __init__(self, field: List[str], gems: List[str] = GEMS):
+        self.field = field
+        self.gems = gems
+        self.starts: List[int] = []
+        self.lengths: List[int] = []
+        self.active = {}   # 3 つ以上続いている宝石の区間 start -> length
+        self.scanned = 0   # 調べたスロットの延べ数（全体走査との比較用）
+        self._scan_into(0, len(field), self.starts, self.lengths)
+        for s, L in zip(self.starts, self.lengths):
+            if L >= 3 and field[s] in gems:
+                self.active[s] = L
+
+    def _scan_into(self, lo: int, hi: int, starts: List[int], lengths: List[int]):
+        field = self.field
+        self.scanned += hi - lo
+        i = lo
+        while i < hi:
+            j = i + 1
+            while j < hi and field[j] == field[i]:
+                j += 1
+            starts.append(i)
+            lengths.append(j - i)
+            i = j
+
+    def changed(self, lo: int, hi: int) -> List[Tuple[int, int]]:
+        """field のスロット lo..hi を直接書き換えた後、それに触れる区間（両隣を含む）だけ作り直す"""
+        field = self.field
+        starts, lengths, active = self.starts, self.lengths, self.active
+        a = bisect_right(starts, lo - 1 if lo > 0 else 0) - 1
+        b = bisect_right(starts, hi + 1 if hi + 1 < len(field) else hi) - 1
+        lo = starts[a]
+        hi = starts[b] + lengths[b]
+        old = {}
+        for k in range(a, b + 1):
+            if lengths[k] >= 3:
+                old[starts[k]] = lengths[k]
+                active.pop(starts[k], None)
+
+        new_starts, new_lengths, became = [], [], []
+        gems = self.gems
+        self.scanned += hi - lo
+        i = lo
+        while i < hi:
+            e = field[i]
+            j = i + 1
+            while j < hi and field[j] == e:
+                j += 1
+            new_starts.append(i)
+            new_lengths.append(j - i)
+            if j - i >= 3 and e in gems:
+                active[i] = j - i
+                if old.get(i) != j - i:
+                    became.append((i, j - i))
+            i = j
+        starts[a:b+1] = new_starts
+        lengths[a:b+1] = new_lengths
+        return became
+
+    def leftmost(self) -> Optional[Tuple[int, int]]:
+        if not self.active:
+            return None
+        s = min(self.active)
+        return (s, self.active[s])
+
+    def swap(self, i: int, j: int) -> List[Tuple[int, int]]:
+        field = self.field
+        if field[i] == field[j]:
+            return []
+        field[i], field[j] = field[j], field[i]
+        return self.changed(min(i, j), max(i, j))
+
+    def collapse(self, start: int, length: int) -> List[Tuple[int, int]]:
+        """collapse_left と同じ（盤面に元から空きが無いことを前提にする）"""
+        collapse_left(self.field, start, length)
+        n = len(self.field)
+        end = start + length
+        starts, lengths = [], []
+        active = {}
+        for s, L in zip(self.starts, self.lengths):
+            e = s + L
+            if e <= start:
+                starts.append(s)
+                lengths.append(L)
+            elif s >= end:
+                # 消えた分だけ左にずれる（中身は変わらない）
+                starts.append(s - length)
+                lengths.append(L)
+            else:
+                if s < start:
+                    starts.append(s)
+                    lengths.append(start - s)
+                if e > end:
+                    starts.append(start)
+                    lengths.append(e - end)
+        starts.append(n - length)
+        lengths.append(length)
+        for s, L in self.active.items():
+            if s + L <= start:
+                active[s] = L
+            elif s >= end:
+                active[s - length] = L
+        self.starts, self.lengths, self.active = starts, lengths, active
+        # つなぎ目（start の前後）で同じ宝石がくっつくかもしれない
+        return self.changed(start, start) if 0 < start < n - length else []
+
+    def fill(self, rng=random) -> List[Tuple[int, int]]:
+        """fill_random と同じ乱数の使い方で空きを埋める"""
+        holes = [(s, s + L - 1) for s, L in zip(self.starts, self.lengths)
+                 if self.field[s] == EMPTY]
+        fill_random(self.field, rng, self.gems)
+        became = []
+        for lo, hi in holes:
+            became.extend(self.changed(lo, hi))
+        return sorted(became)
+
+
+class _FullScan:
+    """RunTracker と同じ呼び方で、毎回盤面を頭から見る（小さい盤面用）"""
+
+    def __init__(self, field: List[str], gems: List[str] = GEMS):
+        self.field = field
+        self.gems = gems
+
+    def changed(self, lo: int, hi: int) -> List[Tuple[int, int]]:
+        return []
+
+    def leftmost(self) -> Optional[Tuple[int, int]]:
+        return leftmost_run(self.field, self.gems)
+
+    def swap(self, i: int, j: int) -> List[Tuple[int, int]]:
+        field = self.field
+        field[i], field[j] = field[j], field[i]
+        return []
+
+    def collapse(self, start: int, length: int) -> List[Tuple[int, int]]:
+        collapse_left(self.field, start, length)
+        return []
+
+    def fill(self, rng=random) -> List[Tuple[int, int]]:
+        fill_random(self.field, rng, self.gems)
+        return []
+
+
+def run_tracker(field: List[str], gems: List[str] = GEMS):
+    """盤面の大きさに合った並びの検出器"""
+    if len(field) >= TRACK_MIN_SLOTS:
+        return RunTracker(field, gems)
+    return _FullScan(field, gems)
+
+
+# ---------------- 盤面の形 ----------------
+
+def slot_label(i: int) -> str:
+    """A..Z, AA, AB, ... （0 始まり）"""
+    s = ""
+    i += 1
+    while i:
+        i, r = divmod(i - 1, 26)
+        s = chr(ord('A') + r) + s
+    return s
+
+
+class Grid:
+    """盤面の形（スロットは左上から行ごとに 0, 1, 2, ...）
+
+    h == 1 は今までの横一列：一番左の並びから一つずつ消して左に詰める。
+    h > 1 は W×H の盤面：縦横の並びを一度の走査で全部見つけ、隣り合う同じ宝石の
+    並びは union-find で一つにまとめて（一つで 1 コンボ）同時に消し、列ごとに下へ詰める。
+    """
+    __slots__ = ("w", "h", "size")
+
+    def __init__(self, w: int = SLOT_COUNT, h: int = 1):
+        if w < 1 or h < 1:
+            raise ValueError(f"盤面の大きさがおかしい（{w}x{h}）")
+        self.w = w
+        self.h = h
+        self.size = w * h
+
+    @classmethod
+    def parse(cls, text: str) -> "Grid":
+        """"14" や "6x5" から作る"""
+        w, _, h = text.lower().partition("x")
+        return cls(int(w), int(h) if h else 1)
+
+    @property
+    def linear(self) -> bool:
+        return self.h == 1
+
+    def __eq__(self, other):
+        return isinstance(other, Grid) and (self.w, self.h) == (other.w, other.h)
+
+    def __hash__(self):
+        return hash((self.w, self.h))
+
+    def __repr__(self):
+        return f"Grid({self.w}, {self.h})"
+
+    def xy(self, i: int) -> Tuple[int, int]:
+        return i % self.w, i // self.w
+
+    def index(self, x: int, y: int) -> int:
+        return y * self.w + x
+
+    def label(self, i: int) -> str:
+        if self.linear:
+            return slot_label(i)
+        x, y = self.xy(i)
+        return f"{slot_label(x)}{y + 1}"
+
+    def adjacent(self, a: int, b: int) -> bool:
+        (ax, ay), (bx, by) = self.xy(a), self.xy(b)
+        return abs(ax - bx) + abs(ay - by) == 1
+
+    def drag_path(self, src: int, dst: int) -> List[Tuple[int, int]]:
+        """src の宝石を dst まで運ぶ時の入れ替えの列（横に動いてから縦に動く）"""
+        if self.linear:
+            return drag_path(src, dst)
+        w = self.w
+        (sx, sy), (dx, dy) = self.xy(src), self.xy(dst)
+        path = []
+        step = 1 if dx > sx else -1
+        for x in range(sx, dx, step):
+            path.append((sy * w + x, sy * w + x + step))
+        step = 1 if dy > sy else -1
+        for y in range(sy, dy, step):
+            path.append((y * w + dx, (y + step) * w + dx))
+        return path
+
+    def matches(self, field: List[str], gems: List[str] = GEMS,
+                changed: Optional[List[int]] = None) -> List[Tuple[str, List[int]]]:
+        """今消える宝石のまとまり [(宝石, スロットの昇順リスト)] を左上から順に
+
+        縦横の 3 つ組で同じ宝石のものを集めて印を付け、印の付いたスロットだけを
+        右と下の隣とつなぐ（union-find）。手間は盤面の大きさにほぼ比例する。
+        changed に gravity() の戻り値を渡すと、動いたスロットを含む 3 つ組だけを見る
+        （動いていない 3 つ組は前の回に消えているはずなので）。
+        """
+        w, h, n = self.w, self.h, self.size
+        f = field
+        if changed is None or 4 * (sum(changed) + w) > n:
+            hs = [i for i in range(n - 2) if f[i] == f[i+1] == f[i+2] and i % w < w - 2] if w >= 3 else []
+            vs = [i for i in range(n - 2*w) if f[i] == f[i+w] == f[i+2*w]]
+        else:
+            hs, vs = set(), []
+            for x, low in enumerate(changed):
+                if low < 0:
+                    continue
+                for i in range(x, min(low, h - 3) * w + x + 1, w):
+                    if f[i] == f[i+w] == f[i+2*w]:
+                        vs.append(i)
+                lo, hi = max(0, x - 2), min(x, w - 3)
+                for row in range(0, (low + 1) * w, w):
+                    for i in range(row + lo, row + hi + 1):
+                        if f[i] == f[i+1] == f[i+2]:
+                            hs.add(i)
+
+        marked = set()
+        for i in hs:
+            marked.update((i, i + 1, i + 2))
+        for i in vs:
+            marked.update((i, i + w, i + 2*w))
+        cells = sorted(i for i in marked if f[i] in gems)
+        if not cells:
+            return []
+
+        parent = {i: i for i in cells}
+
+        def find(a: int) -> int:
+            while parent[a] != a:
+                parent[a] = parent[parent[a]]
+                a = parent[a]
+            return a
+
+        for i in cells:
+            e = f[i]
+            for j in (i + 1, i + w):
+                if j in parent and f[j] == e and (j == i + w or j % w):
+                    ra, rb = find(i), find(j)
+                    if ra != rb:
+                        parent[max(ra, rb)] = min(ra, rb)
+
+        groups = {}
+        for i in cells:
+            groups.setdefault(find(i), []).append(i)
+        # 根はまとまりの中で一番小さいスロットなので、根の順に並べれば左上から
+        return [(f[root], groups[root]) for root in sorted(groups)]
+
+    def gravity(self, field: List[str], cols: Optional[Iterable[int]] = None) -> List[int]:
+        """空きを列ごとに上へ集め、宝石を下に詰める（cols を渡すとその列だけ）
+
+        列ごとに中身が変わった一番下の行（変わらなければ -1）を返す。
+        上に集めた空きも変わった内に入れるので、fill() の後もそのまま
+        matches(changed=...) に使える。
+        """
+        w, h = self.w, self.h
+        changed = [-1] * w
+        for x in (range(w) if cols is None else cols):
+            col = field[x::w]
+            kept = [e for e in col if e != EMPTY]
+            if len(kept) != h:
+                col_new = [EMPTY] * (h - len(kept)) + kept
+                field[x::w] = col_new
+                y = h - 1
+                while col[y] == col_new[y] != EMPTY:
+                    y -= 1
+                changed[x] = y
+        return changed
+
+    def fill(self, field: List[str], changed: List[int], rng=random, gems: List[str] = GEMS):
+        """gravity() の後の空きを埋める（fill_random と同じ順に乱数を引くので結果も同じ）"""
+        w = self.w
+        empties = [i for x, low in enumerate(changed) if low >= 0
+                   for i in range(x, low * w + x + 1, w) if field[i] == EMPTY]
+        empties.sort()
+        for i in empties:
+            field[i] = rng.choice(gems)
+
+
+# ---------------- ダメージ/回復 ----------------
+
+def jitter(v: float, r: float = 0.10, rng=random) -> int:
+    return max(1, int(v*rng.uniform(1-r, 1+r)))
+
+
+def _attr(att, defe, cycle=ELEMENT_CYCLE) -> float:
+    if att in cycle and cycle[att] == defe:
+        return 2.0
+    if defe in cycle and cycle[defe] == att:
+        return 0.5
+    return 1.0
+
+
+def attr_coeff(att, defe):
+    return _ATTR_TABLE.get((att, defe), 1.0)
+
+
+def party_attack_from_gems(elem: str, run_len: int, combo: int, party: dict, monster: dict, rng=random) -> int:
+    """任意のパーティ dict 用（戦闘中は BattleState.rules の attack を使う）"""
+    combo_coeff = DEFAULT_RULES.combo_coeff((run_len - 3) + combo)
+
+    if elem == "命":
+        heal = jitter(20*combo_coeff, rng=rng)
+        party["hp"] = min(party["max_hp"], party["hp"]+heal)
+        return 0
+
+    ally = next(
+        (a for a in party["allies"] if a["element"] == elem), None)
+
+    if not ally:
+        return 0
+
+    base = max(1, ally["ap"]-monster["dp"])
+    dmg = jitter(
+        base*attr_coeff(elem, monster["element"])*combo_coeff, rng=rng)
+    monster["hp"] = max(0, monster["hp"]-dmg)
+
+    return dmg
+
+
+def gem_heal(run_len: int, combo: int, rng=random) -> int:
+    """盤面で命の宝石を消した時の回復量"""
+    return DEFAULT_RULES.heal(run_len, combo, rng)
+
+
+def enemy_attack(party: Party, monster: Enemy, rng=random) -> int:
+    base = max(1, monster.ap-party.dp)
+    dmg = jitter(base, rng=rng)
+    party.hp = max(0, party.hp-dmg)
+    return dmg
+
+
+# ---------------- ルール表 ----------------
+
+class Ruleset:
+    """属性の相性・コンボ倍率・属性→味方の対応を一度だけ表にしたもの
+
+    宝石は GEMS の並び順のコード（0..4）で引く。一手ごとに dict を作ったり
+    味方を探したりしないよう、戦闘が始まる時に BattleState が一つ作る。
+    party / enemies を省くと相性と倍率の表だけを持つ。
+    """
+
+    def __init__(self, party: Optional[Party] = None, enemies: Optional[List[Enemy]] = None,
+                 gems: List[str] = GEMS, cycle: dict = ELEMENT_CYCLE,
+                 combo_base: float = 1.5, heal_amount: float = 22.5, heal_base: float = 1.4,
+                 life: str = "命", max_exp: int = 64):
+        self.gems = list(gems)
+        self.code = {g: i for i, g in enumerate(self.gems)}
+        self.life = self.code.get(life, -1)
+        # attr[攻撃側][防御側]
+        self.attr = [[_attr(a, d, cycle) for d in self.gems] for a in self.gems]
+        self.combo_base = combo_base
+        self.heal_amount = heal_amount
+        self.heal_base = heal_base
+        # 指数 (run_len-3)+combo ごとの倍率
+        self.combo_table = [combo_base ** k for k in range(max_exp + 1)]
+        self.heal_table = [heal_amount * (heal_base ** k) for k in range(max_exp + 1)]
+
+        # 宝石コード → 攻撃する味方（最初の一人）と SP がたまる味方の番号
+        self.attacker = [-1] * len(self.gems)
+        self.chargers: List[Tuple[int, ...]] = [()] * len(self.gems)
+        if party is not None:
+            for i, ally in enumerate(party.allies):
+                c = self.code.get(ally.element)
+                if c is None:
+                    continue
+                if self.attacker[c] < 0:
+                    self.attacker[c] = i
+                # スキルのない味方には SP をためない
+                if ally.skill is not None:
+                    self.chargers[c] = self.chargers[c] + (i,)
+        # 敵の番号 → 属性コード
+        self.enemy_codes = [self.code.get(en.element, -1) for en in (enemies or [])]
+
+    def combo_coeff(self, k: int) -> float:
+        return self.combo_table[k] if 0 <= k < len(self.combo_table) else self.combo_base ** min(k, MAX_COMBO_EXP)
+
+    def heal_value(self, run_len: int, combo: int) -> float:
+        k = (run_len - 3) + combo
+        if 0 <= k < len(self.heal_table):
+            return self.heal_table[k]
+        return self.heal_amount * (self.heal_base ** min(k, MAX_COMBO_EXP))
+
+    def heal(self, run_len: int, combo: int, rng=random) -> int:
+        return jitter(self.heal_value(run_len, combo), rng=rng)
+
+    def attack_value(self, code: int, run_len: int, combo: int, party: Party, monster: Enemy,
+                     enemy_code: Optional[int] = None) -> float:
+        """ぶれを入れる前のダメージ（味方がいなければ 0）"""
+        i = self.attacker[code]
+        if i < 0:
+            return 0.0
+        if enemy_code is None:
+            enemy_code = self.code.get(monster.element, -1)
+        mult = self.attr[code][enemy_code] if enemy_code >= 0 else 1.0
+        base = max(1, party.allies[i].ap-monster.dp)
+        return base*mult*self.combo_coeff((run_len - 3) + combo)
+
+    def attack(self, code: int, run_len: int, combo: int, party: Party, monster: Enemy,
+               rng=random, enemy_code: Optional[int] = None) -> int:
+        """party_attack_from_gems と同じ計算（乱数の使い方も同じ）"""
+        if self.attacker[code] < 0:
+            return 0
+        dmg = jitter(self.attack_value(code, run_len, combo, party, monster, enemy_code), rng=rng)
+        monster.hp = max(0, monster.hp-dmg)
+        return dmg
+
+    def charge(self, party: Party, code: int, amount: int):
+        """その属性の味方に SP をためる"""
+        allies = party.allies
+        for i in self.chargers[code]:
+            ally = allies[i]
+            ally.sp = min(ally.sp + amount, ally.skill.need_sp)
+
+
+DEFAULT_RULES = Ruleset()
+_ATTR_TABLE = {(a, d): _attr(a, d) for a in ELEMENT_CYCLE for d in ELEMENT_CYCLE}
+
+
+# ---------------- 既定のデータ ----------------
+# 中身は content/default.json（pazmon_content）。呼ぶたびに新しいオブジェクトを作る
+# （一回の攻略ごとに書き換えられるため）
+
+def new_items() -> dict:
+    return content.default_pack().new_items()
+
+
+def new_party() -> Party:
+    return content.default_pack().new_party()
+
+
+def new_enemies(dungeon: str = "default") -> List[Enemy]:
+    return content.default_pack().new_enemies(dungeon)
+
+
+def enemy_images() -> dict:
+    return content.default_pack().enemy_images
+
+
+def new_battle(rng=None, snapshots: bool = True, pack: Optional[content.ContentPack] = None,
+               dungeon: str = "default", grid: Optional[Grid] = None) -> "BattleState":
+    """パック（省略時は既定のパック）のパーティと敵の列で新しい攻略を始める"""
+    rng = rng if rng is not None else random
+    pack = pack if pack is not None else content.default_pack()
+    return BattleState(pack.new_party(), pack.new_enemies(dungeon), pack.new_items(),
+                       rng=rng, snapshots=snapshots, grid=grid)
+
+
+# ---------------- 戦闘の状態 ----------------
+
+class BattleState:
+    """一回のダンジョン攻略の状態（盤面・パーティ・敵の列・アイテム）"""
+
+    def __init__(self, party: Party, enemies: List[Enemy], items: Optional[dict] = None,
+                 field: Optional[List[str]] = None, rng=None, snapshots: bool = True,
+                 grid: Optional[Grid] = None):
+        self.rng = rng if rng is not None else random
+        # False にするとイベントに盤面や HP を写さない（シミュレーション用に軽くする）
+        self.snapshots = snapshots
+        # 古い dict 形式で渡されたらクラスに置き換える
+        self.party = Party.coerce(party)
+        self.enemies = [Enemy.coerce(en) for en in enemies]
+        self.items = items
+        self.enemy_idx = 0
+        # 盤面の形（省略時は渡された盤面の長さ、それも無ければ 14 スロットの横一列）
+        if grid is None:
+            grid = Grid(len(field)) if field is not None else Grid()
+        elif field is not None and len(field) != grid.size:
+            raise ValueError(f"盤面が {len(field)} スロットで、{grid.w}x{grid.h} と合わない")
+        self.grid = grid
+        self.field = field if field is not None else init_field(self.rng, grid.size)
+        self.guard = False   # お守り：次の敵の攻撃を防ぐ
+        self.power = False   # 力の粉：次の攻撃を強化
+        self.cleared = False
+        self.turns = 0
+        self._tracker = None
+        self.rules = Ruleset(self.party, self.enemies)
+
+    @property
+    def enemy(self) -> Enemy:
+        return self.enemies[min(self.enemy_idx, len(self.enemies)-1)]
+
+    @property
+    def wiped(self) -> bool:
+        return self.party.hp <= 0
+
+    @property
+    def finished(self) -> bool:
+        return self.cleared or self.wiped
+
+    def clone(self, rng=None) -> "BattleState":
+        """探索用の写し（盤面・パーティ・敵・アイテムを写し、Ruleset と盤面の形は使い回す）
+
+        イベントに写しを付けない（snapshots=False）。rng を省くと同じ乱数を使う。
+        """
+        st = BattleState.__new__(BattleState)
+        st.rng = rng if rng is not None else self.rng
+        st.snapshots = False
+        st.party = self.party.snapshot()
+        st.enemies = [en.snapshot() for en in self.enemies]
+        st.items = {k: dict(v) for k, v in self.items.items()} if self.items else self.items
+        st.enemy_idx = self.enemy_idx
+        st.grid = self.grid
+        st.field = list(self.field)
+        st.guard = self.guard
+        st.power = self.power
+        st.cleared = self.cleared
+        st.turns = self.turns
+        st._tracker = None
+        st.rules = self.rules
+        return st
+
+    @property
+    def tracker(self):
+        """盤面の並びの検出器（ターンをまたいで使い回し、盤面が差し替わったら作り直す）
+
+        同じリストのまま中身を書き換えると検出器が古くなる。ターンの外で宝石を
+        動かす時（GUI のドラッグ中など）は swap() を使う。
+        """
+        t = self._tracker
+        if t is None or t.field is not self.field:
+            t = self._tracker = run_tracker(self.field)
+        return t
+
+    def swap(self, i: int, j: int):
+        """スロット i と j の宝石を入れ替え、並びの検出器にも知らせる"""
+        self.tracker.swap(i, j)
+
+
+def _event(state: BattleState, kind: str, message: str, **extra) -> dict:
+    """その時点の盤面と HP/SP を写したイベント（GUI はこれを見てコマを作る）"""
+    if not state.snapshots:
+        extra["type"] = kind
+        extra["message"] = message
+        return extra
+    ev = {
+        "type": kind,
+        "message": message,
+        "field": list(state.field),
+        "enemy_idx": state.enemy_idx,
+        "enemy_hp": state.enemy.hp,
+        "party_hp": state.party.hp,
+        "sp": tuple(a.sp for a in state.party.allies),
+    }
+    ev.update(extra)
+    return ev
+
+
+def next_enemy(state: BattleState) -> List[dict]:
+    """敵を倒した後、次の敵へ進む（最後ならダンジョン制覇）"""
+    state.enemy_idx += 1
+    if state.enemy_idx < len(state.enemies):
+        state.field = init_field(state.rng, state.grid.size)
+        return [_event(state, "next_enemy", f"さらに奥へ… 次は {state.enemy.name}")]
+    state.cleared = True
+    return [_event(state, "dungeon_clear", "ダンジョン制覇！おめでとう！（ESCで終了）")]
+
+
+def apply_move(state: BattleState, src: int, dst: int) -> List[dict]:
+    """宝石を src から dst へドラッグし、連鎖が止まるまで消して補充する"""
+    if not state.grid.linear:
+        return _apply_grid_move(state, src, dst)
+    events = []
+    field = state.field
+    party = state.party
+    enemy = state.enemy
+    rng = state.rng
+    rules = state.rules
+    enemy_code = rules.enemy_codes[min(state.enemy_idx, len(rules.enemy_codes)-1)]
+
+    # 大きい盤面では並びの区間を覚えておき、入れ替えや左詰めの後は変わった所だけ調べ直す
+    tracker = state.tracker
+    for k, nxt in drag_path(src, dst):
+        field[k], field[nxt] = field[nxt], field[k]
+        events.append(_event(state, "swap", f"{slot_label(k)}↔{slot_label(nxt)} を交換", slots=(k, nxt)))
+    if src != dst:
+        # ドラッグで変わるのは src..dst の間だけ
+        tracker.changed(min(src, dst), max(src, dst))
+
+    # 評価ループ
+    combo = 0
+    while True:
+        run = tracker.leftmost()
+        if not run:
+            break
+        start, L = run
+        combo += 1
+        elem = field[start]
+        code = rules.code[elem]
+        if code == rules.life:
+            heal = rules.heal(L, combo, rng)
+            party.hp = min(party.max_hp, party.hp+heal)
+            events.append(_event(state, "heal", f"HP +{heal}",
+                                 elem=elem, run=run, combo=combo, heal=heal))
+        else:
+            dmg = rules.attack(code, L, combo, party, enemy, rng, enemy_code)
+            if state.power:
+                dmg = dmg * 1.5
+                state.power = False
+            # 攻撃した味方の属性について、宝石を消した分だけその属性のspをためる
+            rules.charge(party, code, L)
+            events.append(_event(state, "attack", f"{elem}攻撃！ {dmg} ダメージ",
+                                 elem=elem, run=run, combo=combo, dmg=dmg,
+                                 killed=enemy.hp <= 0))
+
+        tracker.collapse(start, L)
+        events.append(_event(state, "collapse", "消滅！"))
+        tracker.fill(rng)
+        events.append(_event(state, "refill", "湧き！"))
+        if enemy.hp <= 0:
+            events.append(_event(state, "defeat", f"{enemy.name} を倒した！", source="gems"))
+            events.extend(next_enemy(state))
+            break
+
+    state.turns += 1
+    return events
+
+
+def _apply_grid_move(state: BattleState, src: int, dst: int) -> List[dict]:
+    """W×H の盤面の apply_move：消えるまとまりを一度に全部消し、列ごとに下へ詰めて補充する
+
+    まとまり一つが 1 コンボ（長さはまとまりの宝石の数）で、ダメージ・回復・SP は
+    横一列と同じ Ruleset で計算する。
+    """
+    events = []
+    grid = state.grid
+    field = state.field
+    party = state.party
+    enemy = state.enemy
+    rng = state.rng
+    rules = state.rules
+    enemy_code = rules.enemy_codes[min(state.enemy_idx, len(rules.enemy_codes)-1)]
+
+    for k, nxt in grid.drag_path(src, dst):
+        field[k], field[nxt] = field[nxt], field[k]
+        events.append(_event(state, "swap", f"{grid.label(k)}↔{grid.label(nxt)} を交換", slots=(k, nxt)))
+
+    combo = 0
+    changed = None   # 最初は全部、連鎖の 2 回目からは落ちてきた所だけ見る
+    while True:
+        groups = grid.matches(field, rules.gems, changed)
+        if not groups:
+            break
+        cols = set()
+        for elem, cells in groups:
+            combo += 1
+            L = len(cells)
+            run = (cells[0], L)
+            code = rules.code[elem]
+            if code == rules.life:
+                heal = rules.heal(L, combo, rng)
+                party.hp = min(party.max_hp, party.hp+heal)
+                events.append(_event(state, "heal", f"HP +{heal}",
+                                     elem=elem, run=run, cells=cells, combo=combo, heal=heal))
+            else:
+                dmg = rules.attack(code, L, combo, party, enemy, rng, enemy_code)
+                if state.power:
+                    dmg = dmg * 1.5
+                    state.power = False
+                rules.charge(party, code, L)
+                events.append(_event(state, "attack", f"{elem}攻撃！ {dmg} ダメージ",
+                                     elem=elem, run=run, cells=cells, combo=combo, dmg=dmg,
+                                     killed=enemy.hp <= 0))
+            for i in cells:
+                field[i] = EMPTY
+                cols.add(i % grid.w)
+
+        changed = grid.gravity(field, sorted(cols))
+        events.append(_event(state, "collapse", "消滅！"))
+        grid.fill(field, changed, rng, rules.gems)
+        events.append(_event(state, "refill", "湧き！"))
+        if enemy.hp <= 0:
+            events.append(_event(state, "defeat", f"{enemy.name} を倒した！", source="gems"))
+            events.extend(next_enemy(state))
+            break
+
+    state.turns += 1
+    return events
+
+
+def enemy_turn(state: BattleState) -> List[dict]:
+    """敵の行動と状態異常のターン経過"""
+    party = state.party
+    enemy = state.enemy
+    status = enemy.status
+
+    # 行動パターン決定
+    act_type = "normal"
+    if status.type == "atk_down":
+        act_type = "atk_down"
+    if status.type == "stun":
+        act_type = "stun"
+
+    edmg = 0
+    if act_type == "normal":
+        if not state.guard:
+            edmg = enemy_attack(party, enemy, state.rng)
+            message = f"{enemy.name}の攻撃！ -{edmg}"
+        else:
+            message = "お守りの効果でガードした！"
+            state.guard = False
+    elif act_type == "atk_down":
+        base_dmg = enemy_attack(party, enemy, state.rng)
+        edmg = int(base_dmg*status.val)
+        party.hp += base_dmg - edmg
+        message = f"{enemy.name}の攻撃(弱)！ -{edmg}(残り{status.turn}ターン)"
+    else:
+        message = f"{enemy.name}は動けない！残り{status.turn}ターン"
+    events = [_event(state, "enemy_attack", message, act=act_type, dmg=edmg)]
+
+    # ターン処理
+    if status.turn is not None and status.turn > 0:
+        status.turn -= 1
+        if status.turn == 0:
+            status.clear()
+
+    if party.hp <= 0:
+        events.append(_event(state, "wiped", "パーティは力尽きた…（ESCで終了）"))
+    return events
+
+
+def play_turn(state: BattleState, src: int, dst: int) -> List[dict]:
+    """プレイヤーの一手と、倒せなかった場合の敵の反撃"""
+    events = apply_move(state, src, dst)
+    if not any(ev["type"] == "defeat" for ev in events):
+        events.extend(enemy_turn(state))
+    return events
+
+
+def use_skill(state: BattleState, ally_idx: int) -> List[dict]:
+    """SP が溜まっていればスキルを発動する（ターンは消費しない）"""
+    ally = state.party.allies[ally_idx]
+    skill = ally.skill
+    if skill is None:
+        return []
+    if ally.sp < skill.need_sp:
+        return []
+    enemy = state.enemy
+    res = skill.execute(state.party, enemy, state.rng)
+    ally.sp -= skill.need_sp
+    events = [_event(state, "skill", res, ally=ally_idx, attack=skill.dmg is not None)]
+    if enemy.hp <= 0:
+        events.append(_event(state, "defeat", f"{enemy.name} を倒した！", source="skill"))
+        events.extend(next_enemy(state))
+    return events
+
+
+def use_item(state: BattleState, no: int) -> List[dict]:
+    """アイテム番号 no（1..パックのアイテム数）を使う"""
+    items = state.items
+    if items["max_hold"][no] <= 0:
+        return [_event(state, "item", "アイテムはもうない...", item=no, used=False)]
+    items["max_hold"][no] -= 1
+    kind = items["type"][no]
+    if kind == "ATK":
+        state.power = True
+    elif kind == "RBRTH":
+        state.guard = True
+    elif kind == "LIFE":
+        if state.party.hp < 500:
+            state.party.hp += items["value"][no]
+    elif kind == "SHUFFLE":
+        # どれか一つ（自分も含む）の所持数が一つ増える
+        s = state.rng.choice(range(1, len(items["name"]) + 1))
+        items["max_hold"][s] += 1
+    return [_event(state, "item", f"{items['name'][no]}を使った。", item=no, used=True)]
@@ -0,0 +1,231 @@
+"""味方・パーティ・敵・状態異常を __slots__ のクラスで持つ（スキルもここ）
+
+エンジンやシミュレータは属性（ally.sp, enemy.hp）で読み書きする。移行中の
+コード（GUI の draw_top や Skill.execute）のために ent["hp"] のような dict と
+同じ書き方でも読み書きでき、dict(ent) で dict にも戻せる。
+copy() は中身を共有する浅いコピー、snapshot() は書き換えても元に響かないコピー。
+"""
+import random
+from typing import List, Optional
+
+
+class _Record:
+    """__slots__ クラス共通の dict 互換の口"""
+    __slots__ = ()
+    _coerce = {}   # ent["key"] = 値 で代入する時の変換（status に dict が来た時など）
+
+    def __getitem__(self, key: str):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key: str, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        conv = self._coerce.get(key)
+        setattr(self, key, conv(value) if conv is not None else value)
+
+    def __contains__(self, key) -> bool:
+        return key in self.__slots__
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def keys(self):
+        return self.__slots__
+
+    def items(self):
+        return [(k, getattr(self, k)) for k in self.__slots__]
+
+    def copy(self, **changes):
+        """浅いコピー（changes の項目だけ差し替える）"""
+        new = object.__new__(type(self))
+        for k in self.__slots__:
+            setattr(new, k, changes[k] if k in changes else getattr(self, k))
+        return new
+
+    def to_dict(self) -> dict:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+    def __eq__(self, other):
+        return type(other) is type(self) and all(
+            getattr(self, k) == getattr(other, k) for k in self.__slots__)
+
+    __hash__ = None
+
+    def __repr__(self):
+        body = ", ".join(f"{k}={getattr(self, k)!r}" for k in self.__slots__)
+        return f"{type(self).__name__}({body})"
+
+
+class StatusEffect(_Record):
+    """敵の状態異常（type: None / "atk_down" / "stun"）"""
+    __slots__ = ("type", "turn", "val")
+
+    def __init__(self, type: Optional[str] = None, turn: Optional[int] = 0, val: Optional[float] = None):
+        self.type = type
+        self.turn = turn
+        self.val = val
+
+    @classmethod
+    def coerce(cls, obj) -> "StatusEffect":
+        if isinstance(obj, cls):
+            return obj
+        return cls(obj.get("type"), obj.get("turn", 0), obj.get("val"))
+
+    def clear(self):
+        self.type = None
+        self.val = None
+
+    snapshot = _Record.copy
+
+
+class Ally(_Record):
+    __slots__ = ("name", "element", "hp", "max_hp", "ap", "dp", "skill", "sp")
+
+    def __init__(self, name: str, element: str, hp: int, max_hp: int, ap: int, dp: int,
+                 skill=None, sp: int = 0):
+        self.name = name
+        self.element = element
+        self.hp = hp
+        self.max_hp = max_hp
+        self.ap = ap
+        self.dp = dp
+        self.skill = skill   # Skill は書き換えないので共有してよい
+        self.sp = sp
+
+    @classmethod
+    def coerce(cls, obj) -> "Ally":
+        if isinstance(obj, cls):
+            return obj
+        return cls(obj["name"], obj["element"], obj["hp"], obj["max_hp"], obj["ap"], obj["dp"],
+                   obj.get("skill"), obj.get("sp", 0))
+
+    snapshot = _Record.copy
+
+
+class Party(_Record):
+    __slots__ = ("player_name", "allies", "hp", "max_hp", "dp")
+
+    def __init__(self, player_name: str, allies: List[Ally], hp: int, max_hp: int, dp: float):
+        self.player_name = player_name
+        self.allies = allies
+        self.hp = hp
+        self.max_hp = max_hp
+        self.dp = dp
+
+    @classmethod
+    def coerce(cls, obj) -> "Party":
+        if isinstance(obj, cls):
+            return obj
+        return cls(obj.get("player_name", "Player"), [Ally.coerce(a) for a in obj["allies"]],
+                   obj["hp"], obj["max_hp"], obj["dp"])
+
+    def snapshot(self) -> "Party":
+        return self.copy(allies=[a.snapshot() for a in self.allies])
+
+    def to_dict(self) -> dict:
+        d = _Record.to_dict(self)
+        d["allies"] = [a.to_dict() for a in self.allies]
+        return d
+
+
+class Enemy(_Record):
+    __slots__ = ("name", "element", "hp", "max_hp", "ap", "dp", "status")
+    _coerce = {"status": StatusEffect.coerce}
+
+    def __init__(self, name: str, element: str, hp: int, max_hp: int, ap: int, dp: int,
+                 status: Optional[StatusEffect] = None):
+        self.name = name
+        self.element = element
+        self.hp = hp
+        self.max_hp = max_hp
+        self.ap = ap
+        self.dp = dp
+        self.status = status if status is not None else StatusEffect()
+
+    @classmethod
+    def coerce(cls, obj) -> "Enemy":
+        if isinstance(obj, cls):
+            return obj
+        status = obj.get("status")
+        return cls(obj["name"], obj["element"], obj["hp"], obj["max_hp"], obj["ap"], obj["dp"],
+                   StatusEffect.coerce(status) if status is not None else None)
+
+    def snapshot(self) -> "Enemy":
+        return self.copy(status=self.status.snapshot())
+
+    def to_dict(self) -> dict:
+        d = _Record.to_dict(self)
+        d["status"] = self.status.to_dict()
+        return d
+
+
+# ---------------- スキル ----------------
+
+class Skill:
+    def __init__(self,
+                 skill_name: str,
+                 need_sp: int,
+                 dmg=None,  # 火:タプル、風・水:リスト
+                 debuff_ratio: float=None,
+                 debuff_turns: int=None,
+                 stun_turns: int=None,
+                 heal: int=None):
+        self.skill_name = skill_name
+        self.need_sp = need_sp
+        self.dmg = dmg
+        self.debuff_ratio = debuff_ratio
+        self.debuff_turns = debuff_turns
+        self.stun_turns = stun_turns
+        self.heal = heal
+
+    def execute(self, party, enemy, rng=random):  # スキルのメイン処理
+        message = []
+        message.append(f"【{self.skill_name}】")
+        dmg = self._calc_damage(enemy, rng)
+        if dmg is not None:
+            message.append(f"{dmg}ダメージ！")
+
+        heal = self._calc_heal(party)
+        if heal is not None:
+            message.append(f"{heal}回復！")
+
+        debuff_res = self._apply_debuff(enemy)
+        if debuff_res is not None:
+            message.append(f"{enemy['name']}の攻撃力を{debuff_res}ダウン！")
+
+        stun_res = self._apply_stun(enemy)
+        if stun_res is not None:
+            message.append(f"{enemy['name']}を{stun_res}ターンスタン！")
+
+        return " ".join(message)
+
+    def _calc_damage(self, enemy, rng=random):  # ダメージ
+        if type(self.dmg) == tuple:
+            skill_dmg = int(self.dmg[0]+enemy["hp"]*self.dmg[1])
+            enemy["hp"] = max(0, enemy["hp"]-skill_dmg)
+            return skill_dmg
+        if type(self.dmg) == list:
+            skill_dmg = int(rng.randint(self.dmg[0], self.dmg[1]))
+            enemy["hp"] = max(0, enemy["hp"]-skill_dmg)
+            return skill_dmg
+
+    def _calc_heal(self, party):  # 回復
+        if self.heal is not None:
+            if (party["hp"] <= party["max_hp"]/2):
+                party["hp"] = min(party["max_hp"], party["hp"]+self.heal)
+            else:
+                party["hp"] = min(party["max_hp"], party["hp"]+5)
+            return self.heal
+
+    def _apply_debuff(self, enemy):  # デバフ
+        if self.debuff_ratio is not None and self.debuff_turns is not None:
+            enemy["status"] = {"type": "atk_down",
+                               "turn": self.debuff_turns, "val": self.debuff_ratio}
+            return enemy["ap"]-enemy["ap"]*self.debuff_ratio
+
+    def _apply_stun(self, enemy):  # スタン
+        if self.stun_turns is not None and self.stun_turns != 0:
+            enemy["status"] = {"type": "stun", "turn": self.stun_turns}
+            return self.stun_turns
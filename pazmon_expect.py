@@ -0,0 +1,453 @@
+"""連鎖の見込み（期待値と分布）を補充の乱数について厳密に求める
+
+fill_random は GEMS から一様に引くので、ある盤面である手を指した時の
+コンボ数・属性ごとのダメージ・回復の期待値（と分布）は、補充の引き方すべての
+重み付き平均としてきっちり決まる。サンプリングせずに動的計画法で出す。
+
+- 補充した宝石は、いちばん左の並びを決めるのに要るまで見ない（見ていない
+  スロットの数だけ覚えておき、要る時に一つずつ GEMS の数に分ける）
+- いちばん左の並びより左は、並びが消えて詰まるたびに右端の同じ宝石のまとまりが
+  一つずつ並びに入りうる（一回に入るのは一つだけ）。右から PREFIX_BLOCKS 個の
+  まとまりだけ残してその奥は _HIDDEN 一文字にし、
+  (残りの宝石, 見ていないスロットの数, コンボ数, 力の粉) をキーにメモ化する
+- ダメージと回復は Ruleset の値（party_attack_from_gems と同じ式）に、jitter の
+  ±10% のぶれ（切り捨て、最低 1）を区間の長さから厳密に掛ける
+
+敵を倒した所で連鎖が止まるのは見ない（倒した後の分もダメージに数える）。
+連鎖は max_combo で打ち切り、捨てたまとまりまで届いた所でも打ち切って、
+打ち切った確率を truncated に出す（答えはその分だけ小さめになる）。
+分布は値ごとの確率の配列を畳み込むので期待値だけの時よりずっと重い
+（DIST_EPS より小さい確率の端は落とす）。--dist の時は既定の打ち切りを浅くする。
+横一列の盤面だけ（W×H の盤面は補充の場合の数が多すぎるので扱わない）。
+
+    python pazmon_expect.py --seed 3 --move 13 1 --dist
+    python pazmon_expect.py --seed 3 --top 5
+    python pazmon_expect.py --check 4000
+"""
+import argparse
+import math
+import random
+import re
+import statistics
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+import pazmon_engine as engine
+
+# 答えの並び：コンボ数, ダメージ合計, 宝石コードごとのダメージ..., 回復
+COMBOS, DAMAGE = 0, 1
+_REVEAL = "reveal"
+# 捨てた左の宝石の代わりの一文字（どの宝石とも並ばない）
+_HIDDEN = "#"
+# いちばん左の並びより左に残す同じ宝石のまとまりの数
+PREFIX_BLOCKS = 2
+# 分布は (いちばん小さい値の添字, 確率の配列) で持つ。添字は値を UNIT で割ったもの
+# （力の粉の 1.5 倍で半端が出る）
+UNIT = 0.5
+DIST_EPS = 1e-15
+_ONE = (0, np.ones(1))
+
+
+def jitter_dist(v: float, r: float = 0.10) -> Dict[int, float]:
+    """engine.jitter(v, r) の値 → 確率（v*U の U が [1-r, 1+r) で一様）"""
+    lo, hi = v * (1 - r), v * (1 + r)
+    if hi <= lo:
+        return {max(1, int(lo)): 1.0}
+    width = hi - lo
+    out: Dict[int, float] = {}
+    k = math.floor(lo)
+    while k < hi:
+        p = (min(hi, k + 1) - max(lo, k)) / width
+        if p > 0:
+            key = max(1, k)
+            out[key] = out.get(key, 0.0) + p
+        k += 1
+    return out
+
+
+def _floor_integral(x: float) -> float:
+    """0 から x までの floor の積分"""
+    k = math.floor(x)
+    return k * (k - 1) / 2 + k * (x - k)
+
+
+def jitter_mean(v: float, r: float = 0.10) -> float:
+    """engine.jitter(v, r) の期待値（分布を作らずに積分で出す）"""
+    lo, hi = v * (1 - r), v * (1 + r)
+    if hi <= lo:
+        return float(max(1, int(lo)))
+    if lo < 1:
+        # 最低 1 に切り上がる所がある小さい値は分布から
+        return sum(k * p for k, p in jitter_dist(v, r).items())
+    return (_floor_integral(hi) - _floor_integral(lo)) / (hi - lo)
+
+
+def _to_array(dist: Dict[float, float]) -> Tuple[int, np.ndarray]:
+    """値 → 確率 を (添字, UNIT 刻みの配列) にする"""
+    idx = {int(round(k / UNIT)): p for k, p in dist.items()}
+    lo = min(idx)
+    out = np.zeros(max(idx) - lo + 1)
+    for i, p in idx.items():
+        out[i - lo] += p
+    return lo, out
+
+
+def _from_array(dist: Tuple[int, np.ndarray]) -> Dict[float, float]:
+    """(添字, 配列) を 値 → 確率 に戻す（確率 0 の値は出さない。整数の値は int で）"""
+    lo, a = dist
+    out = {}
+    for i in np.flatnonzero(a > 0):
+        v = (lo + i) * UNIT
+        out[int(v) if v == int(v) else v] = float(a[i])
+    return out
+
+
+def _trim(lo: int, a: np.ndarray) -> Tuple[int, np.ndarray]:
+    """両端の DIST_EPS に満たない確率を落とす（配列が長くなりすぎないように）"""
+    nz = np.flatnonzero(a >= DIST_EPS)
+    if len(nz) == 0:
+        return lo, a[:1] * 0.0
+    return lo + nz[0], a[nz[0]:nz[-1] + 1]
+
+
+def _mean(dist: Tuple[int, np.ndarray]) -> float:
+    lo, a = dist
+    return float(np.dot(a, np.arange(lo, lo + len(a)))) * UNIT
+
+
+def _scan(known: str, unseen: int, run_re) -> Tuple[int, object]:
+    """(いちばん左の並びが始まりうる位置, 並び)
+
+    並びは (start, length)、見ていないスロットを見ないと決まらなければ _REVEAL、
+    もう並びができないなら None。盤面は宝石一文字ずつの文字列。
+    """
+    m = run_re.search(known)
+    if m is not None:
+        start, end = m.span()
+        if end == len(known) and unseen:
+            # 並びは決まったが、右の見ていないスロットまで続くかもしれない
+            return start, _REVEAL
+        return start, (start, end - start)
+    if not known:
+        return 0, (_REVEAL if unseen else None)
+    # 並びが無ければ、できるのは右端の同じ宝石の続きから
+    q = len(known.rstrip(known[-1]))
+    return q, (_REVEAL if unseen else None)
+
+
+def _prefix_cut(known: str, q: int, keep: int) -> int:
+    """known[:q] の右から keep 個の同じ宝石のまとまりを残した時に捨てられる長さ"""
+    i = q
+    while i > 0 and keep > 0 and known[i - 1] != _HIDDEN:
+        i = len(known[:i].rstrip(known[i - 1]))
+        keep -= 1
+    return i
+
+
+class CascadeExpectation:
+    """盤面と手から連鎖の期待値（dist=True なら分布も）を出す
+
+    敵・パーティの値はコンストラクタで読む。同じ敵・パーティの間はメモを
+    使い回すので、手を次々に評価すると後のほど速い。
+    """
+
+    def __init__(self, state: engine.BattleState, dist: bool = False, max_combo: int = 8,
+                 power: Optional[bool] = None, prefix_blocks: int = PREFIX_BLOCKS):
+        rules = self.rules = state.rules
+        self.party = state.party
+        self.enemy = state.enemy
+        self.enemy_code = rules.enemy_codes[min(state.enemy_idx, len(rules.enemy_codes)-1)]
+        self.gems = tuple(rules.gems)
+        if any(len(g) != 1 for g in self.gems):
+            raise ValueError("宝石は一文字でないと扱えない")
+        self._run_re = re.compile("([" + re.escape("".join(self.gems)) + "])\\1\\1+")
+        self.dist = dist
+        self.max_combo = max_combo
+        self.prefix_blocks = prefix_blocks
+        self.power = state.power if power is None else power
+        self.size = 3 + len(self.gems)
+        self.memo: Dict[tuple, tuple] = {}
+        self._runs: Dict[tuple, list] = {}
+        # 見ていないスロットを一つずつ開けていくので、盤面の長さ × コンボ数だけ深くなる
+        need = max_combo * (len(state.field) + 2) + 200
+        if sys.getrecursionlimit() < need:
+            sys.setrecursionlimit(need)
+
+    # ---------------- 一つの並びの分 ----------------
+
+    def _run(self, code: int, length: int, combo: int, power: bool) -> list:
+        """並び一つで増える分（期待値なら数、分布なら配列）。位置は答えの並びと同じ"""
+        key = (code, length, combo, power)
+        hit = self._runs.get(key)
+        if hit is not None:
+            return hit
+        rules = self.rules
+        # 期待値だけなら jitter は積分で、分布なら 値→確率 で
+        jit = jitter_dist if self.dist else jitter_mean
+        add: list = [None] * self.size
+        add[COMBOS] = {1: 1.0} if self.dist else 1.0
+        if code == rules.life:
+            add[-1] = jit(rules.heal_value(length, combo))
+        else:
+            if rules.attacker[code] < 0:
+                dmg = {0: 1.0} if self.dist else 0.0
+            else:
+                dmg = jit(rules.attack_value(code, length, combo, self.party, self.enemy, self.enemy_code))
+            if power:
+                dmg = {k * 1.5: p for k, p in dmg.items()} if self.dist else dmg * 1.5
+            add[DAMAGE] = dmg
+            add[2 + code] = dmg
+        if self.dist:
+            add = [None if d is None else _to_array(d) for d in add]
+        self._runs[key] = add
+        return add
+
+    # ---------------- 組み立て ----------------
+
+    def _zero(self) -> list:
+        if self.dist:
+            return [_ONE] * self.size
+        return [0.0] * self.size
+
+    def _mix(self, parts: List[tuple]) -> tuple:
+        """等しい確率で起きる続きの平均"""
+        w = 1.0 / len(parts)
+        trunc = sum(t for _, t in parts) * w
+        if not self.dist:
+            return [sum(col) * w for col in zip(*[vals for vals, _ in parts])], trunc
+        out = []
+        for col in zip(*[vals for vals, _ in parts]):
+            lo = min(o for o, _ in col)
+            acc = np.zeros(max(o + len(a) for o, a in col) - lo)
+            for o, a in col:
+                acc[o - lo:o - lo + len(a)] += a
+            out.append(_trim(lo, acc * w))
+        return out, trunc
+
+    def _add(self, vals: list, add: list) -> list:
+        """続きの答えに、その前に消えた並びの分を足す（分布なら畳み込む）"""
+        if not self.dist:
+            return [v if a is None else v + a for v, a in zip(vals, add)]
+        return [d if a is None else _trim(d[0] + a[0], np.convolve(d[1], a[1])) for d, a in zip(vals, add)]
+
+    # ---------------- 本体 ----------------
+
+    def _solve(self, known: str, unseen: int, combo: int, power: bool) -> tuple:
+        """(答え, 打ち切った確率)"""
+        q, run = _scan(known, unseen, self._run_re)
+        hidden = known[:1] == _HIDDEN
+        if hidden and q <= 1:
+            # 捨てた宝石が並びに入るかもしれない所まで来た：打ち切りと同じに扱う
+            return self._zero(), 1.0
+        # q より左は右端のまとまりから一つずつしか消えない。PREFIX_BLOCKS 個（残りの
+        # コンボで届かなければそれより少なく）を残し、その奥は _HIDDEN 一文字にする
+        cut = _prefix_cut(known, q, min(self.prefix_blocks, self.max_combo - combo + 1))
+        if cut > hidden:
+            known = _HIDDEN + known[cut:]
+            if run is not None and run is not _REVEAL:
+                run = (run[0] - cut + 1, run[1])
+        key = (known, unseen, combo, power)
+        hit = self.memo.get(key)
+        if hit is not None:
+            return hit
+
+        if run is None:
+            res = (self._zero(), 0.0)
+        elif combo >= self.max_combo:
+            res = (self._zero(), 1.0)
+        elif run is _REVEAL:
+            res = self._mix([self._solve(known + g, unseen - 1, combo, power) for g in self.gems])
+        else:
+            start, length = run
+            code = self.rules.code[known[start]]
+            attack = code != self.rules.life
+            rest = known[:start] + known[start + length:]
+            vals, trunc = self._solve(rest, unseen + length, combo + 1, power and not attack)
+            res = (self._add(vals, self._run(code, length, combo + 1, power and attack)), trunc)
+        self.memo[key] = res
+        return res
+
+    def board(self, field: List[str]) -> dict:
+        """埋まった盤面から連鎖した時の見込み"""
+        vals, trunc = self._solve("".join(field), 0, 0, self.power)
+        return self._report(vals, trunc)
+
+    def move(self, field: List[str], src: int, dst: int) -> dict:
+        """src から dst へドラッグした時の見込み"""
+        f = list(field)
+        for k, nxt in engine.drag_path(src, dst):
+            f[k], f[nxt] = f[nxt], f[k]
+        return self.board(f)
+
+    def _report(self, vals: list, trunc: float) -> dict:
+        gems = self.gems
+        if self.dist:
+            dists = [_from_array(a) for a in vals]
+            means = [_mean(d) for d in vals]
+        else:
+            dists, means = None, vals
+        out = {
+            "combos": means[COMBOS],
+            "damage": means[DAMAGE],
+            "by_elem": {g: means[2 + c] for c, g in enumerate(gems) if c != self.rules.life},
+            "heal": means[-1],
+            "truncated": trunc,
+        }
+        if dists is not None:
+            out["dist"] = {
+                "combos": dists[COMBOS],
+                "damage": dists[DAMAGE],
+                "by_elem": {g: dists[2 + c] for c, g in enumerate(gems) if c != self.rules.life},
+                "heal": dists[-1],
+            }
+        return out
+
+
+# ---------------- 手の順位 ----------------
+
+def rank_moves(state: engine.BattleState, top: Optional[int] = None,
+               calc: Optional[CascadeExpectation] = None) -> List[Tuple[float, Tuple[int, int], dict]]:
+    """全部のドラッグを見込みダメージ（HP が減っていれば回復も足す）の順に並べる
+
+    結果の盤面が同じになるドラッグは一つにまとめる。
+    """
+    if not state.grid.linear:
+        raise ValueError("W×H の盤面の見込みは計算できない（横一列だけ）")
+    calc = calc if calc is not None else CascadeExpectation(state)
+    party = state.party
+    heal_weight = 1.0 if party.hp < party.max_hp else 0.0
+    field = state.field
+    n = len(field)
+    seen = set()
+    ranked = []
+    for src in range(n):
+        for dst in range(n):
+            if src == dst:
+                continue
+            f = list(field)
+            for k, nxt in engine.drag_path(src, dst):
+                f[k], f[nxt] = f[nxt], f[k]
+            key = tuple(f)
+            if key in seen:
+                continue
+            seen.add(key)
+            rep = calc.board(f)
+            ranked.append((rep["damage"] + heal_weight * rep["heal"], (src, dst), rep))
+    ranked.sort(key=lambda t: -t[0])
+    return ranked[:top] if top else ranked
+
+
+def expect_policy(state: engine.BattleState, rng) -> Tuple[int, int]:
+    """pazmon_sim 用のポリシー（見込みが最大の手、同点なら乱数で）"""
+    ranked = rank_moves(state)
+    best = ranked[0][0]
+    return rng.choice([mv for v, mv, _ in ranked if v >= best - 1e-9])
+
+
+# ---------------- サンプリングとの突き合わせ ----------------
+
+def sample_move(state: engine.BattleState, src: int, dst: int, rng) -> dict:
+    """本物の apply_move で一回指した結果（敵は倒れないようにしておく）"""
+    st = engine.BattleState(state.party.snapshot(), [state.enemy.snapshot()], None,
+                            list(state.field), rng=rng, snapshots=False)
+    st.power = state.power
+    st.enemy.hp = st.enemy.max_hp = 10 ** 12
+    out = {"combos": 0, "damage": 0.0, "heal": 0}
+    for ev in engine.apply_move(st, src, dst):
+        if ev["type"] == "attack":
+            out["combos"] += 1
+            out["damage"] += ev["dmg"]
+        elif ev["type"] == "heal":
+            out["combos"] += 1
+            out["heal"] += ev["heal"]
+    return out
+
+
+# 決まった盤面（手は指さずにそのまま連鎖させる）。いちばん左の並びより遠い宝石が
+# 後で並びに入る：水水水 → 火火火 → 風風風 と必ず 3 コンボ以上になる
+FIXED_BOARDS = ["風火火水水水火風風土命土命土"]
+
+
+def check(samples: int = 4000, boards: int = 5, seed: int = 0) -> int:
+    """いくつかの盤面と手で、厳密な期待値と apply_move を samples 回指した平均を比べる
+
+    平均との差が標準誤差の 4 倍を超えた数を返す。
+    """
+    rng = random.Random(seed)
+    cases = []
+    for b in range(boards):
+        state = engine.new_battle(random.Random(seed * 1000 + b), snapshots=False)
+        state.party.hp = state.party.max_hp // 2
+        cases.append((f"board {b}", state, rank_moves(state, 1)[0][1]))
+    for b, field in enumerate(FIXED_BOARDS):
+        state = engine.new_battle(random.Random(seed * 1000 + boards + b), snapshots=False)
+        state.party.hp = state.party.max_hp // 2
+        state.field[:] = field
+        cases.append((f"fixed {b}", state, (0, 0)))
+    bad = 0
+    for label, state, (src, dst) in cases:
+        exact = CascadeExpectation(state).move(state.field, src, dst)
+        runs = [sample_move(state, src, dst, rng) for _ in range(samples)]
+        line = [f"{label} move {src}->{dst}:"]
+        for name in ("combos", "damage", "heal"):
+            xs = [r[name] for r in runs]
+            mean = statistics.fmean(xs)
+            se = statistics.pstdev(xs) / math.sqrt(samples)
+            ok = abs(mean - exact[name]) <= 4 * se + 1e-9
+            bad += not ok
+            line.append(f"{name} {exact[name]:.3f} / {mean:.3f}±{se:.3f}{'' if ok else ' ずれ'}")
+        line.append(f"truncated {exact['truncated']:.1e}")
+        print("  ".join(line))
+    return bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description="連鎖の見込み（期待値と分布）を厳密に計算する")
+    parser.add_argument("--seed", type=int, default=0, help="盤面を作る乱数の種")
+    parser.add_argument("--move", type=int, nargs=2, metavar=("SRC", "DST"), help="この手だけ見る")
+    parser.add_argument("--top", type=int, default=5, help="見込みの大きい手をいくつ出すか")
+    parser.add_argument("--dist", action="store_true", help="分布も出す（--move の時）")
+    parser.add_argument("--max-combo", type=int, default=None,
+                        help="ここで連鎖を打ち切る（省略時は 8、--dist なら 6）")
+    parser.add_argument("--prefix-blocks", type=int, default=PREFIX_BLOCKS,
+                        help="並びより左に残すまとまりの数（多いほど truncated が減って重い）")
+    parser.add_argument("--check", type=int, default=0, metavar="N", help="N 回指した平均と比べる")
+    args = parser.parse_args()
+
+    max_combo = args.max_combo or (6 if args.dist else 8)
+    if args.check:
+        sys.exit(1 if check(args.check, seed=args.seed) else 0)
+
+    state = engine.new_battle(random.Random(args.seed), snapshots=False)
+    print("".join(state.field), f"（{state.enemy.name}）")
+    t = time.perf_counter()
+    if args.move:
+        calc = CascadeExpectation(state, args.dist, max_combo, prefix_blocks=args.prefix_blocks)
+        rep = calc.move(state.field, *args.move)
+        elapsed = time.perf_counter() - t
+        print(f"{args.move[0]}->{args.move[1]}: combos {rep['combos']:.4f}, damage {rep['damage']:.3f}, "
+              f"heal {rep['heal']:.3f}, truncated {rep['truncated']:.2e} ({elapsed * 1000:.1f} ms, "
+              f"{len(calc.memo)} states)")
+        print("  by_elem:", {g: round(v, 3) for g, v in rep["by_elem"].items()})
+        if args.dist:
+            d = rep["dist"]
+            print("  combos:", {k: round(p, 5) for k, p in d["combos"].items()})
+            for name in ("damage", "heal"):
+                hist = d[name]
+                mode = max(hist, key=hist.get)
+                print(f"  {name}: {len(hist)} values, min {min(hist)}, max {max(hist)}, mode {mode}")
+        return
+    calc = CascadeExpectation(state, max_combo=max_combo, prefix_blocks=args.prefix_blocks)
+    ranked = rank_moves(state, args.top, calc)
+    elapsed = time.perf_counter() - t
+    print(f"{elapsed * 1000:.1f} ms, {len(calc.memo)} states")
+    for v, (src, dst), rep in ranked:
+        print(f"  {src:2d}->{dst:2d}  value {v:8.3f}  combos {rep['combos']:.3f}  "
+              f"damage {rep['damage']:.3f}  heal {rep['heal']:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+"""遊んだ入力の記録と、ヘッドレスでの最高速再生
+
+記録は乱数の種と、メインループが実際に処理した入力（盤面・スキルバーへの
+マウス操作、キー、アイテムのクリック、押しっぱなしのキー、オートプレイと
+オートバトルの手）をフレーム番号付きで小さなバイナリに書く。最後に終わった時の
+状態を付ける。
+再生は SDL の dummy ドライバで同じ main() を動かし、記録した入力を同じ
+フレームで渡す。待ちもアニメーションも飛ばすので CPU の速さで回る。
+アニメーション中に捨てられた入力は記録しないので、飛ばしても展開は変わらない。
+
+    python pazmon_replay.py record session.pzr [--seed 7] [--grid 6x5]
+    python pazmon_replay.py replay session.pzr [--trace frames.csv]
+
+ファイルの形（リトルエンディアン）：
+    ヘッダ  : b"PZRP", バージョン u16, 種 u64, 盤面の幅 u16, 高さ u16
+    レコード: フレーム u32, 種類 u8, 種類ごとの中身（_FORMATS）
+    終わり  : フレーム数 u32, 種類 255, 長さ u32, 最終状態の JSON
+"""
+import argparse
+import json
+import os
+import random
+import struct
+import sys
+import time
+from collections import defaultdict, deque
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pygame as pg
+
+import pazmon_engine as engine
+import pazmonfree as gui
+
+MAGIC = b"PZRP"
+VERSION = 2
+_HEADER = struct.Struct("<4sHQHH")
+_RECORD = struct.Struct("<IB")
+_LENGTH = struct.Struct("<I")
+
+# レコードの種類（1..15 は pygame のイベント、16.. は decide の値）
+DOWN, UP, MOTION, KEY, QUIT = 1, 2, 3, 4, 5
+KEYS, ITEM, AUTO, MOVE, BOT = 16, 17, 18, 19, 20
+END = 255
+_FORMATS = {
+    DOWN: struct.Struct("<Bhh"),    # ボタン, x, y
+    UP: struct.Struct("<Bhh"),
+    MOTION: struct.Struct("<hh"),   # x, y
+    KEY: struct.Struct("<i"),       # キーコード
+    QUIT: struct.Struct(""),
+    KEYS: struct.Struct("<B"),      # gui.HELD_* のビット
+    ITEM: struct.Struct("<B"),      # アイテム番号（1..）
+    AUTO: struct.Struct(""),
+    MOVE: struct.Struct("<HH"),     # src, dst
+    BOT: struct.Struct("<BHH"),     # pazmon_bot の手（種類, a, b）
+}
+_DECISIONS = {"keys": KEYS, "item": ITEM, "auto": AUTO, "move": MOVE, "bot": BOT}
+# 記録が無いフレームで decide が返す値（押していない・クリックしていない）
+_NOTHING = {KEYS: 0, ITEM: 0, AUTO: False, BOT: None}
+
+
+class ReplayError(Exception):
+    """ログが読めない・再生が記録とずれた"""
+
+
+def final_state(state: engine.BattleState) -> dict:
+    """記録と再生で突き合わせる、終わった時の状態"""
+    return {
+        "turns": state.turns,
+        "enemy_idx": state.enemy_idx,
+        "enemy_hp": [en.hp for en in state.enemies],
+        "party_hp": state.party.hp,
+        "sp": [a.sp for a in state.party.allies],
+        "field": list(state.field),
+        "items": list(state.items["max_hold"].values()) if state.items else [],
+        "cleared": state.cleared,
+    }
+
+
+# ---------------- 記録 ----------------
+
+class Recorder(gui.LiveInput):
+    """ふつうに遊びながら、処理した入力をファイルに書いていく"""
+
+    def __init__(self, path: str, seed: Optional[int] = None,
+                 grid: Optional[Tuple[int, int]] = None):
+        self.path = path
+        self.seed = seed if seed is not None else random.randrange(1 << 63)
+        # 盤面の形も書いておく（再生は環境変数によらずこの形で回す）
+        self.grid = grid or gui.grid_from_env() or (engine.SLOT_COUNT, 1)
+        self.frame = 0
+        self.records = 0
+        self._f = open(path, "wb")
+        self._f.write(_HEADER.pack(MAGIC, VERSION, self.seed, *self.grid))
+
+    def _write(self, kind: int, *values):
+        self._f.write(_RECORD.pack(self.frame, kind) + _FORMATS[kind].pack(*values))
+        self.records += 1
+
+    def log(self, e):
+        if e.type == pg.MOUSEBUTTONDOWN:
+            self._write(DOWN, e.button, *e.pos)
+        elif e.type == pg.MOUSEBUTTONUP:
+            self._write(UP, e.button, *e.pos)
+        elif e.type == pg.MOUSEMOTION:
+            self._write(MOTION, *e.pos)
+        elif e.type == pg.KEYDOWN:
+            self._write(KEY, e.key)
+        elif e.type == pg.QUIT:
+            self._write(QUIT)
+
+    def decide(self, kind: str, fn: Callable):
+        value = fn()
+        code = _DECISIONS[kind]
+        if value:
+            if code in (MOVE, BOT):
+                self._write(code, *value)
+            elif code == AUTO:
+                self._write(code)
+            else:
+                self._write(code, value)
+        return value
+
+    def tick(self, pacer, idle: bool = False) -> float:
+        dt = super().tick(pacer, idle)
+        self.frame += 1
+        return dt
+
+    def close(self, state):
+        body = json.dumps(final_state(state), ensure_ascii=False).encode("utf-8")
+        self._f.write(_RECORD.pack(self.frame, END) + _LENGTH.pack(len(body)) + body)
+        self._f.close()
+
+
+# ---------------- 読み込み ----------------
+
+def read_log(path: str) -> Tuple[int, Tuple[int, int], List[Tuple[int, int, tuple]], Optional[dict], int]:
+    """(種, 盤面の形, [(フレーム, 種類, 値)], 最終状態, フレーム数)。途中で切れたログは最終状態が None"""
+    with open(path, "rb") as f:
+        data = f.read()
+    if len(data) < _HEADER.size:
+        raise ReplayError(f"{path}: 短すぎる")
+    magic, version, seed, w, h = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ReplayError(f"{path}: 記録ファイルではない（{magic!r} v{version}）")
+    records = []
+    pos = _HEADER.size
+    while pos + _RECORD.size <= len(data):
+        frame, kind = _RECORD.unpack_from(data, pos)
+        pos += _RECORD.size
+        if kind == END:
+            (n,) = _LENGTH.unpack_from(data, pos)
+            pos += _LENGTH.size
+            return seed, (w, h), records, json.loads(data[pos:pos + n].decode("utf-8")), frame
+        fmt = _FORMATS.get(kind)
+        if fmt is None or pos + fmt.size > len(data):
+            raise ReplayError(f"{path}: {pos} バイト目のレコードが壊れている")
+        records.append((frame, kind, fmt.unpack_from(data, pos)))
+        pos += fmt.size
+    last = records[-1][0] + 1 if records else 0
+    return seed, (w, h), records, None, last
+
+
+def _to_event(kind: int, values: tuple) -> pg.event.Event:
+    if kind in (DOWN, UP):
+        button, x, y = values
+        return pg.event.Event(pg.MOUSEBUTTONDOWN if kind == DOWN else pg.MOUSEBUTTONUP,
+                              button=button, pos=(x, y))
+    if kind == MOTION:
+        return pg.event.Event(pg.MOUSEMOTION, pos=values, rel=(0, 0), buttons=(0, 0, 0))
+    if kind == KEY:
+        return pg.event.Event(pg.KEYDOWN, key=values[0], mod=0, unicode="")
+    return pg.event.Event(pg.QUIT)
+
+
+# ---------------- 再生 ----------------
+
+class Replayer(gui.LiveInput):
+    """記録した入力を同じフレームで main() に渡す（待たない）"""
+    headless = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self.seed, self.grid, records, self.expected, self.frames = read_log(path)
+        self.frame = 0
+        self._events: Dict[int, list] = defaultdict(list)
+        self._decisions: Dict[Tuple[int, int], deque] = defaultdict(deque)
+        for frame, kind, values in records:
+            if kind < KEYS:
+                self._events[frame].append(_to_event(kind, values))
+            else:
+                self._decisions[(frame, kind)].append(values)
+        self.trace: List[Tuple[int, float, int]] = []   # (フレーム, ミリ秒, イベント数)
+        self.state: Optional[dict] = None
+        self.seconds = 0.0
+        self._n_events = 0
+        self._t0 = self._t = time.perf_counter()
+
+    def events(self) -> list:
+        if self.frame >= self.frames:
+            # 記録が終わったら閉じる（途中で切れたログでもそこまで再生する）
+            return [pg.event.Event(pg.QUIT)]
+        pg.event.pump()
+        evs = self._events.pop(self.frame, [])
+        self._n_events = len(evs)
+        return evs
+
+    def decide(self, kind: str, fn: Callable):
+        code = _DECISIONS[kind]
+        queue = self._decisions.get((self.frame, code))
+        if not queue:
+            if code == MOVE:
+                raise ReplayError(f"フレーム {self.frame}: オートプレイの手が記録に無い（ずれた）")
+            return _NOTHING[code]
+        values = queue.popleft()
+        if code in (MOVE, BOT):
+            return values
+        return True if code == AUTO else values[0]
+
+    def tick(self, pacer, idle: bool = False) -> float:
+        now = time.perf_counter()
+        self.trace.append((self.frame, (now - self._t) * 1000.0, self._n_events))
+        self._t = now
+        self.frame += 1
+        return 1 / 60
+
+    def close(self, state):
+        self.seconds = time.perf_counter() - self._t0
+        self.state = final_state(state)
+
+    def mismatches(self) -> List[str]:
+        """記録の最終状態と違った項目（最終状態の無いログなら空）"""
+        if self.expected is None or self.state is None:
+            return []
+        return [k for k in self.expected if self.expected[k] != self.state.get(k)]
+
+    def write_trace(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("frame,ms,events\n")
+            for frame, ms, n in self.trace:
+                f.write(f"{frame},{ms:.3f},{n}\n")
+
+
+def run(inputs: gui.LiveInput):
+    try:
+        gui.main(inputs)
+    except SystemExit:
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="入力の記録とヘッドレス再生")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    rec = sub.add_parser("record", help="遊びながら記録する")
+    rec.add_argument("path")
+    rec.add_argument("--seed", type=int, default=None)
+    rec.add_argument("--grid", default=None, help="盤面の形（20 や 6x5、省略時は PAZMON_GRID か 14）")
+    rep = sub.add_parser("replay", help="dummy ドライバで最高速で再生する")
+    rep.add_argument("path")
+    rep.add_argument("--trace", default=None, help="フレームごとの処理時間を書く CSV")
+    args = parser.parse_args()
+
+    if args.cmd == "record":
+        grid = engine.Grid.parse(args.grid) if args.grid else None
+        recorder = Recorder(args.path, args.seed, (grid.w, grid.h) if grid else None)
+        run(recorder)
+        print(f"{args.path}: seed {recorder.seed}, grid {recorder.grid[0]}x{recorder.grid[1]}, "
+              f"{recorder.frame} frames, {recorder.records} records")
+        return
+
+    os.environ["SDL_VIDEODRIVER"] = "dummy"
+    os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+    replayer = Replayer(args.path)
+    run(replayer)
+    if args.trace:
+        replayer.write_trace(args.trace)
+    fps = replayer.frame / replayer.seconds if replayer.seconds else 0.0
+    print(f"{args.path}: seed {replayer.seed}, grid {replayer.grid[0]}x{replayer.grid[1]}, "
+          f"{replayer.frame} frames in {replayer.seconds:.2f} s ({fps:.0f} fps)")
+    if replayer.expected is None:
+        print("  (最終状態の無いログなので突き合わせない)")
+        return
+    bad = replayer.mismatches()
+    if bad:
+        for k in bad:
+            print(f"  {k}: 記録 {replayer.expected[k]!r} / 再生 {replayer.state.get(k)!r}")
+        sys.exit(1)
+    print("  最終状態が一致")
+
+
+if __name__ == "__main__":
+    main()
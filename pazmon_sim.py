@@ -0,0 +1,323 @@
+"""ダンジョン攻略のモンテカルロ・シミュレータ（バランス調整用）
+
+スライムからドラゴンまでの攻略を、手の選び方（ポリシー）を差し替えながら
+プロセスプールで大量に回し、勝率・敵ごとのターン数・ダメージと回復の分布・
+スキルの使用回数を集計する。max_turns までに終わらなかった攻略は全滅とは
+分けて timeouts に数える。
+
+速さの目安（1 コアあたり）：random は数百回/秒で、100 万回も CPU 数があれば
+数分で回る。greedy は盤面を pazmon_bitboard で動かしても一手ごとに全部の
+ドラッグを調べるので数十回/秒にとどまり、solver・expect はさらに遅い。
+大量に回すのは random、手の良し悪しを見るのは他のポリシーを少ない回数で。
+
+    python pazmon_sim.py --runs 100000 --policy greedy --workers 8
+    python pazmon_sim.py --runs 20000 --json report.json
+    python pazmon_sim.py --content content/other.json --dungeon cave
+"""
+import argparse
+import json
+import multiprocessing as mp
+import os
+import random
+import time
+from collections import Counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pazmon_bitboard as bits
+import pazmon_content as content
+import pazmon_engine as engine
+from pazmon_expect import expect_policy
+from pazmon_solver import solver_policy
+
+
+# ---------------- ポリシー ----------------
+# policy(state, rng) -> (src, dst)
+
+def random_policy(state: engine.BattleState, rng) -> Tuple[int, int]:
+    n = len(state.field)
+    return rng.randrange(n), rng.randrange(n)
+
+
+def greedy_policy(state: engine.BattleState, rng) -> Tuple[int, int]:
+    """最初に消える並びの見込みダメージが一番大きいドラッグを選ぶ（連鎖・補充は見ない）
+
+    盤面は pazmon_bitboard の整数表現で動かし、結果の盤面が同じになるドラッグは
+    一つにまとめる。ダメージと回復は Ruleset の値（コンボ 1 として）。
+    """
+    field = state.field
+    n = len(field)
+    enemy = state.enemy
+    party = state.party
+    rules = state.rules
+    enemy_code = rules.code.get(enemy.element, -1)
+    hurt = party.hp < party.max_hp / 2
+    # 長さ 3 の基本ダメージ（長さの倍率は combo_coeff で掛ける）
+    gain = [rules.attack_value(c, 3, 0, party, enemy, enemy_code) for c in range(len(rules.gems))]
+
+    board = bits.from_list(field)
+    seen = {}
+    for src in range(n):
+        for dst in range(n):
+            if src != dst:
+                seen.setdefault(bits.drag(board, src, dst), (src, dst))
+
+    best, best_score = [], -1.0
+    for b, mv in seen.items():
+        run = bits.leftmost_run(b, n)
+        if run is None:
+            score = 0.0
+        else:
+            start, L = run
+            code = bits.get(b, start)
+            if code == rules.life:
+                score = rules.heal_value(L, 1) if hurt else 1.0
+            else:
+                score = gain[code] * rules.combo_coeff(L - 3 + 1)
+        if score > best_score:
+            best, best_score = [mv], score
+        elif score == best_score:
+            best.append(mv)
+    return rng.choice(best)
+
+
+POLICIES: Dict[str, Callable] = {
+    "random": random_policy,
+    "greedy": greedy_policy,
+    "solver": solver_policy,
+    "expect": expect_policy,
+}
+
+
+# ---------------- 一回の攻略 ----------------
+
+def _item_no(items: dict, kind: str) -> Optional[int]:
+    """その種類で所持数が残っている最初のアイテムの番号"""
+    return next((no for no, k in items["type"].items() if k == kind and items["max_hold"][no] > 0), None)
+
+
+def use_items(state: engine.BattleState):
+    """HP が減っていたら回復（LIFE）、危なければお守り（RBRTH）を使う"""
+    party = state.party
+    items = state.items
+    events = []
+    if party.hp < party.max_hp * 0.4:
+        no = _item_no(items, "LIFE")
+        if no is not None:
+            events += engine.use_item(state, no)
+    if party.hp < party.max_hp * 0.2 and not state.guard:
+        no = _item_no(items, "RBRTH")
+        if no is not None:
+            events += engine.use_item(state, no)
+    return events
+
+
+def play_run(policy: Callable, rng, max_turns: int = 500, skills: bool = True,
+             items: bool = False, pack: Optional[content.ContentPack] = None,
+             dungeon: str = "default") -> dict:
+    """一回攻略して、集計に使う値をまとめて返す"""
+    state = engine.new_battle(rng, snapshots=False, pack=pack, dungeon=dungeon)
+    names = [en.name for en in state.enemies]
+    allies = state.party.allies
+    turns = [0] * len(names)
+    dmg = Counter()
+    heal = Counter()
+    skill_use = Counter()
+
+    def tally(events):
+        for ev in events:
+            kind = ev["type"]
+            if kind == "attack":
+                dmg[int(ev["dmg"])] += 1
+            elif kind == "heal":
+                heal[ev["heal"]] += 1
+            elif kind == "skill":
+                skill_use[allies[ev["ally"]].skill.skill_name] += 1
+
+    while not state.finished and state.turns < max_turns:
+        if skills:
+            for i in range(len(allies)):
+                tally(engine.use_skill(state, i))
+                if state.finished:
+                    break
+            if state.finished:
+                break
+        if items:
+            use_items(state)
+        idx = state.enemy_idx
+        src, dst = policy(state, rng)
+        tally(engine.play_turn(state, src, dst))
+        turns[idx] += 1
+
+    return {
+        "win": state.cleared,
+        "timeout": not state.finished,
+        "reached": min(state.enemy_idx, len(names) - 1),
+        "kills": state.enemy_idx,
+        "turns": turns,
+        "dmg": dmg,
+        "heal": heal,
+        "skills": skill_use,
+        "names": names,
+    }
+
+
+# ---------------- 集計 ----------------
+
+class Tally:
+    """複数の攻略の結果を足し合わせる（プロセス間で受け渡せる）"""
+
+    def __init__(self, names: List[str]):
+        self.names = names
+        self.runs = 0
+        self.wins = 0
+        self.timeouts = 0                  # max_turns までに終わらなかった数
+        self.deaths = Counter()            # 力尽きた相手
+        self.turns = [Counter() for _ in names]   # 倒すまでのターン数の分布
+        self.dmg = Counter()
+        self.heal = Counter()
+        self.skills = Counter()
+
+    def add(self, res: dict):
+        self.runs += 1
+        if res["win"]:
+            self.wins += 1
+        elif res["timeout"]:
+            self.timeouts += 1
+        else:
+            self.deaths[res["names"][res["reached"]]] += 1
+        for i in range(res["kills"]):
+            self.turns[i][res["turns"][i]] += 1
+        self.dmg.update(res["dmg"])
+        self.heal.update(res["heal"])
+        self.skills.update(res["skills"])
+
+    def merge(self, other: "Tally"):
+        self.runs += other.runs
+        self.wins += other.wins
+        self.timeouts += other.timeouts
+        self.deaths.update(other.deaths)
+        for mine, theirs in zip(self.turns, other.turns):
+            mine.update(theirs)
+        self.dmg.update(other.dmg)
+        self.heal.update(other.heal)
+        self.skills.update(other.skills)
+
+
+def summarize(hist: Counter) -> dict:
+    """値→回数 の分布を平均とパーセンタイルにまとめる"""
+    total = sum(hist.values())
+    if total == 0:
+        return {"count": 0}
+    items = sorted(hist.items())
+    mean = sum(v * c for v, c in items) / total
+    out = {"count": total, "mean": round(mean, 3), "min": items[0][0], "max": items[-1][0]}
+    marks = [("p50", 0.50), ("p90", 0.90), ("p99", 0.99)]
+    acc = 0
+    for v, c in items:
+        acc += c
+        while marks and acc >= marks[0][1] * total:
+            out[marks.pop(0)[0]] = v
+    return out
+
+
+def report(t: Tally) -> dict:
+    return {
+        "runs": t.runs,
+        "win_rate": t.wins / t.runs if t.runs else 0.0,
+        "deaths": dict(t.deaths),
+        "timeouts": t.timeouts,
+        "turns_per_enemy": {name: summarize(h) for name, h in zip(t.names, t.turns)},
+        "damage": summarize(t.dmg),
+        "heal": summarize(t.heal),
+        "skill_usage": dict(t.skills),
+    }
+
+
+# ---------------- 並列実行 ----------------
+
+def _worker(args) -> Tally:
+    seed, chunk, runs, policy_name, max_turns, skills, items, pack_path, dungeon = args
+    # チャンクごとに独立した乱数列（同じ seed なら何度回しても同じ結果）
+    rng = random.Random(f"pazmon-sim:{seed}:{chunk}")
+    policy = POLICIES[policy_name]
+    # パックはワーカーごとにキャッシュから読む（JSON の確認は親で一度だけ）
+    pack = content.load_pack(pack_path)
+    tally = None
+    for _ in range(runs):
+        res = play_run(policy, rng, max_turns, skills, items, pack, dungeon)
+        if tally is None:
+            tally = Tally(res["names"])
+        tally.add(res)
+    return tally
+
+
+def simulate(runs: int, policy: str = "greedy", workers: int = 0, seed: int = 0,
+             max_turns: int = 500, skills: bool = True, items: bool = False,
+             chunk_size: int = 250, pack_path: Optional[str] = None,
+             dungeon: str = "default") -> Tally:
+    """runs 回を chunk_size ずつに分けて回す（乱数はチャンク単位なのでワーカー数に依らず同じ結果）"""
+    workers = workers or os.cpu_count() or 1
+    # GUI・エンジンと同じパックを使う（PAZMON_CONTENT もここで決めてワーカーに渡す）
+    pack = content.load_pack(content.pack_path(pack_path))
+    jobs = []
+    done = 0
+    chunk = 0
+    while done < runs:
+        n = min(chunk_size, runs - done)
+        jobs.append((seed, chunk, n, policy, max_turns, skills, items, pack.source, dungeon))
+        done += n
+        chunk += 1
+
+    total = Tally([en.name for en in pack.new_enemies(dungeon)])
+    if workers == 1:
+        for job in jobs:
+            total.merge(_worker(job))
+        return total
+    with mp.Pool(workers) as pool:
+        for part in pool.imap_unordered(_worker, jobs):
+            total.merge(part)
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ダンジョン攻略のモンテカルロ・シミュレーション")
+    parser.add_argument("--runs", type=int, default=10000)
+    parser.add_argument("--policy", choices=sorted(POLICIES), default="greedy")
+    parser.add_argument("--workers", type=int, default=0, help="0 で CPU 数")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-turns", type=int, default=500)
+    parser.add_argument("--no-skills", action="store_true", help="スキルを使わない")
+    parser.add_argument("--items", action="store_true", help="薬草/お守りを使う")
+    parser.add_argument("--content", help="コンテンツパック（省略時は PAZMON_CONTENT か content/default.json）")
+    parser.add_argument("--dungeon", default="default")
+    parser.add_argument("--json", help="結果を JSON で書き出すパス")
+    args = parser.parse_args()
+
+    t = time.perf_counter()
+    tally = simulate(args.runs, args.policy, args.workers, args.seed,
+                     args.max_turns, not args.no_skills, args.items,
+                     pack_path=args.content, dungeon=args.dungeon)
+    elapsed = time.perf_counter() - t
+    rep = report(tally)
+    rep["policy"] = args.policy
+    rep["seconds"] = round(elapsed, 3)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rep, f, ensure_ascii=False, indent=2)
+    print(f"{rep['runs']} runs ({args.policy}) in {elapsed:.1f}s, "
+          f"win rate {rep['win_rate']:.2%}")
+    for name, s in rep["turns_per_enemy"].items():
+        if s["count"]:
+            print(f"  {name}: {s['count']} kills, turns mean {s['mean']} p90 {s['p90']}")
+    print(f"  damage: {rep['damage']}")
+    print(f"  heal  : {rep['heal']}")
+    print(f"  skills: {rep['skill_usage']}")
+    if rep["deaths"]:
+        print(f"  deaths: {rep['deaths']}")
+    if rep["timeouts"]:
+        print(f"  timeouts: {rep['timeouts']}（{args.max_turns} ターンで打ち切り）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""最善手ソルバー（ヒント表示とオートプレイ用）
+
+唯一の操作「スロット i の宝石を j までドラッグ」を全部（14×13 通り）試し、
+今の敵に対する見込みダメージで順位を付ける。連鎖の 2 段目以降は補充の乱数に
+よるので、指定した深さまで補充をサンプリングして期待値をとる。
+途中の盤面の評価は盤面ハッシュをキーにした置換表に覚えておく。
+盤面は pazmon_bitboard の整数表現のまま扱い、リストは作らない。
+W×H の盤面（engine.Grid）は整数表現を使わず、最初に消えるまとまりだけで比べる。
+"""
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+import pazmon_bitboard as bits
+import pazmon_engine as engine
+
+# 盤面を 1 スロット 3 ビットで詰めた整数（置換表のキー）
+board_key = bits.from_list
+# W×H の盤面でこれより大きいと、全部の組ではなく近くへのドラッグだけを試す
+GRID_ALL_PAIRS = 64
+GRID_NEAR = 2
+
+
+class Solver:
+    """見込みダメージが最大のドラッグを探す
+
+    depth   : 補充を何段先まで読むか（0 なら最初に消える並びだけ）
+    samples : 補充一回あたりのサンプル数
+    budget  : 一手あたりの持ち時間（秒）。浅い深さから順に読み、時間内に
+              読み切れた一番深い結果を使う。
+    """
+
+    def __init__(self, depth: int = 2, samples: int = 6, budget: float = 0.05,
+                 rng=None, table_size: int = 200000):
+        self.depth = depth
+        self.samples = samples
+        self.budget = budget
+        self.rng = rng if rng is not None else random.Random()
+        self.table_size = table_size
+        self.table: Dict[tuple, float] = {}
+        self._ctx = None
+        self.rules = engine.DEFAULT_RULES
+        self.hits = 0
+        self.misses = 0
+        self.last_depth = -1
+        self._n = engine.SLOT_COUNT
+
+    # ---------------- 評価 ----------------
+
+    def _set_context(self, state: engine.BattleState):
+        party = state.party
+        enemy = state.enemy
+        rules = self.rules = state.rules
+        self._n = len(state.field)
+        enemy_code = rules.code.get(enemy.element, -1)
+        # 宝石コード → 3 つ消えた時の基本ダメージ（コンボ・長さの倍率は run_value で掛ける）
+        gain = tuple(rules.attack_value(c, 3, 0, party, enemy, enemy_code)
+                     for c in range(len(rules.gems)))
+        lost = party.max_hp - party.hp
+        ctx = (gain, lost > 0)
+        if ctx != self._ctx:
+            # 敵や味方が変わったら覚えた評価は使えない
+            self.table.clear()
+            self._ctx = ctx
+        self._gain = gain
+        # 命は減っている時だけ価値がある（ダメージと同じ物差しで 1HP = 1）
+        self._heal_weight = 1.0 if lost > 0 else 0.0
+        self._pair_codes = [c for c in range(len(rules.gems)) if rules.attacker[c] >= 0]
+
+    def run_value(self, code: int, run_len: int, combo: int) -> float:
+        rules = self.rules
+        if code == rules.life:
+            return self._heal_weight * rules.heal_value(run_len, combo)
+        return self._gain[code] * rules.combo_coeff((run_len - 3) + combo)
+
+    def value(self, board: int, combo: int, depth: int) -> float:
+        """埋まった盤面（整数表現）から連鎖した時の見込みダメージ（combo はここまでのコンボ数）"""
+        key = (board, combo, depth)
+        v = self.table.get(key)
+        if v is not None:
+            self.hits += 1
+            return v
+        self.misses += 1
+
+        n = self._n
+        run = bits.leftmost_run(board, n)
+        if run is None:
+            v = 0.0
+        else:
+            start, L = run
+            v = self.run_value(bits.get(board, start), L, combo + 1)
+            if depth > 0:
+                rest = bits.collapse(board, start, L, n)
+                total = 0.0
+                for _ in range(self.samples):
+                    total += self.value(bits.fill_random(rest, self.rng, n), combo + 1, depth - 1)
+                v += total / self.samples
+
+        if len(self.table) >= self.table_size:
+            self.table.clear()
+        self.table[key] = v
+        return v
+
+    # ---------------- 探索 ----------------
+
+    def moves(self, field: List[str]) -> List[Tuple[Tuple[int, int], int]]:
+        """結果の盤面が同じになるドラッグはまとめて一つにする"""
+        seen = {}
+        n = len(field)
+        board = bits.from_list(field)
+        for src in range(n):
+            for dst in range(n):
+                if src == dst:
+                    continue
+                b = bits.drag(board, src, dst)
+                if b not in seen:
+                    seen[b] = (src, dst)
+        return [(mv, b) for b, mv in seen.items()]
+
+    def setup_value(self, board: int) -> float:
+        """何も消えない手どうしの順位付け用：次の手で揃えやすい隣り合う同色の数"""
+        codes = [bits.get(board, i) for i in range(self._n)]
+        pair = self._pair_codes
+        return sum(1 for a, b in zip(codes, codes[1:]) if a == b and a in pair)
+
+    # ---------------- W×H の盤面 ----------------
+
+    def grid_moves(self, grid: engine.Grid, field: List[str]) -> List[Tuple[Tuple[int, int], List[str]]]:
+        """W×H の盤面のドラッグと結果の盤面（同じ盤面になる手は一つにまとめる）"""
+        n = grid.size
+        seen = {}
+        for src in range(n):
+            if n <= GRID_ALL_PAIRS:
+                dsts = range(n)
+            else:
+                sx, sy = grid.xy(src)
+                dsts = [grid.index(x, y)
+                        for y in range(max(0, sy - GRID_NEAR), min(grid.h, sy + GRID_NEAR + 1))
+                        for x in range(max(0, sx - GRID_NEAR), min(grid.w, sx + GRID_NEAR + 1))
+                        if abs(x - sx) + abs(y - sy) <= GRID_NEAR]
+            for dst in dsts:
+                if src == dst:
+                    continue
+                f = list(field)
+                for k, nxt in grid.drag_path(src, dst):
+                    f[k], f[nxt] = f[nxt], f[k]
+                key = tuple(f)
+                if key not in seen:
+                    seen[key] = ((src, dst), f)
+        return list(seen.values())
+
+    def grid_value(self, grid: engine.Grid, field: List[str]) -> float:
+        """最初に消えるまとまりの見込みダメージ（補充の先は読まない）"""
+        rules = self.rules
+        v = 0.0
+        for combo, (elem, cells) in enumerate(grid.matches(field, rules.gems), 1):
+            v += self.run_value(rules.code[elem], len(cells), combo)
+        return v
+
+    def grid_setup_value(self, grid: engine.Grid, field: List[str]) -> float:
+        """何も消えない手どうしの順位付け用：横と縦に隣り合う同色の数"""
+        pair = self._pair_codes
+        code = self.rules.code
+        w = grid.w
+        count = 0
+        for i, e in enumerate(field):
+            if code.get(e, -1) not in pair:
+                continue
+            if (i + 1) % w and field[i + 1] == e:
+                count += 1
+            if i + w < grid.size and field[i + w] == e:
+                count += 1
+        return count
+
+    def rank(self, state: engine.BattleState, depth: int,
+             deadline: Optional[float] = None) -> Optional[List[Tuple[float, Tuple[int, int]]]]:
+        """全部の手を見込みの大きい順に（deadline を過ぎたら途中でやめて None）"""
+        self._set_context(state)
+        grid = state.grid
+        scored = []
+        if not grid.linear:
+            for mv, f in self.grid_moves(grid, state.field):
+                if deadline is not None and time.perf_counter() >= deadline:
+                    return None
+                v = self.grid_value(grid, f) + 1e-3 * self.grid_setup_value(grid, f) + 1e-6 * self.rng.random()
+                scored.append((v, mv))
+            scored.sort(key=lambda t: -t[0])
+            return scored
+        for mv, f in self.moves(state.field):
+            if deadline is not None and time.perf_counter() >= deadline:
+                return None
+            # 同点なら並びの作りやすさ、それも同じなら乱数で決める（同じ手を繰り返さない）
+            v = self.value(f, 0, depth) + 1e-3 * self.setup_value(f) + 1e-6 * self.rng.random()
+            scored.append((v, mv))
+        scored.sort(key=lambda t: -t[0])
+        return scored
+
+    def sampled_move(self, state: engine.BattleState, k: int = 16) -> Tuple[int, int]:
+        """でたらめな k 個のドラッグのうち、最初に消える分が一番大きい手（プレイアウト用の速い手）"""
+        self._set_context(state)
+        grid = state.grid
+        field = state.field
+        n = grid.size
+        rng = self.rng
+        board = board_key(field) if grid.linear else None
+        best, best_v = None, -1.0
+        for _ in range(k):
+            src, dst = rng.randrange(n), rng.randrange(n)
+            if src == dst:
+                continue
+            if board is not None:
+                v = self.value(bits.drag(board, src, dst), 0, 0)
+            else:
+                f = list(field)
+                for a, b in grid.drag_path(src, dst):
+                    f[a], f[b] = f[b], f[a]
+                v = self.grid_value(grid, f)
+            if v > best_v:
+                best, best_v = (src, dst), v
+        return best if best is not None else (0, 1 % n)
+
+    def best_move(self, state: engine.BattleState, budget: Optional[float] = None) -> Tuple[int, int]:
+        """持ち時間内で読み切れた一番深い評価での最善手
+
+        深さ 0 は必ず読み切る。それより深い読みは持ち時間を過ぎたら途中で捨てる。
+        """
+        budget = self.budget if budget is None else budget
+        deadline = time.perf_counter() + budget
+        best = None
+        self.last_depth = -1
+        # W×H の盤面は深さを読まないので一度だけ
+        depths = range(self.depth + 1) if state.grid.linear else range(1)
+        for depth in depths:
+            ranked = self.rank(state, depth, deadline if depth else None)
+            if ranked is None:
+                break
+            best = ranked[0][1]
+            self.last_depth = depth
+            if time.perf_counter() >= deadline:
+                break
+        return best
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"entries": len(self.table), "hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0, "last_depth": self.last_depth}
+
+
+def solver_policy(state: engine.BattleState, rng) -> Tuple[int, int]:
+    """pazmon_sim 用のポリシー"""
+    solver = getattr(solver_policy, "_solver", None)
+    if solver is None:
+        solver = solver_policy._solver = Solver(depth=1, samples=4, budget=0.01, rng=rng)
+    solver.rng = rng
+    return solver.best_move(state)
@@ -1,11 +1,769 @@
 import os
 import random
 import sys
+import threading
 import time
-from typing import List, Optional, Tuple
+from collections import OrderedDict, deque
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
 
 import pygame as pg
 
+import pazmon_engine as engine
+from pazmon_bot import SKILL, AutoBattle, describe
+from pazmon_solver import Solver
+
+
+# --------------------MonsterTextureStore begin.--------------------
+class MonsterTextureStore:
+    """モンスター画像のキャッシュ
+
+    (名前, サイズ, α) をキーに縮小済みサーフェスを保持し、
+    予算(バイト数)を超えたら最も古く使われたものから捨てる。
+    files は 名前 → assets/monsters/ のファイル名（パックの enemies.*.image）。
+    """
+
+    def __init__(self, files: Optional[Dict[str, str]] = None, budget_bytes: int = 32 * 1024 * 1024):
+        self.files = dict(files or {})
+        self.budget_bytes = budget_bytes
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[tuple, pg.Surface]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _surface_bytes(surf: pg.Surface) -> int:
+        return surf.get_width() * surf.get_height() * surf.get_bytesize()
+
+    def path_of(self, name: str) -> Optional[str]:
+        fn = self.files.get(name)
+        if fn:
+            path = os.path.join("assets", "monsters", fn)
+            if os.path.exists(path):
+                return path
+        return None
+
+    def decode(self, name: str, size: Tuple[int, int]) -> pg.Surface:
+        """ファイルを読んで縮小する（display を使わないのでワーカースレッドから呼べる）"""
+        path = self.path_of(name)
+        if path:
+            img = pg.image.load(path)
+            if img.get_bitsize() < 24:
+                img = img.convert(32, pg.SRCALPHA)
+            return pg.transform.smoothscale(img, size)
+        surf = pg.Surface(size, pg.SRCALPHA)
+        surf.fill((60, 60, 60, 200))
+        return surf
+
+    def _load(self, name: str, size: Tuple[int, int]) -> pg.Surface:
+        surf = self.decode(name, size)
+        return surf.convert_alpha() if pg.display.get_surface() is not None else surf
+
+    def put(self, name: str, surf: pg.Surface, size: Tuple[int, int] = (256, 256)):
+        """decode 済みの画像を登録する（メインスレッドで呼ぶ）"""
+        if pg.display.get_surface() is not None:
+            surf = surf.convert_alpha()
+        self._put((name, size, None), surf)
+
+    def resident(self, name: str, size: Tuple[int, int] = (256, 256)) -> bool:
+        with self._lock:
+            return (name, size, None) in self._cache
+
+    def _put(self, key: tuple, surf: pg.Surface):
+        with self._lock:
+            if key in self._cache:
+                return
+            self._cache[key] = surf
+            self.used_bytes += self._surface_bytes(surf)
+            # 予算超過分を古い順に捨てる（今入れたものは残す）
+            while self.used_bytes > self.budget_bytes and len(self._cache) > 1:
+                _, old = self._cache.popitem(last=False)
+                self.used_bytes -= self._surface_bytes(old)
+
+    def get(self, name: str, size: Tuple[int, int] = (256, 256), alpha: Optional[int] = None) -> pg.Surface:
+        """α を指定すると、その透明度を設定済みの別サーフェスを返す"""
+        if alpha is not None:
+            alpha = max(0, min(255, int(alpha)))
+        key = (name, size, alpha)
+        with self._lock:
+            surf = self._cache.get(key)
+            if surf is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return surf
+            self.misses += 1
+        if alpha is None:
+            surf = self._load(name, size)
+        else:
+            surf = self.get(name, size).copy()
+            surf.set_alpha(alpha)
+        self._put(key, surf)
+        return surf
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.used_bytes = 0
+
+# --------------------MonsterTextureStore end.--------------------
+
+# --------------------FontRegistry begin.--------------------
+class FontRegistry:
+    """フォントの共有レジストリ
+
+    フォントファイルの場所は最初の一回だけ解決し、
+    pg.font.Font はサイズごとに一つだけ作って使い回す。
+    """
+
+    BUNDLE = os.path.join("assets", "fonts", "misaki_mincho.ttf")
+    CANDIDATES = [
+        "Noto Sans CJK JP", "Noto Sans JP",
+        "Yu Gothic UI", "Yu Gothic",
+        "Meiryo", "MS Gothic",
+        "Hiragino Sans", "Hiragino Kaku Gothic ProN",
+    ]
+
+    def __init__(self):
+        self._fonts: Dict[int, pg.font.Font] = {}
+        self._resolved = False
+        self._path: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.file_opens = 0
+
+    def resolve_path(self) -> Optional[str]:
+        """同梱フォント → システムの候補フォント の順に探す（結果はキャッシュ）"""
+        if not self._resolved:
+            self._path = None
+            if os.path.exists(self.BUNDLE):
+                self._path = self.BUNDLE
+            else:
+                for name in self.CANDIDATES:
+                    path = pg.font.match_font(name)
+                    if path:
+                        self._path = path
+                        break
+            self._resolved = True
+        return self._path
+
+    def get(self, size: int) -> pg.font.Font:
+        size = int(size)
+        f = self._fonts.get(size)
+        if f is not None:
+            self.hits += 1
+            return f
+        self.misses += 1
+        f = self._fonts[size] = self.open(size)
+        return f
+
+    def open(self, size: int) -> pg.font.Font:
+        """登録せずにフォントを開く（AssetLoader のワーカーから呼ぶ）"""
+        path = self.resolve_path()
+        self.file_opens += 1
+        if path:
+            return pg.font.Font(path, size)
+        return pg.font.SysFont(None, size)
+
+    def put(self, size: int, font: pg.font.Font):
+        self._fonts.setdefault(int(size), font)
+
+    def peek(self, size: int) -> Optional[pg.font.Font]:
+        """読み込み済みならそのフォント、まだなら None（開きには行かない）"""
+        return self._fonts.get(int(size))
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses,
+                "file_opens": self.file_opens, "sizes": sorted(self._fonts)}
+
+    def clear(self):
+        self._fonts.clear()
+        self._resolved = False
+
+
+FONTS = FontRegistry()
+
+# --------------------FontRegistry end.--------------------
+
+# --------------------TextCache begin.--------------------
+class TextCache:
+    """font.render の結果を (フォント, 文字列, 色, AA) をキーに LRU で保持する"""
+
+    def __init__(self, max_entries: int = 512):
+        self.max_entries = max_entries
+        self._cache: "OrderedDict[tuple, pg.Surface]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.frame_renders = 0
+        self.last_frame_renders = 0
+
+    def render(self, font: pg.font.Font, text: str, antialias: bool, color: Tuple) -> pg.Surface:
+        key = (font, text, tuple(color), bool(antialias))
+        surf = self._cache.get(key)
+        if surf is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return surf
+        self.misses += 1
+        self.frame_renders += 1
+        surf = font.render(text, antialias, color)
+        self._cache[key] = surf
+        if len(self._cache) > self.max_entries:
+            self._cache.popitem(last=False)
+        return surf
+
+    def begin_frame(self):
+        self.last_frame_renders = self.frame_renders
+        self.frame_renders = 0
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hit_rate(), "entries": len(self._cache),
+                "last_frame_renders": self.last_frame_renders}
+
+    def clear(self):
+        self._cache.clear()
+
+
+TEXT_CACHE = TextCache()
+
+# --------------------TextCache end.--------------------
+
+# --------------------BarWidget begin.--------------------
+class BarWidget:
+    """HP/SP バー一本分
+
+    サーフェスは最初に一枚だけ作り、描く幅や色が変わった時だけ塗り直す。
+    speed > 0 の時は表示中の値（shown）を毎秒 speed の割合で目標に近づける
+    （advance で進める。途中もサーフェスは作り直さない）。
+    """
+    HP_SCALE = 600.0   # HP バーはこの最大 HP を全幅にする
+
+    def __init__(self, w: int, h: int, stats: Optional["BarCache"] = None, speed: float = 0.0):
+        self.w = w
+        self.h = h
+        self.speed = speed
+        self.stats = stats
+        self.surf = pg.Surface((w, h), pg.SRCALPHA)
+        if stats is not None:
+            stats.allocations += 1
+            stats.frame_allocations += 1
+        self.kind = "hp"
+        self.shown: Optional[float] = None
+        self.target = 0.0
+        self.max = 0
+        self.color: Optional[Tuple] = None
+        self._painted = None
+
+    def _set(self, kind: str, value: float, max_value: float, color=None):
+        self.kind = kind
+        self.target = value
+        self.max = max_value
+        self.color = color
+        if self.shown is None or self.speed <= 0:
+            self.shown = value
+
+    def advance(self, dt: float) -> bool:
+        """表示中の値を目標へ進める（動いたら True）"""
+        if self.shown is None or self.shown == self.target:
+            return False
+        d = self.target - self.shown
+        step = d * min(1.0, dt * self.speed)
+        self.shown = self.target if abs(d - step) < 0.5 else self.shown + step
+        return True
+
+    def _layout(self) -> tuple:
+        ratio = max(0, min(1, self.shown / self.max if self.max > 0 else 0))
+        if self.kind == "sp":
+            return self.w, int(self.w * ratio), self.color
+        bar_w = int(self.w * min(1.0, self.max / self.HP_SCALE))
+        if ratio >= 0.6:
+            col = (40, 200, 90)
+        elif ratio >= 0.3:
+            col = (230, 200, 60)
+        else:
+            col = (230, 70, 70)
+        return bar_w, int(bar_w * ratio), col
+
+    def surface(self) -> pg.Surface:
+        key = self._layout()
+        if key != self._painted:
+            bar_w, fill_w, col = key
+            # 塗りつぶし（合成しない）なので、半透明の背景の上に不透明の中身を重ねた見た目になる
+            self.surf.fill((0, 0, 0, 0))
+            self.surf.fill((0, 0, 0, 120), (0, 0, bar_w, self.h))
+            if fill_w > 0:
+                self.surf.fill(col, (0, 0, fill_w, self.h))
+            self._painted = key
+            if self.stats is not None:
+                self.stats.repaints += 1
+                self.stats.frame_repaints += 1
+        return self.surf
+
+    def hp(self, current: float, max_hp: float) -> pg.Surface:
+        self._set("hp", current, max_hp)
+        return self.surface()
+
+    def sp(self, sp: float, need_sp: float, color: Tuple) -> pg.Surface:
+        self._set("sp", sp, need_sp, tuple(color))
+        return self.surface()
+
+
+class BarCache:
+    """名前（"enemy" や ("sp", 0)）ごとの BarWidget と、作成・塗り直しの回数"""
+
+    def __init__(self, speed: float = 0.0):
+        self.speed = speed
+        self._bars: Dict[object, BarWidget] = {}
+        self.version = 0   # アニメーションで表示が動くたびに増える（差分描画のシグネチャ用）
+        self.allocations = 0
+        self.repaints = 0
+        self.frame_allocations = 0
+        self.frame_repaints = 0
+        self.last_frame_allocations = 0
+        self.last_frame_repaints = 0
+
+    def _bar(self, key, w: int, h: int) -> BarWidget:
+        bar = self._bars.get(key)
+        if bar is None or (bar.w, bar.h) != (w, h):
+            bar = self._bars[key] = BarWidget(w, h, self, self.speed)
+        return bar
+
+    def hp(self, key, current: float, max_hp: float, w: int, h: int) -> pg.Surface:
+        return self._bar(key, w, h).hp(current, max_hp)
+
+    def sp(self, key, sp: float, need_sp: float, color: Tuple, w: int, h: int) -> pg.Surface:
+        return self._bar(key, w, h).sp(sp, need_sp, color)
+
+    @property
+    def animating(self) -> bool:
+        return any(bar.shown is not None and bar.shown != bar.target for bar in self._bars.values())
+
+    def advance(self, dt: float) -> bool:
+        moved = False
+        for bar in self._bars.values():
+            moved = bar.advance(dt) or moved
+        if moved:
+            self.version += 1
+        return moved
+
+    def begin_frame(self):
+        self.last_frame_allocations = self.frame_allocations
+        self.last_frame_repaints = self.frame_repaints
+        self.frame_allocations = 0
+        self.frame_repaints = 0
+
+    def stats(self) -> dict:
+        return {"bars": len(self._bars), "allocations": self.allocations, "repaints": self.repaints,
+                "last_frame_allocations": self.last_frame_allocations,
+                "last_frame_repaints": self.last_frame_repaints}
+
+    def clear(self):
+        self._bars.clear()
+
+
+BARS = BarCache()
+
+# --------------------BarWidget end.--------------------
+
+# --------------------AssetLoader begin.--------------------
+class AssetLoader:
+    """ダンジョンで使う assets/ のファイルをワーカースレッドで読み込む
+
+    ジョブは (名前, decode, finish)。ワーカーは decode()（画像の読み込みと縮小、
+    フォントを開く）だけを順に行い、display に触る convert_alpha や各キャッシュへの
+    登録は finish(結果) としてメインループの poll() で行う。タイトル画面は
+    progress を見てバーを描き、ready になるまでスタートさせない。
+    """
+
+    def __init__(self, jobs: List[Tuple[str, Callable, Callable]]):
+        self.jobs = jobs
+        self.done = 0
+        self.errors: List[str] = []
+        self.seconds = 0.0
+        self._results: deque = deque()
+        self._thread: Optional[threading.Thread] = None
+        self._t0 = 0.0
+
+    @property
+    def total(self) -> int:
+        return len(self.jobs)
+
+    @property
+    def ready(self) -> bool:
+        return self.done >= self.total
+
+    @property
+    def progress(self) -> float:
+        return self.done / self.total if self.total else 1.0
+
+    def start(self):
+        self._t0 = pg.time.get_ticks()
+
+        def work():
+            for i, (name, decode, _) in enumerate(self.jobs):
+                try:
+                    self._results.append((i, decode(), None))
+                except Exception as e:
+                    # 何が起きても結果は積む（積まないと ready にならずタイトルで止まる）
+                    self._results.append((i, None, e))
+
+        self._thread = threading.Thread(target=work, daemon=True)
+        self._thread.start()
+
+    def poll(self, limit: int = 8) -> int:
+        """読み終わった分を limit 個までメインスレッドで仕上げる（仕上げた数を返す）
+
+        ファイルが無い・壊れている以外の例外は、ワーカーで起きたものもここで上げる。
+        """
+        n = 0
+        while n < limit and self._results:
+            i, result, err = self._results.popleft()
+            name = self.jobs[i][0]
+            self.done += 1
+            n += 1
+            if err is None:
+                self.jobs[i][2](result)
+            elif isinstance(err, (pg.error, OSError)):
+                # 読めなかったものは描画時の代わりの絵/フォントに任せる
+                self.errors.append(f"{name}: {err}")
+            else:
+                raise RuntimeError(f"{name} の読み込みに失敗した") from err
+        if n and self.ready:
+            self.seconds = (pg.time.get_ticks() - self._t0) / 1000.0
+        return n
+
+    def wait(self):
+        """全部読み終わるまで待って仕上げる（再生など、待ってよい時用）"""
+        if self._thread is not None:
+            self._thread.join()
+        self.poll(self.total)
+
+
+def dungeon_asset_jobs(gss, item, enemies, font_sizes: Iterable[int]) -> List[Tuple[str, Callable, Callable]]:
+    """このダンジョンで使うフォント・敵画像・アイテムアイコンの読み込みジョブ
+
+    フォントを先に並べる（タイトル画面の文字がすぐ出るように）。
+    """
+    jobs = []
+    for size in dict.fromkeys(font_sizes):
+        jobs.append((f"font:{size}", lambda size=size: FONTS.open(size),
+                     lambda f, size=size: FONTS.put(size, f)))
+
+    for name in dict.fromkeys(en.name for en in enemies):
+        jobs.append((f"monster:{name}", lambda name=name: gss.textures.decode(name, (256, 256)),
+                     lambda surf, name=name: gss.textures.put(name, surf)))
+
+    icons: List[Optional[pg.Surface]] = [None] * item.number_of_item
+
+    def icon_done(i, surf):
+        icons[i] = surf
+        if all(icon is not None for icon in icons):
+            item.build_atlas(icons)
+
+    for i in range(item.number_of_item):
+        jobs.append((f"icon:{item.icon_files[i]}", lambda i=i: item.decode_icon(i),
+                     lambda surf, i=i: icon_done(i, surf)))
+    return jobs
+
+# --------------------AssetLoader end.--------------------
+
+# --------------------DirtyRenderer begin.--------------------
+class DirtyRenderer:
+    """変化した領域だけを描き直して pg.display.update に渡す
+
+    領域は (キー, 矩形, シグネチャ, 描画関数) で渡す。シグネチャが前フレームと
+    同じ領域は描かない。ドラッグ中の宝石のような重ね描きはオーバーレイとして
+    最後に描き、動いたら前の位置の下にある領域ごと描き直す。
+    enabled=False の時は毎フレーム全画面を描いて flip する（比較用）。
+    """
+
+    def __init__(self, screen: pg.Surface, bg: Tuple, enabled: bool = True):
+        self.screen = screen
+        self.bg = bg
+        self.enabled = enabled
+        self._sigs: Dict[str, object] = {}
+        self._overlay: Optional[tuple] = None
+        self._dirty: List[pg.Rect] = []
+        self._full = True
+        self._scene = None
+        self.last_rect_count = 0
+        self.full_repaints = 0
+
+    def invalidate(self):
+        """次の present で全画面を描き直す"""
+        self._full = True
+
+    def toggle(self):
+        self.enabled = not self.enabled
+        self.invalidate()
+
+    def scene(self, key):
+        """場面（タイトル/戦闘/クリア…）が変わったら全画面描き直し"""
+        if key != self._scene:
+            self._scene = key
+            self.invalidate()
+
+    def mark(self, rect: pg.Rect):
+        self._dirty.append(pg.Rect(rect))
+
+    def draw(self, regions, overlay=None):
+        """regions: [(key, rect, sig, fn)], overlay: (sig, rect, fn) または None"""
+        if not self.enabled or self._full:
+            self.screen.fill(self.bg)
+            self._sigs.clear()
+            for key, rect, sig, fn in regions:
+                self._sigs[key] = sig
+                fn()
+            if overlay is not None:
+                overlay[2]()
+            self._overlay = overlay[:2] if overlay is not None else None
+            self._full = True
+            return
+
+        need = [self._sigs.get(key, self) != sig for key, rect, sig, fn in regions]
+        prev = self._overlay
+        if prev is None or overlay is None:
+            ov_changed = prev is not overlay
+        else:
+            ov_changed = prev[0] != overlay[0]
+        if not ov_changed and overlay is not None:
+            # 下の領域が描き直されるなら重ね描きもやり直す
+            ov_changed = any(n and rect.colliderect(overlay[1])
+                             for n, (key, rect, sig, fn) in zip(need, regions))
+
+        erase = []
+        if ov_changed and prev is not None:
+            erase.append(prev[1])
+            self.screen.fill(self.bg, prev[1])
+            self._dirty.append(prev[1])
+
+        for n, (key, rect, sig, fn) in zip(need, regions):
+            if n or rect.collidelist(erase) >= 0:
+                self.screen.fill(self.bg, rect)
+                self._sigs[key] = sig
+                fn()
+                self._dirty.append(rect)
+
+        if overlay is not None and ov_changed:
+            overlay[2]()
+            self._dirty.append(overlay[1])
+        self._overlay = overlay[:2] if overlay is not None else None
+
+    def present(self):
+        if not self.enabled or self._full:
+            pg.display.flip()
+            self.full_repaints += 1
+            self.last_rect_count = 1
+        else:
+            clip = self.screen.get_rect()
+            rects = [r.clip(clip) for r in self._dirty]
+            rects = [r for r in rects if r.width and r.height]
+            if rects:
+                pg.display.update(rects)
+            self.last_rect_count = len(rects)
+        self._dirty = []
+        self._full = False
+
+# --------------------DirtyRenderer end.--------------------
+
+# --------------------FrameProfiler begin.--------------------
+class FrameProfiler:
+    """メインループの各フェーズの時間を毎フレーム測る
+
+    begin() でフレームを始め、enter(フェーズ) で「ここから先はこのフェーズ」と
+    切り替える（前のフェーズにはそこまでの時間が付く）。描画関数は wrap() で包む。
+    直近 window フレームの p50/p95/p99/max を持ち、visible なら画面に出す。
+    待ち（wait）を除いた時間が budget を超えたフレームは一番重かったフェーズと
+    一緒に flagged に残す。csv_path を渡すと 1 フレーム 1 行で書き出す。
+    """
+
+    PHASES = ("events", "logic", "anim", "draw_top", "draw_field", "items", "draw", "present", "wait")
+    OVERLAY_POS = (640, 4)
+
+    def __init__(self, budget: float = 1 / 60, window: int = 300, csv_path: Optional[str] = None):
+        self.budget = budget
+        self.frame = 0
+        self.visible = False
+        self.over_budget = 0
+        self.flagged: deque = deque(maxlen=6)   # (フレーム, ミリ秒, 一番重いフェーズ)
+        self._hist = {p: deque(maxlen=window) for p in self.PHASES + ("total",)}
+        self._acc = dict.fromkeys(self.PHASES, 0.0)
+        self._cur = "events"
+        self._t = 0.0
+        self._panel: Optional[pg.Surface] = None
+        self._csv = None
+        if csv_path:
+            self._csv = open(csv_path, "w", encoding="utf-8")
+            self._csv.write(",".join(("frame", "total_ms") + self.PHASES + ("over",)) + "\n")
+
+    def begin(self):
+        for p in self._acc:
+            self._acc[p] = 0.0
+        self._cur = "events"
+        self._t = time.perf_counter()
+
+    def enter(self, phase: str) -> str:
+        """ここまでの時間を今のフェーズに付けて phase に切り替える（前のフェーズを返す）"""
+        now = time.perf_counter()
+        self._acc[self._cur] += now - self._t
+        self._t = now
+        prev, self._cur = self._cur, phase
+        return prev
+
+    def wrap(self, phase: str, fn: Callable) -> Callable:
+        def run():
+            prev = self.enter(phase)
+            try:
+                return fn()
+            finally:
+                self.enter(prev)
+        return run
+
+    def end(self):
+        self.enter(self._cur)
+        acc = self._acc
+        work = sum(acc.values()) - acc["wait"]
+        for p, v in acc.items():
+            self._hist[p].append(v)
+        self._hist["total"].append(work)
+        over = work > self.budget
+        if over:
+            self.over_budget += 1
+            heavy = max((p for p in self.PHASES if p != "wait"), key=acc.__getitem__)
+            self.flagged.append((self.frame, work * 1000, heavy))
+        if self._csv is not None:
+            self._csv.write(f"{self.frame},{work * 1000:.3f},"
+                            + ",".join(f"{acc[p] * 1000:.3f}" for p in self.PHASES)
+                            + f",{int(over)}\n")
+        if self.visible and self.frame % 15 == 0:
+            self._panel = None   # 表示は 15 フレームごとに作り直す
+        self.frame += 1
+
+    def stats(self) -> Dict[str, dict]:
+        """フェーズ → {p50, p95, p99, max}（ミリ秒）"""
+        out = {}
+        for p, hist in self._hist.items():
+            if not hist:
+                continue
+            xs = sorted(hist)
+            n = len(xs) - 1
+            out[p] = {"p50": xs[n // 2] * 1000, "p95": xs[int(n * 0.95)] * 1000,
+                      "p99": xs[int(n * 0.99)] * 1000, "max": xs[-1] * 1000}
+        return out
+
+    def toggle(self):
+        self.visible = not self.visible
+        self._panel = None
+
+    def draw(self, screen, font, extra: Iterable[str] = ()) -> Optional[pg.Rect]:
+        """右上に表を描く（extra は下に足す行。font が無い間は描かない）"""
+        if font is None:
+            return None
+        if self._panel is None:
+            lines = ["phase        p50   p95   p99   max"]
+            for p, st in self.stats().items():
+                lines.append(f"{p:10s}" + "".join(f"{st[k]:6.1f}" for k in ("p50", "p95", "p99", "max")))
+            lines.append(f"over budget: {self.over_budget}")
+            lines.extend(extra)
+            for frame, ms, heavy in self.flagged:
+                lines.append(f"  #{frame} {ms:.1f}ms {heavy}")
+            rows = [font.render(line, False, (230, 230, 140)) for line in lines]
+            h = sum(r.get_height() for r in rows)
+            panel = pg.Surface((max(r.get_width() for r in rows) + 8, h + 8))
+            panel.fill((0, 0, 0))
+            y = 4
+            for r in rows:
+                panel.blit(r, (4, y))
+                y += r.get_height()
+            self._panel = panel
+        return screen.blit(self._panel, self.OVERLAY_POS)
+
+    def close(self):
+        if self._csv is not None:
+            self._csv.close()
+            self._csv = None
+
+# --------------------FrameProfiler end.--------------------
+
+# --------------------GemSprites begin.--------------------
+class GemSprites:
+    """宝石の絵（丸・記号、ドラッグ用は影も）を一度だけ描いて使い回す
+
+    (属性, 半径, フォント, 影) ごとに一枚。SLOT_W・DRAG_SCALE・影の色・
+    COLOR_RGB・ELEMENT_SYMBOLS のどれかが変わったら sync() で全部捨てて描き直す。
+    """
+
+    def __init__(self, settings: "SettingsOfPazmon"):
+        self.settings = settings
+        self._sprites: Dict[tuple, Tuple[pg.Surface, int]] = {}
+        self._sig = None
+        self.builds = 0
+        self.rebuilds = 0
+
+    TILE_KEY = (255, 0, 255)
+
+    def sync(self):
+        g = self.settings
+        sig = (g.SLOT_W, g.DRAG_SCALE, g.DRAG_SHADOW,
+               tuple(g.COLOR_RGB.items()), tuple(g.ELEMENT_SYMBOLS.items()))
+        if sig != self._sig:
+            if self._sig is not None:
+                self.rebuilds += 1
+            self._sprites.clear()
+            self._sig = sig
+
+    def get(self, elem: str, r: int, font, shadow: bool = False) -> Tuple[pg.Surface, int]:
+        """(絵, 中心までの距離)。中心を (x, y) に置くなら (x-距離, y-距離) に blit する"""
+        key = (elem, r, font, shadow)
+        hit = self._sprites.get(key)
+        if hit is None:
+            hit = self._sprites[key] = self._build(elem, r, font, shadow)
+        return hit
+
+    def _build(self, elem: str, r: int, font, shadow: bool) -> Tuple[pg.Surface, int]:
+        g = self.settings
+        sym = TEXT_CACHE.render(font, g.ELEMENT_SYMBOLS[elem], True, (0, 0, 0))
+        half = max(r + 3 if shadow else r + 1, (sym.get_width() + 1) // 2, (sym.get_height() + 1) // 2)
+        surf = pg.Surface((half * 2, half * 2), pg.SRCALPHA)
+        if shadow:
+            pg.draw.circle(surf, g.DRAG_SHADOW, (half, half), r + 3)
+        pg.draw.circle(surf, g.COLOR_RGB[elem], (half, half), r)
+        surf.blit(sym, (half - sym.get_width() // 2, half - sym.get_height() // 2))
+        if pg.display.get_surface() is not None:
+            surf = surf.convert_alpha()
+        self.builds += 1
+        return surf, half
+
+    def tile(self, elem: Optional[str], base: Tuple, r: int, font) -> pg.Surface:
+        """スロット一つ分（角丸の下地＋宝石）。elem=None なら下地だけ
+
+        角の外はカラーキーで抜くので、α を使わない速い blit で置ける。
+        """
+        key = ("tile", elem, base, r, font)
+        hit = self._sprites.get(key)
+        if hit is None:
+            w = self.settings.SLOT_W
+            surf = pg.Surface((w, w))
+            surf.fill(self.TILE_KEY)
+            surf.set_colorkey(self.TILE_KEY)
+            pg.draw.rect(surf, base, (0, 0, w, w), border_radius=8)
+            if elem is not None:
+                gem, half = self.get(elem, r, font)
+                surf.blit(gem, (w // 2 - half, w // 2 - half))
+            if pg.display.get_surface() is not None:
+                surf = surf.convert()
+            hit = self._sprites[key] = (surf, 0)
+            self.builds += 1
+        return hit[0]
+
+    def stats(self) -> dict:
+        return {"sprites": len(self._sprites), "builds": self.builds, "rebuilds": self.rebuilds}
+
+# --------------------GemSprites end.--------------------
 
 # --------------------SettingsOfPazmon begin.--------------------
 class SettingsOfPazmon:
@@ -33,54 +791,91 @@ class SettingsOfPazmon:
         }
 
         self.GEMS = ["火", "水", "風", "土", "命"]
-        self.SLOTS = [chr(ord('A')+i) for i in range(14)]
+        # 盤面の形（GRID_H = 1 なら横一列、それ以外は W×H。set_grid で変える）
+        self.GRID_W = 14
+        self.GRID_H = 1
 
         # その他 可変パラメータ
         self.FRAME_DELAY = 0.2
         self.ENEMY_DELAY = 0.3
+        self.INSTANT_ANIMATION = False  # True でアニメーションを全部飛ばす
+        # ヒント/オートプレイの読みの深さと一手の持ち時間（秒）
+        self.SOLVER_DEPTH = 2
+        self.SOLVER_BUDGET = 0.05
+        # オートバトル（B）の一手の持ち時間（秒、環境変数 PAZMON_BOT_BUDGET で変えられる）
+        self.BOT_BUDGET = 1.0
+        # HP/SP バーが新しい値へ近づく速さ（1秒あたりの割合、0 ならすぐ変わる）
+        self.BAR_ANIM_SPEED = 0.0
         self.WIN_W = 980
         self.WIN_H = 720
         self.FIELD_Y = 520
         self.SLOT_W = 60
         self.SLOT_PAD = 8
         self.LEFT_MARGIN = 30
+        # 盤面が大きい時はスロットをこの大きさまで縮める。W×H の盤面の高さの上限
+        self.MAX_SLOT_W = 60
+        self.MIN_SLOT_W = 12
+        self.FIELD_MAX_H = 240
+
+        # 差分描画（pg.display.update に渡す矩形で描く）
+        self.DIRTY_RECTS = True
+        self.BG_COLOR = (22, 22, 28)
+        # 描画領域（差分描画用、互いに重ならないこと）
+        self.ENEMY_IMG_RECT = pg.Rect(0, 0, 310, 440)
+        self.ENEMY_STATUS_RECT = pg.Rect(310, 30, self.WIN_W - 310, 80)
+        self.PARTY_RECT = pg.Rect(310, 110, self.WIN_W - 310, 62)
+        self.SKILL_RECT = pg.Rect(500, 240, self.WIN_W - 500, 195)
+        self.MESSAGE_RECT = pg.Rect(0, 450, self.WIN_W, 40)
+        self.FIELD_RECT = pg.Rect(0, self.FIELD_Y - 30, self.WIN_W, self.SLOT_W + 40)
+        self.ITEM_RECT = pg.Rect(0, 645, self.WIN_W, 60)
+
+        # モンスター画像キャッシュ
+        self.textures = MonsterTextureStore(engine.enemy_images())
+        # 宝石の絵のキャッシュ
+        self.gem_sprites = GemSprites(self)
+        # 起動時に AssetLoader で開いておくフォントの大きさ（タイトル用を先に）
+        self.TITLE_FONT_SIZES = (73, 17)
+        self.GAME_FONT_SIZES = (30, 40, 26, int(26*self.DRAG_SCALE))
+        self.PROGRESS_RECT = (290, 380, 400, 14)
+        self.set_grid(self.GRID_W, self.GRID_H)
+
+    # ---------------- 盤面の形 ----------------
+
+    def set_grid(self, w: int, h: int = 1):
+        """盤面の形を変え、スロットの大きさと盤面から下の配置を決め直す
+
+        14 スロットの横一列なら今までと同じ配置。W×H の盤面は画面の中央に置き、
+        FIELD_MAX_H に収まるまでスロットを縮め、増えた高さの分だけウィンドウを伸ばす。
+        """
+        grid = engine.Grid(w, h)
+        self.GRID = grid
+        self.GRID_W, self.GRID_H = w, h
+        self.SLOT_COUNT = grid.size
+        self.SLOTS = [grid.label(i) for i in range(grid.size)]
+
+        pad = self.SLOT_PAD
+        side = min(self.MAX_SLOT_W, (self.WIN_W - self.LEFT_MARGIN + pad) // w - pad)
+        if h > 1:
+            side = min(side, (self.FIELD_MAX_H + pad) // h - pad)
+        self.SLOT_W = max(self.MIN_SLOT_W, side)
+        step = self.SLOT_W + pad
+        field_w, field_h = w * step - pad, h * step - pad
+        self.FIELD_X = self.LEFT_MARGIN if h == 1 else (self.WIN_W - field_w) // 2
+        self.FIELD_H = field_h
+
+        extra = max(0, field_h - self.MAX_SLOT_W)
+        self.WIN_H = 720 + extra
+        self.FIELD_RECT = pg.Rect(0, self.FIELD_Y - 30, self.WIN_W, field_h + 40)
+        self.ITEM_RECT = pg.Rect(0, 645 + extra, self.WIN_W, 60)
 
     # ---------------- フォント解決 ----------------
 
     def get_jp_font(self, size: int) -> pg.font.Font:
-        bundle = os.path.join("assets", "fonts", "misaki_mincho.ttf")
-        if os.path.exists(bundle):
-            return pg.font.Font(bundle, size)
-        candidates = [
-            "Noto Sans CJK JP", "Noto Sans JP",
-            "Yu Gothic UI", "Yu Gothic",
-            "Meiryo", "MS Gothic",
-            "Hiragino Sans", "Hiragino Kaku Gothic ProN",
-        ]
-        for name in candidates:
-            path = pg.font.match_font(name)
-            if path:
-                return pg.font.Font(path, size)
-            return pg.font.SysFont(None, size)
+        return FONTS.get(size)
 
     # ---------------- 画像 ----------------
-    def load_monster_image(self, name: str) -> pg.Surface:
-        self.m = {
-            "スライム": "slime.png",
-            "ゴブリン": "goblin.png",
-            "オオコウモリ": "bat.png",
-            "ウェアウルフ": "werewolf.png",
-            "ドラゴン": "dragon.png"
-        }
-        fn = self.m.get(name)
-        if fn:
-            path = os.path.join("assets", "monsters", fn)
-            if os.path.exists(path):
-                img = pg.image.load(path).convert_alpha()
-                return pg.transform.smoothscale(img, (256, 256))
-        surf = pg.Surface((256, 256), pg.SRCALPHA)
-        surf.fill((60, 60, 60, 200))
-        return surf
+    def load_monster_image(self, name: str, alpha: Optional[int] = None) -> pg.Surface:
+        return self.textures.get(name, (256, 256), alpha)
 
 # --------------------SettingsOfPazmon end.--------------------
 
@@ -93,149 +888,90 @@ class GameSystemSettings(SettingsOfPazmon):
         super().__init__()
 
     def sp_bar_surf(self, sp: int, need_sp: int, color: Tuple, w: int, h: int) -> pg.Surface:
-        ratio = max(0, min(1, sp / need_sp if need_sp > 0 else 0))
-        bar_w = w
-        fill_w = int(bar_w * ratio)
-        # バー描画
-        surf = pg.Surface((w, h), pg.SRCALPHA)
-        # 背景（透明）
-        bg = pg.Surface((bar_w, h), pg.SRCALPHA)
-        bg.fill((0, 0, 0, 120))
-        surf.blit(bg, (0, 0))
-        # 黄色バー
-        fg = pg.Surface((fill_w, h), pg.SRCALPHA)
-        fg.fill(color)
-        surf.blit(fg, (0, 0))
-        return surf
+        """その場限りの SP バー（毎フレーム描く所は BARS.sp を使う）"""
+        return BarWidget(w, h, BARS).sp(sp, need_sp, color)
 
     # ---------------- HPバー ----------------
 
     def hp_bar_surf(self, current: int, max_hp: int, w: int, h: int) -> pg.Surface:
-        """HPバー（max600基準でスケーリング）"""
-        # HP比（0〜1）
-        ratio = max(0, min(1, current / max_hp if max_hp > 0 else 0))
-        # 600を基準にスケール（例：max_hp=100なら1/6）
-        scale = min(1.0, max_hp / 600.0)
-        bar_w = int(w * scale)
-
-        # HP割合で塗り幅を決定
-        fill_w = int(bar_w * ratio)
-
-    # 色（体力残量による）
-        if ratio >= 0.6:
-            col = (40, 200, 90)
-        elif ratio >= 0.3:
-            col = (230, 200, 60)
-        else:
-            col = (230, 70, 70)
-
-    # バー描画
-        surf = pg.Surface((w, h), pg.SRCALPHA)
-    # 背景（透明）
-        bg = pg.Surface((bar_w, h), pg.SRCALPHA)
-        bg.fill((0, 0, 0, 120))
-        surf.blit(bg, (0, 0))
-    # 緑バー
-        fg = pg.Surface((fill_w, h), pg.SRCALPHA)
-        fg.fill(col)
-        surf.blit(fg, (0, 0))
-        return surf
+        """HPバー（max600基準でスケーリング、毎フレーム描く所は BARS.hp を使う）"""
+        return BarWidget(w, h, BARS).hp(current, max_hp)
 
     # ---------------- 盤面ロジック ----------------
+    # 中身は pazmon_engine にある（GUI なしでも動かせるように）
 
     def init_field(self) -> List[str]:
-        return [random.choice(self.GEMS) for _ in range(14)]
+        return engine.init_field(random, self.SLOT_COUNT, self.GEMS)
 
     def death_field(self) -> List[str]:
-        return ["無" for _ in range(14)]
+        return engine.death_field(self.SLOT_COUNT)
 
     def leftmost_run(self, field: List[str]) -> Optional[Tuple[int, int]]:
-        n = len(field)
-        i = 0
-        while i < n:
-            j = i+1
-            while j < n and field[j] == field[i]:
-                j += 1
-            L = j-i
-            if L >= 3 and field[i] in self.GEMS:
-                return (i, L)
-            i = j
-        return None
+        return engine.leftmost_run(field, self.GEMS)
 
     def collapse_left(self, field: List[str], start: int, length: int):
-        # 消滅部分を '無' にしてから左詰め（簡略：一気に詰める）
-        # n = len(field)
-        for k in range(start, start+length):
-            field[k] = "無"
-        rest = [e for e in field if e != "無"]
-        field[:] = rest + ["無"]*length
+        engine.collapse_left(field, start, length)
 
     def fill_random(self, field: List[str]):
-        for i, e in enumerate(field):
-            if e == "無":
-                field[i] = random.choice(self.GEMS)
+        engine.fill_random(field, random, self.GEMS)
 
         # ---------------- ダメージ/回復 ----------------
 
     def jitter(self, v: float, r: float = 0.10) -> int:
-        return max(1, int(v*random.uniform(1-r, 1+r)))
+        return engine.jitter(v, r)
 
     def attr_coeff(self, att, defe):
-        cyc = {"火": "風", "風": "土", "土": "水", "水": "火"}
-        if att in cyc and cyc[att] == defe:
-            return 2.0
-        if defe in cyc and cyc[defe] == att:
-            return 0.5
-        return 1.0
+        return engine.attr_coeff(att, defe)
 
     def party_attack_from_gems(self, elem: str, run_len: int, combo: int, party: dict, monster: dict) -> int:
-        combo_coeff = 1.5 ** ((run_len - 3) + combo)
-
-        if elem == "命":
-            heal = self.jitter(20*combo_coeff)
-            party["hp"] = min(party["max_hp"], party["hp"]+heal)
-            return 0
-
-        ally = next(
-            (a for a in party["allies"] if a["element"] == elem), None)
-
-        if not ally:
-            return 0
-
-        base = max(1, ally["ap"]-monster["dp"])
-        dmg = self.jitter(
-            base*self.attr_coeff(elem, monster["element"])*combo_coeff)
-        monster["hp"] = max(0, monster["hp"]-dmg)
-
-        return dmg
+        return engine.party_attack_from_gems(elem, run_len, combo, party, monster)
 
     def enemy_attack(self, party: dict, monster: dict) -> int:
-        base = max(1, monster["ap"]-party["dp"])
-        dmg = self.jitter(base)
-        party["hp"] = max(0, party["hp"]-dmg)
-        return dmg
+        return engine.enemy_attack(party, monster)
 
         # ---------------- 描画ユーティリティ ----------------
 
     def slot_rect(self, i: int) -> pg.Rect:
-        tx = self.LEFT_MARGIN + i * (self.SLOT_W + self.SLOT_PAD)
-        return pg.Rect(tx, self.FIELD_Y, self.SLOT_W, self.SLOT_W)
+        x, y = self.GRID.xy(i)
+        step = self.SLOT_W + self.SLOT_PAD
+        return pg.Rect(self.FIELD_X + x * step, self.FIELD_Y + y * step, self.SLOT_W, self.SLOT_W)
+
+    def slot_at(self, mx: int, my: Optional[int] = None) -> Optional[int]:
+        """(mx, my) にあるスロットの番号（無ければ None）
+
+        my を省くと縦は見ない（横一列の盤面で、離した位置の列だけを見る時用）。
+        スロットの間の隙間は右/下のスロットに入れない（左/上のスロットの内）。
+        """
+        step = self.SLOT_W + self.SLOT_PAD
+        x = (mx - self.FIELD_X) // step
+        if not 0 <= x < self.GRID_W:
+            return None
+        if my is None:
+            if self.GRID_H != 1:
+                return None
+            return x
+        y = (my - self.FIELD_Y) // step
+        if not 0 <= y < self.GRID_H or my > self.FIELD_Y + self.FIELD_H:
+            return None
+        return self.GRID.index(x, y)
+
+    def in_field(self, my: int) -> bool:
+        """my が盤面の行の高さの内か"""
+        return self.FIELD_Y <= my <= self.FIELD_Y + self.FIELD_H
+
+    def gem_font(self, font):
+        """スロットを縮めた盤面では宝石の記号も小さくする"""
+        if self.SLOT_W >= self.MAX_SLOT_W:
+            return font
+        return self.get_jp_font(max(10, self.SLOT_W // 2))
 
     def draw_gem_at(self, screen, elem: str, x: int, y: int, scale=1.0, with_shadow=False, font=None):
 
-        r = int((self.SLOT_W//2 - 10) * scale)
-
-        if with_shadow:
-            shadow = pg.Surface((r*2+6, r*2+6), pg.SRCALPHA)
-            pg.draw.circle(shadow, self.DRAG_SHADOW, (r+3, r+3), r+3)
-            screen.blit(shadow, (x-r-3, y-r-3))
-
-        pg.draw.circle(screen, self.COLOR_RGB[elem], (x, y), r)
-
-        sym = self.ELEMENT_SYMBOLS[elem]
+        r = max(3, int((self.SLOT_W//2 - 10) * scale))
         f = font if font else self.get_jp_font(int(26*scale))
-        s = f.render(sym, True, (0, 0, 0))
-        screen.blit(s, (x - s.get_width() // 2, y - s.get_height() // 2))
+        self.gem_sprites.sync()
+        surf, half = self.gem_sprites.get(elem, r, f, with_shadow)
+        return screen.blit(surf, (x - half, y - half))
 
     def draw_field(self,
                    screen,
@@ -246,74 +982,102 @@ class GameSystemSettings(SettingsOfPazmon):
                    drag_elem: Optional[str] = None,
                    x=0, y=0
                    ):
-        # スロット見出し
-        for i, slot in enumerate(self.SLOTS):
-            tx = self.LEFT_MARGIN+i*(self.SLOT_W + self.SLOT_PAD)
-            s = font.render(slot, True, (220, 220, 220))
-            screen.blit(s, (tx, self.FIELD_Y-28))
-
-        # スロット下地 & ホバー強調
-        for i, _ in enumerate(field):
-            rect = self.slot_rect(i)
-            base = (35, 35, 40) if hover_idx != i else (60, 60, 80)
-            rect[0] += x / 10
-            rect[2] += x / -10
-            rect[1] += y / 10
-            rect[3] += y / -10
-            pg.draw.rect(screen, base, rect, border_radius=8)
-
-        # 宝石（ドラッグ開始スロットは空に見せる）
-        for i, elem in enumerate(field):
-            if drag_src is not None and i == drag_src:
-                continue
-            rect = self.slot_rect(i)
-            cx, cy = rect.center
-
-            pg.draw.circle(
-                screen,
-                self.COLOR_RGB[elem],
-                (cx + x/10, cy + y/10),
-                self.SLOT_W // 3
-            )
-
-            sym = self.ELEMENT_SYMBOLS[elem]
-            s = font.render(sym, True, (0, 0, 0))
-            screen.blit(s, (cx-s.get_width()//2 + x /
-                        10, cy-s.get_height()//2 + y/10))
+        font = self.gem_font(font)
+        step = self.SLOT_W + self.SLOT_PAD
+        # スロット見出し（W×H の盤面は列の見出しと行の番号）
+        if self.GRID_H == 1:
+            for i, slot in enumerate(self.SLOTS):
+                s = TEXT_CACHE.render(font, slot, True, (220, 220, 220))
+                screen.blit(s, (self.FIELD_X + i * step, self.FIELD_Y-28))
+        else:
+            for cx in range(self.GRID_W):
+                s = TEXT_CACHE.render(font, engine.slot_label(cx), True, (220, 220, 220))
+                screen.blit(s, (self.FIELD_X + cx * step, self.FIELD_Y-28))
+            for cy in range(self.GRID_H):
+                s = TEXT_CACHE.render(font, str(cy + 1), True, (220, 220, 220))
+                screen.blit(s, (self.FIELD_X - s.get_width() - 6, self.FIELD_Y + cy * step))
+
+        sprites = self.gem_sprites
+        sprites.sync()
+        r = self.SLOT_W // 3
+        if x == 0 and y == 0:
+            # 揺れていない時は下地と宝石を焼き込んだタイルをスロットの数だけ置くだけ
+            for i, elem in enumerate(field):
+                base = (35, 35, 40) if hover_idx != i else (60, 60, 80)
+                shown = None if drag_src is not None and i == drag_src else elem
+                screen.blit(sprites.tile(shown, base, r, font), self.slot_rect(i))
+        else:
+            # スロット下地 & ホバー強調
+            for i, _ in enumerate(field):
+                rect = self.slot_rect(i)
+                base = (35, 35, 40) if hover_idx != i else (60, 60, 80)
+                rect[0] += x / 10
+                rect[2] += x / -10
+                rect[1] += y / 10
+                rect[3] += y / -10
+                pg.draw.rect(screen, base, rect, border_radius=8)
+
+            # 宝石（ドラッグ開始スロットは空に見せる）。描いておいた絵を置くだけ
+            for i, elem in enumerate(field):
+                if drag_src is not None and i == drag_src:
+                    continue
+                surf, half = sprites.get(elem, r, font)
+                rect = self.slot_rect(i)
+                cx = rect.x + self.SLOT_W // 2 + x / 10
+                cy = rect.y + self.SLOT_W // 2 + y / 10
+                screen.blit(surf, (cx - half, cy - half))
 
         # ドラッグ中の宝石（ゴースト）をカーソル位置に拡大表示
         if drag_elem is not None:
-
-            mx, my = pg.mouse.get_pos()
-            self.draw_gem_at(
-                screen,
-                drag_elem,
-                mx + x,
-                my-4,
-                scale=self.DRAG_SCALE,
-                with_shadow=True,
-                font=font
-            )
+            self.draw_drag_ghost(screen, drag_elem, font, x)
+        return self.FIELD_RECT
+
+    def ghost_rect(self, x=0) -> pg.Rect:
+        """ドラッグ中の宝石（影込み）が覆う範囲"""
+        mx, my = pg.mouse.get_pos()
+        r = max(3, int((self.SLOT_W//2 - 10) * self.DRAG_SCALE)) + 4
+        side = max(r * 2, int(26 * self.DRAG_SCALE)) + 8
+        return pg.Rect(mx + x - side // 2, my - 4 - side // 2, side, side)
+
+    def draw_drag_ghost(self, screen, drag_elem: str, font, x=0) -> pg.Rect:
+        mx, my = pg.mouse.get_pos()
+        self.draw_gem_at(
+            screen,
+            drag_elem,
+            mx + x,
+            my-4,
+            scale=self.DRAG_SCALE,
+            with_shadow=True,
+            font=font
+        )
+        return self.ghost_rect(x)
 
     def draw_top(self, screen, enemy, party, font, weakFont=None, gainX=0, gainY=0, alpha=200):
+        self.draw_enemy_image(screen, enemy, gainX, gainY, alpha)
+        self.draw_enemy_status(screen, enemy, font, weakFont)
+        self.draw_party_hp(screen, party, font)
+        self.draw_skill_bars(screen, party, font, weakFont)
+
+    def draw_enemy_image(self, screen, enemy, gainX=0, gainY=0, alpha=200) -> pg.Rect:
+        # 敵画像
+        img = self.load_monster_image(enemy["name"], alpha)
+        return screen.blit(img, (40 + gainX/3.5, 40 + gainY/4.5))
 
+    def draw_enemy_status(self, screen, enemy, font, weakFont=None) -> pg.Rect:
         weakElementList = {
             '火': '水',
             '水': '土',
             '土': '風',
             '風': '火',
         }
-        # 敵画像/名前
-        img = self.load_monster_image(enemy["name"])
-        img.set_alpha(alpha)
-        screen.blit(img, (40 + gainX/3.5, 40 + gainY/4.5))
-
         # 敵名とHPバー
-        name = font.render(
+        name = TEXT_CACHE.render(
+            font,
             enemy["name"], True, (240, 240, 240))
         screen.blit(name, (320, 40))
 
-        enemy_bar = self.hp_bar_surf(
+        enemy_bar = BARS.hp(
+            "enemy",
             enemy["hp"],
             enemy["max_hp"],
             420,
@@ -321,25 +1085,30 @@ class GameSystemSettings(SettingsOfPazmon):
         )
         screen.blit(enemy_bar, (320, 80))
         if (weakFont is not None):
-            weak = weakFont.render(
+            weak = TEXT_CACHE.render(
+                weakFont,
                 f'[属性: {enemy["element"]} < {self.ELEMENT_SYMBOLS[enemy["element"]]} >   弱点: {weakElementList[enemy["element"]]} < {self.ELEMENT_SYMBOLS[weakElementList[enemy["element"]]]} >]', True, (143, 133, 233))
             screen.blit(weak, (635, 60))
 
         # 敵HP数値（バー右側に）
-        enemy_hp_text = font.render(
+        enemy_hp_text = TEXT_CACHE.render(
+            font,
             f"{enemy['hp']} / {enemy['max_hp']}",
             True,
             (240, 240, 240)
         )
 
         screen.blit(enemy_hp_text, (750, 78))
+        return self.ENEMY_STATUS_RECT
 
+    def draw_party_hp(self, screen, party, font) -> pg.Rect:
         # 「パーティ」ラベル
-        label = font.render("パーティ", True, (240, 240, 240))
+        label = TEXT_CACHE.render(font, "パーティ", True, (240, 240, 240))
         screen.blit(label, (320, 110))
 
         # パーティHPバー
-        party_bar = self.hp_bar_surf(
+        party_bar = BARS.hp(
+            "party",
             party["hp"],
             party["max_hp"],
             420, 18
@@ -348,21 +1117,25 @@ class GameSystemSettings(SettingsOfPazmon):
         screen.blit(party_bar, (320, 140))
 
         # パーティHP数値
-        party_hp_text = font.render(
+        party_hp_text = TEXT_CACHE.render(
+            font,
             f"{int(party['hp'])}/{party['max_hp']}",
             True,
             (240, 240, 240)
         )
         screen.blit(party_hp_text, (750, 138))
+        return self.PARTY_RECT
 
+    def draw_skill_bars(self, screen, party, font, weakFont) -> pg.Rect:
         for (i, ally) in enumerate(party["allies"]):
-            if "skill" in ally and "sp" in ally:
+            if ally.skill is not None:
 
                 # 1. 色は「常に」属性色を使う（これで誰のスキルか分かる！）
                 ally_color = self.COLOR_RGB[ally["element"]]
 
                 # 2. バーを描画 (中身は属性色)
-                sp_bar = self.sp_bar_surf(
+                sp_bar = BARS.sp(
+                    ("sp", i),
                     ally["sp"],
                     ally["skill"].need_sp,
                     ally_color,
@@ -375,56 +1148,105 @@ class GameSystemSettings(SettingsOfPazmon):
                 if ally["sp"] >= ally["skill"].need_sp:
                     frame_rect = pg.Rect(520, y, 300, 12)
                     pg.draw.rect(screen, (255, 215, 0), frame_rect, 3)
-                    ok_text = weakFont.render("OK!", True, (255, 215, 0))
+                    ok_text = TEXT_CACHE.render(weakFont, "OK!", True, (255, 215, 0))
                     screen.blit(ok_text, (830, y - 5))
                 else:
                     # 満タンじゃない時はふつうの数値
-                    sp_text = font.render(
+                    sp_text = TEXT_CACHE.render(
+                        font,
                         f"{int(ally['sp'])}/{ally['skill'].need_sp}",
                         True,
                         (240, 240, 240)
                     )
                     screen.blit(sp_text, (830, y - 2))
-
-    def draw_message(self, screen, text, font, x=40, y=460):
-        surf = font.render(text, True, (230, 230, 230))
-        screen.blit(surf, (x, y))
+        return self.SKILL_RECT
+
+    def draw_view(self, screen, view: dict, font, weakFont):
+        """タイムラインの1コマ（snapshot）を描く"""
+        screen.fill(self.BG_COLOR)
+        gx, gy, alpha = view["top"]
+        self.draw_top(screen, view["enemy"], view["party"], font, weakFont, gx, gy, alpha)
+        fx, fy = view["field_off"]
+        self.draw_field(screen, view["field"], font, None, None, None, fx, fy)
+        if view["message"] is not None:
+            self.draw_message(screen, view["message"], font)
+
+    def draw_progress(self, screen, ratio: float, font=None) -> pg.Rect:
+        """タイトル画面の読み込みバー"""
+        x, y, w, h = self.PROGRESS_RECT
+        pg.draw.rect(screen, (70, 70, 80), (x, y, w, h), 1)
+        pg.draw.rect(screen, (143, 133, 233), (x+2, y+2, int((w-4)*max(0.0, min(1.0, ratio))), h-4))
+        if font is not None:
+            label = TEXT_CACHE.render(font, f"読み込み中… {int(ratio*100)}%", True, (200, 200, 200))
+            screen.blit(label, (x, y - label.get_height() - 6))
+        return pg.Rect(x, y, w, h)
+
+    def draw_message(self, screen, text, font, x=40, y=460) -> pg.Rect:
+        surf = TEXT_CACHE.render(font, text, True, (230, 230, 230))
+        return screen.blit(surf, (x, y))
 
 
 # --------------GameSystemSettings end--------------
 
 # --------------GameItemSettings begin--------------
 class Item:
-    def __init__(self, item_num):
-        self.number_of_item = item_num
+    # アイテムの種類 → assets/items/ のアイコン
+    ICON_FILES = {"ATK": "PowerPow.png", "RBRTH": "Revival.png", "LIFE": "Heal.png", "SHUFFLE": "kimagure.png"}
+    ICON_SIZE = 50
+
+    def __init__(self, items: dict, y: int = 650):
+        """items は engine.new_items() の形（番号順に並べる）"""
+        self.icon_files = [self.ICON_FILES[items["type"][no]] for no in sorted(items["type"])]
+        self.number_of_item = len(self.icon_files)
+        # 4 つまでは今までの間隔、それより多ければ詰める
+        self.step = 980 / max(4, self.number_of_item)
+        self.y = y
+        self.atlas: Optional[pg.Surface] = None
+        self.icon_rects: List[pg.Rect] = []
+        self._labels: Dict[int, tuple] = {}
+
+    def decode_icon(self, i: int) -> pg.Surface:
+        img = pg.image.load(os.path.join("assets", "items", self.icon_files[i]))
+        return pg.transform.scale(img, (self.ICON_SIZE, self.ICON_SIZE))
+
+    def build_atlas(self, icons: Optional[List[pg.Surface]] = None):
+        """アイコンを一枚のサーフェスにまとめる（AssetLoader が読んだものがあれば使う）"""
+        n = self.number_of_item
+        size = self.ICON_SIZE
+        atlas = pg.Surface((size * n, size), pg.SRCALPHA)
+        self.icon_rects = []
+        for i in range(n):
+            img = icons[i] if icons is not None else self.decode_icon(i)
+            rect = pg.Rect(size * i, 0, size, size)
+            atlas.blit(img, rect)
+            self.icon_rects.append(rect)
+        if pg.display.get_surface() is not None:
+            atlas = atlas.convert_alpha()
+        self.atlas = atlas
+
+    def _label(self, font, i: int, name: str, count: int) -> pg.Surface:
+        # 所持数が変わった時だけ描き直す
+        key = (font, name, count)
+        cached = self._labels.get(i)
+        if cached is None or cached[0] != key:
+            surf = font.render(f"{name}x{count}", False, (255, 255, 240))
+            cached = (key, surf)
+            self._labels[i] = cached
+        return cached[1]
 
     def draw_item_surface(self, screen, font, txt: str, kosuu: int):
-        img = None
+        if self.atlas is None:
+            self.build_atlas()
         for i in range(self.number_of_item):
-            match(i):
-                case 0:
-                    img = pg.image.load("assets/items/PowerPow.png")
-                    img = pg.transform.scale(img, (50, 50))
-                case 1:
-                    img = pg.image.load("assets/items/Revival.png")
-                    img = pg.transform.scale(img, (50, 50))
-                case 2:
-                    img = pg.image.load("assets/items/Heal.png")
-                    img = pg.transform.scale(img, (50, 50))
-                case 3:
-                    img = pg.image.load("assets/items/kimagure.png")
-                    img = pg.transform.scale(img, (50, 50))
-            text = font.render(f"{txt[i+1]}x{kosuu[i+1]}", False, (255, 255, 240))
-            screen.blit(img, ((980/4)*(i), 650))
-            screen.blit(text, ((980/4)*(i)+54, 650))
-
-    def clickedItem(self, eventType, num, func=lambda: print("AAA")):
+            text = self._label(font, i, txt[i+1], kosuu[i+1])
+            screen.blit(self.atlas, (self.step*(i), self.y), self.icon_rects[i])
+            screen.blit(text, (self.step*(i)+54, self.y))
+
+    def clickedItem(self, eventType, num):
         x, y = pg.mouse.get_pos()
         if (eventType.type == pg.MOUSEBUTTONDOWN):
-            if ((980/4)*(num) <= x and (980/4)*(num)+50 >= x and 650 <= y and 700 >= y):
+            if (self.step*(num) <= x and self.step*(num)+50 >= x and self.y <= y and self.y+50 >= y):
                 return True
-        else:
-            CLICKED = False
         return False
 
 
@@ -463,586 +1285,592 @@ class GameAnimation:
         elif (value < 0):
             return value * -1
 
+    def shake(self, gain, amp=30) -> List[Tuple[float, float]]:
+        """揺れが収まるまでの (x, y) を1フレームずつ並べて返す"""
+        self.PID_INIT()
+        dev = self.P_Control(gain, amp, 0) + self.I_Control(0.2, amp)
+        offsets = []
+        while (self.abs(self.deviation_P) > 2):
+            x = self.P_Control(0.7, dev, 0) + self.I_Control(0.2, dev)
+            y = self.P_Control(0.7, dev, 0) + self.I_Control(0.2, dev)
+            offsets.append((x, y))
+            dev = x
+        return offsets
+
+
+class Timeline:
+    """アニメーションの予定表（メインループから毎フレーム update で進める）
+
+    hold  : 指定秒数だけ同じコマを出す（time.sleep の代わり）
+    frames: 1フレームに1コマずつ出す（PIDの揺れ）
+    tween : 指定秒数かけて t=0→1 で変わるコマを出す（フェードなど）
+    call  : そこまで進んだら関数を呼ぶ
+    instant=True の時は何も溜めずに飛ばす。
+    """
+
+    def __init__(self, instant: bool = False):
+        self.instant = instant
+        self._steps = deque()
+        self._elapsed = 0.0
+        self._index = 0
+
+    @property
+    def busy(self) -> bool:
+        return bool(self._steps)
+
+    def hold(self, seconds: float, view):
+        if not self.instant:
+            self._steps.append(("hold", seconds, view))
+
+    def frames(self, views):
+        if not self.instant and views:
+            self._steps.append(("frames", len(views), list(views)))
+
+    def tween(self, seconds: float, fn):
+        if not self.instant:
+            self._steps.append(("tween", seconds, fn))
+
+    def call(self, fn):
+        if self.instant:
+            fn()
+        else:
+            self._steps.append(("call", 0, fn))
+
+    def clear(self):
+        # 溜まっている call だけは実行しておく
+        for kind, _, data in self._steps:
+            if kind == "call":
+                data()
+        self._steps.clear()
+        self._elapsed = 0.0
+        self._index = 0
+
+    def update(self, dt: float):
+        """dt 秒進めて、今描くべきコマを返す（何もなければ None）"""
+        while self._steps:
+            kind, length, data = self._steps[0]
+            if kind == "call":
+                self._steps.popleft()
+                data()
+                continue
+            if kind == "frames":
+                if self._index < length:
+                    self._index += 1
+                    return data[self._index - 1]
+            elif self._elapsed < length:
+                t = self._elapsed / length
+                self._elapsed += dt
+                return data if kind == "hold" else data(t)
+            self._steps.popleft()
+            self._elapsed = 0.0
+            self._index = 0
+        return None
+
 # --------------GameAnimation end ---------------
 
-# ---------------- SkillSettings Begin ----------------
-
-
-class Skill:
-    def __init__(self,
-                 skill_name: str,
-                 need_sp: int,
-                 dmg=None,  # 火:タプル、風・水:リスト
-                 debuff_ratio: float=None,
-                 debuff_turns: int=None,
-                 stun_turns: int=None,
-                 heal: int=None):
-        self.skill_name = skill_name
-        self.need_sp = need_sp
-        self.dmg = dmg
-        self.debuff_ratio = debuff_ratio
-        self.debuff_turns = debuff_turns
-        self.stun_turns = stun_turns
-        self.heal = heal
-
-    def execute(self, party, enemy):  # スキルのメイン処理
-        message = []
-        message.append(f"【{self.skill_name}】")
-        dmg = self._calc_damage(enemy)
-        if dmg is not None:
-            message.append(f"{dmg}ダメージ！")
-
-        heal = self._calc_heal(party)
-        if heal is not None:
-            message.append(f"{heal}回復！")
-
-        debuff_res = self._apply_debuff(enemy)
-        if debuff_res is not None:
-            message.append(f"{enemy['name']}の攻撃力を{debuff_res}ダウン！")
-
-        stun_res = self._apply_stun(enemy)
-        if stun_res is not None:
-            message.append(f"{enemy['name']}を{stun_res}ターンスタン！")
-
-        return " ".join(message)
-
-    def _calc_damage(self, enemy):  # ダメージ
-        if type(self.dmg) == tuple:
-            skill_dmg = int(self.dmg[0]+enemy["hp"]*self.dmg[1])
-            enemy["hp"] = max(0, enemy["hp"]-skill_dmg)
-            return skill_dmg
-        if type(self.dmg) == list:
-            skill_dmg = int(random.randint(self.dmg[0], self.dmg[1]))
-            enemy["hp"] = max(0, enemy["hp"]-skill_dmg)
-            return skill_dmg
-
-    def _calc_heal(self, party):  # 回復
-        if self.heal is not None:
-            if (party["hp"] <= party["max_hp"]/2):
-                party["hp"] = min(party["max_hp"], party["hp"]+self.heal)
-            else:
-                party["hp"] = min(party["max_hp"], party["hp"]+5)
-            return self.heal
+# --------------------FramePacer begin.--------------------
+class FramePacer:
+    """フレームの間隔とロジックの刻みを分ける
+
+    ロジック（アニメーションの予定表・バーの動き）は steps() が返す回数だけ
+    STEP 秒ずつ進める（描画が遅れても速さが変わらない）。何も動いておらず
+    入力も無いフレームは wait(idle=True) で pg.event.wait して眠り、入力が来たら
+    すぐ起きて次のフレームからは fps に戻る。
+    """
+
+    STEP = 1 / 60
+    MAX_STEPS = 5   # これより遅れた分は捨てる（止まっていた後に早送りしない）
+
+    def __init__(self, fps: int = 60, idle_ms: int = 250, window: int = 120):
+        self.fps = fps
+        self.idle_ms = idle_ms
+        self.clock = pg.time.Clock()
+        self.frames = 0
+        self.idle_frames = 0
+        self.wakeups = 0        # 眠っている間に入力で起きた回数
+        self.dropped_steps = 0
+        self._acc = 0.0
+        self._intervals: deque = deque(maxlen=window)
+
+    def wait(self, idle: bool = False) -> float:
+        """フレームの終わり。ロジックを進める秒数（ふつうは前のフレームからの時間）を返す"""
+        if idle:
+            e = pg.event.wait(self.idle_ms)
+            if e.type != pg.NOEVENT:
+                # 起こしたイベントは次のフレームで処理する
+                pg.event.post(e)
+                self.wakeups += 1
+            self.idle_frames += 1
+            self._acc = 0.0
+            self._intervals.append(self.clock.tick() / 1000.0)
+            self.frames += 1
+            # 眠っていた間は何も動いていないので、ロジックは一刻みだけ進める
+            return self.STEP
+        elapsed = self.clock.tick(self.fps) / 1000.0
+        self.frames += 1
+        self._intervals.append(elapsed)
+        return elapsed
+
+    def steps(self, dt: float) -> int:
+        """dt 秒の間に進めるロジックの刻みの数"""
+        self._acc += dt
+        n = int(self._acc / self.STEP)
+        self._acc -= n * self.STEP
+        if n > self.MAX_STEPS:
+            self.dropped_steps += n - self.MAX_STEPS
+            n = self.MAX_STEPS
+        return n
+
+    def stats(self) -> dict:
+        xs = sorted(self._intervals)
+        if not xs:
+            return {"frames": self.frames, "idle_frames": self.idle_frames}
+        mean = sum(xs) / len(xs)
+        return {"frames": self.frames, "idle_frames": self.idle_frames, "wakeups": self.wakeups,
+                "dropped_steps": self.dropped_steps, "fps": 1.0 / mean if mean else 0.0,
+                "interval_ms": mean * 1000, "interval_p95_ms": xs[int((len(xs) - 1) * 0.95)] * 1000}
+
+# --------------------FramePacer end.--------------------
+
+# --------------------LiveInput begin.--------------------
+def grid_from_env() -> Optional[Tuple[int, int]]:
+    """PAZMON_GRID（"20" や "6x5"）で指定された盤面の形"""
+    text = os.environ.get("PAZMON_GRID")
+    if not text:
+        return None
+    grid = engine.Grid.parse(text)
+    return grid.w, grid.h
+
+
+class LiveInput:
+    """メインループが入力を受け取る口（ふつうに遊ぶ時はそのまま pygame から）
+
+    記録（pazmon_replay.Recorder）と再生（pazmon_replay.Replayer）はこれを
+    差し替える。メインループは
+      events()      : このフレームのイベント
+      log(e)        : イベントを実際に処理した（記録する時だけ意味がある）
+      decide(k, fn) : 入力や時間で結果が変わる判断（押しっぱなしのキー・アイテム・
+                      オートプレイの手）。再生では fn を呼ばずに記録した値を返す
+      tick(pacer, idle): フレームを終えて dt（秒）を返す（idle なら入力まで眠ってよい）
+      close(state)  : 終わった時の状態を渡す
+    だけを使う。headless=True なら待たずに回す（アニメーションも飛ばす）。
+    grid=(W, H) なら盤面の形をそれにする（None なら環境変数 PAZMON_GRID、無ければ既定）。
+    """
+    seed: Optional[int] = None
+    grid: Optional[Tuple[int, int]] = None
+    headless = False
+
+    def events(self) -> list:
+        return pg.event.get()
+
+    def log(self, e):
+        pass
+
+    def decide(self, kind: str, fn: Callable):
+        return fn()
+
+    def tick(self, pacer: FramePacer, idle: bool = False) -> float:
+        return pacer.wait(idle)
+
+    def close(self, state):
+        pass
 
-    def _apply_debuff(self, enemy):  # デバフ
-        if self.debuff_ratio is not None and self.debuff_turns is not None:
-            enemy["status"] = {"type": "atk_down",
-                               "turn": self.debuff_turns, "val": self.debuff_ratio}
-            return enemy["ap"]-enemy["ap"]*self.debuff_ratio
 
-    def _apply_stun(self, enemy):  # スタン
-        if self.stun_turns is not None and self.stun_turns is not 0:
-            enemy["status"] = {"type": "stun", "turn": self.stun_turns}
-            return self.stun_turns
+# 押しっぱなしで効くキー（decide("keys") の値のビット）
+HELD_ESC = 1
+HELD_ZERO = 2
+HELD_START = 4
 
 
-# ---------------- SkillSettings end ----------------
+def held_keys(keys, ready: bool) -> int:
+    """ESC・0・（読み込みが終わっていれば）スペースを押しているか"""
+    return ((HELD_ESC if keys[pg.K_ESCAPE] else 0)
+            | (HELD_ZERO if keys[pg.K_0] else 0)
+            | (HELD_START if keys[pg.K_SPACE] and ready else 0))
 
 # ---------------- メイン ----------------
 
 
-def main():
+def main(inputs: Optional[LiveInput] = None):
+    inputs = inputs if inputs is not None else LiveInput()
+    if inputs.seed is not None:
+        # 盤面・補充・ダメージの乱数をそろえる（記録と再生で同じ展開にする）
+        random.seed(inputs.seed)
     pg.init()
     gss = GameSystemSettings()
+    shape = inputs.grid or grid_from_env()
+    if shape is not None:
+        gss.set_grid(*shape)
     pid = GameAnimation()
     screen = pg.display.set_mode((gss.WIN_W, gss.WIN_H))
     pg.display.set_caption("Puzzle & Monsters - GUI Prototype")
-    font = gss.get_jp_font(30)
-    titleFont = gss.get_jp_font(73)
-    weakFont = gss.get_jp_font(17)
-    clearFont = gss.get_jp_font(40)
-
-    item = Item(4)
+    renderer = DirtyRenderer(screen, gss.BG_COLOR, gss.DIRTY_RECTS)
+    # フェーズごとの時間（F4 で表示、PAZMON_PROFILE_CSV があれば CSV に書く）
+    prof = FrameProfiler(csv_path=os.environ.get("PAZMON_PROFILE_CSV"))
+    BARS.speed = gss.BAR_ANIM_SPEED
+    # フォントは AssetLoader が読み終えてから取り出す
+    font = titleFont = weakFont = clearFont = None
+
+    itemList = engine.new_items()
+    item = Item(itemList, gss.ITEM_RECT.y + 5)
     secret = []
     command_list = [
         [1073741906, 1073741906, 1073741905, 1073741905,
             1073741904, 1073741903, 1073741904, 1073741903, 97, 98],
     ]
 
-# スキルインスタンス生成
-    skill_wind = Skill("Rising Minus Potencial", 30, [20, 50], stun_turns=3)
-    skill_fire = Skill("Flame of Pursing Curce", 10, (30, 0.1))
-    skill_earth = Skill("Angel Kiss", 40, heal=30)
-    skill_water = Skill("Making Stop In Forever Ice", 30, [20, 50], debuff_ratio=0.5, debuff_turns=3)
-
-    itemList = {
-            "name": {
-                1: "力の粉",
-                2: "お守り",
-                3: "薬草",
-                4: "気まぐれ石"
-            },
-            "type": {
-                1: "ATK",
-                2: "RBRTH",
-                3: "LIFE",
-                4: "SHUFFLE"
-            },
-            "max_hold": {
-                1: 3,
-                2: 1,
-                3: 5,
-                4: 3,
-            },
-            "value": {
-                1: 10,
-                2: 1000,
-                3: 5,
-                4: 4
-            }
-    }
-    party = {
-        "player_name": "Player",
-        "allies": [
-            {"name": "青龍", "element": "風", "hp": 150,
-             "max_hp": 150, "ap": 15, "dp": 10, "skill": skill_wind, "sp": 0},
-            {"name": "朱雀", "element": "火", "hp": 150,
-             "max_hp": 150, "ap": 25, "dp": 10, "skill": skill_fire, "sp": 0},
-            {"name": "白虎", "element": "土", "hp": 150,
-             "max_hp": 150, "ap": 20, "dp": 5, "skill": skill_earth, "sp": 0},
-            {"name": "玄武", "element": "水", "hp": 150,
-             "max_hp": 150, "ap": 20, "dp": 15, "skill": skill_water, "sp": 0},
-        ],
-        "hp": 600, "max_hp": 600, "dp": (10+10+5+15)/4
-    }
-
-    enemies = [
-        {"name": "スライム", "element": "水", "hp": 100,
-         "max_hp": 100, "ap": 10, "dp": 1, "status": {"type": None, "turn": 0, "val": None}},
-        {"name": "ゴブリン", "element": "土", "hp": 200,
-         "max_hp": 200, "ap": 20, "dp": 5, "status": {"type": None, "turn": 0, "val": None}},
-        {"name": "オオコウモリ", "element": "風", "hp": 300,
-         "max_hp": 300, "ap": 30, "dp": 10, "status": {"type": None, "turn": 0, "val": None}},
-        {"name": "ウェアウルフ", "element": "風", "hp": 400,
-         "max_hp": 400, "ap": 40, "dp": 15, "status": {"type": None, "turn": 0, "val": None}},
-        {"name": "ドラゴン", "element": "火", "hp": 600,
-         "max_hp": 600, "ap": 50, "dp": 20, "status": {"type": None, "turn": 0, "val": None}},
-    ]
+    party = engine.new_party()
+    enemies = engine.new_enemies()
+    # タイトル画面を描きながら、このダンジョンで使うフォントと画像を読み込む
+    # （タイトルの文字のフォントが先。ウィンドウはアセットの数によらずすぐ開く）
+    loader = AssetLoader(dungeon_asset_jobs(gss, item, enemies, gss.TITLE_FONT_SIZES + gss.GAME_FONT_SIZES))
+    loader.start()
+    if inputs.headless:
+        loader.wait()
 
-    enemy_idx = 0
-    enemy = enemies[enemy_idx]
-    field = gss.init_field()
+    # 戦闘の状態（ロジックは pazmon_engine）
+    state = engine.BattleState(party, enemies, itemList, gss.init_field(), grid=gss.GRID)
 
     drag_src: Optional[int] = None
     drag_elem: Optional[str] = None
     hover_idx: Optional[int] = None
-    message = "ドラッグで A..N の宝石を移動（例：A→F）"
-    clock = pg.time.Clock()
+    message = f"ドラッグで {gss.SLOTS[0]}..{gss.SLOTS[-1]} の宝石を移動（例：{gss.SLOTS[0]}→{gss.SLOTS[5 % gss.SLOT_COUNT]}）"
+    # フレームの間隔（何も起きていない時は眠る）とロジックの刻み
+    pacer = FramePacer()
     gameStarting = False
-    gameClear = False
 
-    sFlag = False
-    leaflag = False
-    powflag = False
-    guardFlag = False
+    # アニメーション（メインループの clock で進める）
+    timeline = Timeline(gss.INSTANT_ANIMATION or inputs.headless)
+    dt = 0.0
+    view = None
+
+    # ヒント（H）とオートプレイ（P）
+    solver = Solver(gss.SOLVER_DEPTH, budget=gss.SOLVER_BUDGET,
+                    rng=random.Random(inputs.seed) if inputs.seed is not None else None)
+    hint: Optional[str] = None
+    auto_play = False
+    # オートバトル（B）：別プロセスの MCTS が考える。待つ間も描画と手動の操作は止まらない
+    bot = AutoBattle(float(os.environ.get("PAZMON_BOT_BUDGET", gss.BOT_BUDGET)), inputs.seed)
+    auto_battle = False
+
+    def snapshot(ev: dict, msg=None, top=(0, 0, 200), field_off=(0, 0), items=False) -> dict:
+        """イベント時点の敵/パーティ/盤面を写し取ったアニメーションの1コマ"""
+        en = enemies[min(ev["enemy_idx"], len(enemies)-1)]
+        return {
+            "enemy": en.copy(hp=ev["enemy_hp"]),
+            "party": party.copy(hp=ev["party_hp"],
+                                allies=[a.copy(sp=sp) for a, sp in zip(party.allies, ev["sp"])]),
+            "field": ev["field"],
+            "top": top,
+            "field_off": field_off,
+            "message": msg,
+            "items": items,
+        }
 
-    GUARD = False
-    pow = False
+    def queue_events(events: List[dict]) -> str:
+        """エンジンのイベント列をアニメーションのコマに並べる"""
+        msg = message
+        for ev in events:
+            kind = ev["type"]
+            if kind == "swap":
+                timeline.hold(gss.FRAME_DELAY, snapshot(ev, ev["message"]))
+            elif kind == "attack":
+                # 倒したら揺れながらフェードアウト
+                v = snapshot(ev, "消滅！")
+                timeline.frames([
+                    dict(v, top=(x, 0, 200 - 10 * n if ev["killed"] else 200))
+                    for n, (x, y) in enumerate(pid.shake(1.4))
+                ])
+            elif kind in ("collapse", "refill"):
+                alpha = 200 if ev["enemy_hp"] > 0 else 0
+                timeline.hold(gss.FRAME_DELAY, snapshot(ev, ev["message"], (0, 0, alpha)))
+            elif kind == "enemy_attack":
+                if ev["act"] != "stun":
+                    # 盤面を揺らす
+                    v = snapshot(ev)
+                    timeline.frames([dict(v, field_off=(x, y)) for x, y in pid.shake(0.7)])
+                timeline.hold(gss.ENEMY_DELAY, snapshot(ev, ev["message"]))
+            elif kind == "skill" and ev["attack"]:
+                # 攻撃スキルなら画面を揺らす
+                v = snapshot(ev, ev["message"])
+                shakes = [dict(v, top=(x, y, 200)) for x, y in pid.shake(1.4)]
+                timeline.frames(shakes)
+                timeline.hold(gss.FRAME_DELAY, shakes[-1] if shakes else v)
+            elif kind == "defeat" and ev["source"] == "skill":
+                v = snapshot(ev, msg)
+                timeline.frames([dict(v, top=(x, y, 200)) for x, y in pid.shake(1.4)])
+            elif kind == "item":
+                timeline.hold(gss.FRAME_DELAY, snapshot(ev, ev["message"], items=True))
+            msg = ev["message"]
+        return msg
+
+    def logic(fn: Callable, *args) -> str:
+        """エンジンを呼んでコマを並べる（揺れの計算も含めて logic フェーズに付ける）"""
+        prev = prof.enter("logic")
+        msg = queue_events(fn(*args))
+        prof.enter(prev)
+        return msg
 
     running = True
     while running:
-        for e in pg.event.get():
+        TEXT_CACHE.begin_frame()
+        BARS.begin_frame()
+        prof.begin()
+        events = inputs.events()
+        for e in events:
             if e.type == pg.QUIT:
+                inputs.log(e)
                 running = False
 
-            if (party["hp"] > 0 and gameStarting == True and enemy_idx < len(enemies) and gameClear == False):
+            if (party["hp"] > 0 and gameStarting == True and not state.cleared and not timeline.busy):
                 if e.type == pg.MOUSEBUTTONDOWN and e.button == 1:
+                    inputs.log(e)
                     mx, my = e.pos
-                    if gss.FIELD_Y <= my <= gss.FIELD_Y+gss.SLOT_W:
-                        i = (mx-gss.LEFT_MARGIN)//(gss.SLOT_W+gss.SLOT_PAD)
-                        if 0 <= i < 14:
+                    if gss.in_field(my):
+                        i = gss.slot_at(mx, my)
+                        if i is not None:
                             drag_src = i
-                            drag_elem = field[i]
+                            drag_elem = state.field[i]
                             message = f"{gss.SLOTS[i]} を掴んだ"
                     else:
                         for i, ally in enumerate(party["allies"]):
-                            if "skill" in ally:
+                            if ally.skill is not None:
                                 # 当たり判定を作る (draw_topの座標計算と同じにする)
                                 bar_y = 250 + i * 50
                                 bar_rect = pg.Rect(520, bar_y, 300, 40)
                                 # クリックした場所がバーの中か
                                 if bar_rect.collidepoint(mx, my):
-                                    skill = ally["skill"]
-
-                                    # SP確認
-                                    if ally["sp"] >= skill.need_sp:
-                                        # 発動
-                                        skill_res = skill.execute(party, enemy)
-                                        ally["sp"] -= skill.need_sp
-                                        message = skill_res
-
-                                        # 攻撃スキルなら画面を揺らす
-                                        if skill.dmg is not None:
-                                            # PID（敵の攻撃の時と同じ設定）
-                                            pid.PID_INIT()
-                                            dev = pid.P_Control(
-                                                1.4, 30, 0) + pid.I_Control(0.2, 30)
-
-                                            # 揺れが収まるまでループ
-                                            while (pid.abs(pid.deviation_P) > 2):
-                                                screen.fill((22, 22, 28))
-
-                                                # 揺れ幅を計算
-                                                x = pid.P_Control(
-                                                    0.7, dev, 0) + pid.I_Control(0.2, dev)
-                                                y = pid.P_Control(
-                                                    0.7, dev, 0) + pid.I_Control(0.2, dev)
-
-                                                gss.draw_top(
-                                                    screen, enemy, party, font, weakFont, x, y)
-                                                gss.draw_field(
-                                                    screen, field, font, None, None, None, 0, 0)
-
-                                                gss.draw_message(
-                                                    screen, message, font)
-
-                                                pg.display.flip()
-                                                dev = x
-
-                                            time.sleep(gss.FRAME_DELAY)
-                                        # 敵が倒れたかチェック
-                                        if enemy["hp"] <= 0:
-                                            pid.PID_INIT()
-
-                                            dev = pid.P_Control(
-                                                1.4, 30, 0) + pid.I_Control(0.2, 30)
-
-                                            # 揺れが収まるまでループ
-                                            while (pid.abs(pid.deviation_P) > 2):
-                                                screen.fill((22, 22, 28))
-
-                                                # 揺れ幅を計算
-                                                x = pid.P_Control(
-                                                    0.7, dev, 0) + pid.I_Control(0.2, dev)
-                                                y = pid.P_Control(
-                                                    0.7, dev, 0) + pid.I_Control(0.2, dev)
-
-                                                gss.draw_top(
-                                                    screen, enemy, party, font, weakFont, x, y)
-                                                gss.draw_field(
-                                                    screen, field, font, None, None, None, 0, 0)
-
-                                                gss.draw_message(
-                                                    screen, message, font)
-
-                                                pg.display.flip()
-                                                dev = x
-                                            enemy_idx += 1
-                                            if enemy_idx < len(enemies):
-                                                enemy = enemies[enemy_idx]
-                                                field = gss.init_field()
-                                                message = f"さらに奥へ… 次は {enemy['name']}"
-                                            else:
-                                                drag_src = None
-                                                drag_elem = None
-                                                hover_idx = None
-                                                gameClear = True
-                                                break
+                                    message = logic(engine.use_skill, state, i)
+                                    if state.cleared:
+                                        drag_src = None
+                                        drag_elem = None
+                                        hover_idx = None
+                                        break
                 elif e.type == pg.MOUSEMOTION:
+                    inputs.log(e)
                     mx, my = e.pos
-                    hi = (mx-gss.LEFT_MARGIN)//(gss.SLOT_W+gss.SLOT_PAD)
+                    linear = gss.GRID_H == 1
                     hy = (gss.SLOT_W+gss.SLOT_PAD)
-                    hover_idx = hi if 0 <= hi < 14 else None
-                    nowPosX = max(0, min(len(field)-1, hi))
+                    # 横一列は縦を見ない（行から少し外れても列で決める）
+                    hover_idx = gss.slot_at(mx, None if linear else my)
                     if (drag_src is not None):
 
                         posX = drag_src
-                        if (hover_idx is not None and hover_idx != drag_src and hy > abs(my - gss.FIELD_Y)):
-
-                            if (nowPosX - posX <= 1):
-                                field[nowPosX], field[posX] = field[posX], field[nowPosX]
-                                drag_src = hi
+                        if (hover_idx is not None and hover_idx != drag_src):
+                            if linear:
+                                near = hy > abs(my - gss.FIELD_Y) and hover_idx - posX <= 1
+                            else:
+                                # W×H は上下左右の隣へ動いた時だけ入れ替える
+                                near = gss.GRID.adjacent(hover_idx, posX)
+                            if near:
+                                state.swap(hover_idx, posX)
+                                drag_src = hover_idx
 
                 elif e.type == pg.MOUSEBUTTONUP and e.button == 1:
+                    inputs.log(e)
                     if drag_src is not None:
                         mx, my = e.pos
-                        j = (mx-gss.LEFT_MARGIN)//(gss.SLOT_W+gss.SLOT_PAD)
-                        if 0 <= j < 14:
-                            i = drag_src
-                            if i != j:
-                                step = 1 if j > i else -1
-                                k = i
-                                while k != j:
-                                    nxt = k + step
-                                    field[k], field[nxt] = field[nxt], field[k]
-                                    k = nxt
-                                    message = f"{gss.SLOTS[k-step]}↔{gss.SLOTS[k]} を交換"
-                                    screen.fill((22, 22, 28))
-                                    gss.draw_top(
-                                        screen, enemy, party, font, weakFont)
-                                    gss.draw_field(
-                                        screen, field, font, hover_idx=None, drag_src=None, drag_elem=None)
-                                    gss.draw_message(screen, message, font)
-                                    pg.display.flip()
-                                    time.sleep(gss.FRAME_DELAY)
-
-                            # 評価ループ
-                            combo = 0
-                            while True:
-                                run = gss.leftmost_run(field)
-                                if not run:
-                                    break
-                                start, L = run
-                                combo += 1
-                                elem = field[start]
-                                if elem == "命":
-                                    heal = gss.jitter(
-                                        22.5*(1.4**((L-3)+combo)))
-                                    party["hp"] = min(
-                                        party["max_hp"], party["hp"]+heal)
-                                    message = f"HP +{heal}"
-                                else:
-                                    dmg = gss.party_attack_from_gems(
-                                        elem, L, combo, party, enemy)
-                                    if(pow is True):
-                                        dmg = dmg * 1.5
-                                        pow = False
-                                    message = f"{elem}攻撃！ {dmg} ダメージ"
-                                                                       # 攻撃した味方の属性について、宝石を消した分だけその属性のspをためる
-                                    for ally in party["allies"]:
-                                        if ally["element"] == elem:
-                                            ally["sp"] += L
-                                            ally["sp"] = min(
-                                            ally["sp"], ally["skill"].need_sp)
-
-
-                                    pid.PID_INIT()
-                                    dev = pid.P_Control(
-                                        1.4, 30, 0) + pid.I_Control(0.2, 30)
-                                    cnt = 200
-                                    while (pid.abs(pid.deviation_P) > 2):
-                                        screen.fill((22, 22, 28))
-                                        x = pid.P_Control(
-                                            0.7, dev, 0) + pid.I_Control(0.2, dev)
-                                        y = pid.P_Control(
-                                            0.7, dev, 0) + pid.I_Control(0.2, dev)
-                                        if (enemy["hp"] > 0):
-                                            gss.draw_top(
-                                                screen, enemy, party, font, weakFont, x, 0)
-                                        else:
-                                            gss.draw_top(
-                                                screen, enemy, party, font, weakFont, x, 0, cnt)
-                                            cnt -= 10
-                                        gss.draw_field(screen, field, font)
-                                        gss.draw_message(screen, "消滅！", font)
-                                        pg.display.flip()
-                                        dev = x
-
-                                gss.collapse_left(field, start, L)
-                                screen.fill((22, 22, 28))
-                                if (enemy["hp"] > 0):
-                                    gss.draw_top(
-                                        screen, enemy, party, font, weakFont)
-                                else:
-                                    gss.draw_top(
-                                        screen, enemy, party, font, weakFont, 0, 0, 0)
-                                gss.draw_field(screen, field, font)
-                                gss.draw_message(screen, "消滅！", font)
-                                pg.display.flip()
-                                time.sleep(gss.FRAME_DELAY)
-                                gss.fill_random(field)
-                                screen.fill((22, 22, 28))
-                                if (enemy["hp"] > 0):
-                                    gss.draw_top(
-                                        screen, enemy, party, font, weakFont)
-                                else:
-                                    gss.draw_top(
-                                        screen, enemy, party, font, weakFont, 0, 0, 0)
-                                gss.draw_field(screen, field, font)
-                                gss.draw_message(screen, "湧き！", font)
-                                pg.display.flip()
-                                time.sleep(gss.FRAME_DELAY)
-                                if enemy["hp"] <= 0:
-                                    message = f"{enemy['name']} を倒した！"
-
-                                    break
-
-                            # 敵ターン or 撃破後処理
-                            if enemy["hp"] > 0:
-
-                                # 準備
-                                status = enemy["status"]
-                                act_type = "normal"
-
-                                # 行動パターン決定
-                                if status["type"] == "atk_down":
-                                    act_type = "weak_atk"
-                                if status["type"] == "stun":
-                                    act_type = "stun"
-
-                                # 実行
-                                edmg = 0
-                                if act_type == "normal":
-                                    if(GUARD == False):
-                                        base_dmg = gss.enemy_attack(party, enemy)
-                                        edmg = base_dmg
-                                        message = f"{enemy['name']}の攻撃！ -{edmg}"
-                                    else:
-                                        base_dmg = 0
-                                        message = "お守りの効果でガードした！"
-                                        GUARD = False
-                                if act_type == "atk_down":
-                                    base_dmg = gss.enemy_attack(party, enemy)
-                                    edmg = int(base_dmg*status["val"])
-                                    diff = base_dmg - edmg
-                                    party["hp"] += diff
-                                    message = f"{enemy['name']}の攻撃(弱)！ -{edmg}(残り{status['turn']}ターン)"
-                                if act_type == "stun":
-                                    message = f"{enemy['name']}は動けない！残り{status['turn']}ターン"
-                                if act_type != "stun":
-                                    dev = pid.P_Control(
-                                        0.7, 30, 0) + pid.I_Control(0.2, 30)
-                                while (pid.abs(pid.deviation_P) > 2):
-                                    screen.fill((22, 22, 28))
-                                    x = pid.P_Control(
-                                        0.7, dev, 0) + pid.I_Control(0.2, dev)
-                                    y = pid.P_Control(
-                                        0.7, dev, 0) + pid.I_Control(0.2, dev)
-                                    gss.draw_top(
-                                        screen, enemy, party, font, weakFont)
-                                    gss.draw_field(
-                                        screen, field, font, None, None, None, x, y)
-                                    pg.display.flip()
-                                    dev = x
-                                screen.fill((22, 22, 28))
-                                gss.draw_top(screen, enemy, party,
-                                             font, weakFont)
-                                gss.draw_field(
-                                    screen, field, font, None, None, None)
-                                gss.draw_message(screen, message, font)
-                                pg.display.flip()
-                                time.sleep(gss.ENEMY_DELAY)
-
-                                # ターン処理
-                                if status["turn"] is not None and status["turn"] > 0:
-                                    status["turn"] -= 1
-                                    if status["turn"] == 0:
-                                        status["type"] = None
-                                        status["val"] = None
-
-                                if party["hp"] <= 0:
-                                    message = "パーティは力尽きた…（ESCで終了）"
-                            else:
-                                enemy_idx += 1
-                                if enemy_idx < len(enemies):
-
-                                    enemy = enemies[enemy_idx]
-                                    field = gss.init_field()
-                                    message = f"さらに奥へ… 次は {enemy['name']}"
-                                else:
-                                    drag_src = None
-                                    drag_elem = None
-                                    hover_idx = None
-                                    gameClear = True
-                                    break
+                        j = gss.slot_at(mx, None if gss.GRID_H == 1 else my)
+                        if j is not None:
+                            # 移動・連鎖・敵の反撃（撃破時は次の敵へ）
+                            message = logic(engine.play_turn, state, drag_src, j)
+                            hint = None
                     drag_src = None
                     drag_elem = None
                     hover_idx = None
             else:
                 screen.fill((22, 22, 28))
+                renderer.invalidate()
 
 
             if (e.type == pg.KEYDOWN):
+                inputs.log(e)
                 secret.append(e.key)
+                if e.key == pg.K_F2:
+                    # 差分描画 ⇔ 全画面描画 の切り替え（フレーム時間の比較用）
+                    renderer.toggle()
+                elif e.key == pg.K_F4:
+                    # フェーズごとの時間の表示
+                    prof.toggle()
+                    renderer.invalidate()
+                elif e.key == pg.K_F3:
+                    # アニメーションを飛ばす（高速プレイ）
+                    timeline.instant = not timeline.instant or inputs.headless
+                    if timeline.instant:
+                        timeline.clear()
+                elif e.key == pg.K_h and gameStarting and not state.finished:
+                    src, dst = solver.best_move(state)
+                    hint = f"ヒント: {gss.SLOTS[src]}→{gss.SLOTS[dst]}"
+                elif e.key == pg.K_p:
+                    auto_play = not auto_play
+                    auto_battle = False
+                    bot.cancel()
+                    hint = "オートプレイ ON（Pで解除）" if auto_play else None
+                elif e.key == pg.K_b:
+                    auto_battle = not auto_battle
+                    auto_play = False
+                    if not auto_battle:
+                        bot.cancel()
+                    hint = "オートバトル ON（Bで解除、その間も手で指せる）" if auto_battle else None
 
             if (set(command_list[0]) <= set(secret)):
                 party["hp"] = 700
                 secret.clear()
 
             # ドラッグ終了
-    # 常時描画
-        if (party["hp"] > 0 and gameStarting == True and gameClear == False):
-            screen.fill((22, 22, 28))
-            gss.draw_top(screen, enemy, party, font, weakFont)
-            gss.draw_field(screen, field, font, hover_idx, drag_src, drag_elem)
-            item.draw_item_surface(screen, font, itemList["name"], itemList["max_hold"])
-
-            powflag = item.clickedItem(e, 0)
-            guardFlag = item.clickedItem(e, 1)
-            leaflag =  item.clickedItem(e, 2)
-            sFlag = item.clickedItem(e, 3)
-            if(powflag == True):
-                if(itemList["max_hold"][1] > 0):
-                    gss.draw_message(screen, "力の粉を使った。", font)
-                    pg.display.flip()
-                    itemList["max_hold"][1] -= 1
-                    time.sleep(gss.FRAME_DELAY)
-                    pow = True
-                    powflag = False
+        # オートプレイ：アニメーションが終わるたびにスキル→最善手を指す
+        # （再生では記録したフレームでだけ、記録した手を指す）
+        if (auto_play and gameStarting and not state.finished and not timeline.busy
+                and drag_src is None and inputs.decide("auto", lambda: True)):
+            for i in range(len(party["allies"])):
+                message = logic(engine.use_skill, state, i)
+                if state.finished:
+                    break
+            if not state.finished:
+                # 読む時間も logic に付け、元のフェーズに戻す
+                prev = prof.enter("logic")
+                src, dst = inputs.decide("move", lambda: solver.best_move(state))
+                prof.enter(prev)
+                message = logic(engine.play_turn, state, src, dst)
+        # オートバトル：アニメーション中も次の局面を考えさせておき、終わって持ち時間が
+        # 過ぎたら届いた最善手を指す（掴んでいる間や手で指した後は考え直し）
+        if auto_battle and gameStarting and not state.finished:
+            ready = not timeline.busy and drag_src is None
+            action = inputs.decide("bot", lambda: bot.poll(state, ready))
+            if action:
+                kind, a, b = action
+                if kind == SKILL:
+                    message = logic(engine.use_skill, state, a)
                 else:
-                    gss.draw_message(screen, "アイテムはもうない...", font)
-                    pg.display.flip()
-                    time.sleep(gss.FRAME_DELAY)
-
-            elif(guardFlag == True):
-                if(itemList["max_hold"][2] > 0):
-                    gss.draw_message(screen, "お守りを使った。", font)
-                    pg.display.flip()
-                    itemList["max_hold"][2] -= 1
-                    time.sleep(gss.FRAME_DELAY)
-                    GUARD = True
-                    guardFlag = False
-                else:
-                    gss.draw_message(screen, "アイテムはもうない...", font)
-                    pg.display.flip()
-                    time.sleep(gss.FRAME_DELAY)
-
-            elif(leaflag == True):
-                if(itemList["max_hold"][3] > 0):
-                    gss.draw_message(screen, "薬草を使った。", font)
-                    pg.display.flip()
-                    itemList["max_hold"][3] -= 1
-                    time.sleep(gss.FRAME_DELAY)
-                    if(party["hp"] < 500):
-                        party["hp"] += 25
-                    leaflag = False
-                else:
-                    gss.draw_message(screen, "アイテムはもうない...", font)
-                    pg.display.flip()
-                    time.sleep(gss.FRAME_DELAY)
-
-            elif(sFlag == True):
-                if(itemList["max_hold"][4] > 0):
-                    gss.draw_message(screen, "気まぐれ石を使った。", font)
-                    pg.display.flip()
-                    itemList["max_hold"][4] -= 1
-                    time.sleep(gss.FRAME_DELAY)
-                    s = random.choice([1,2,3,4])
-                    itemList["max_hold"][s] += 1
-                    sFlag == False
-                else:
-                    gss.draw_message(screen, "アイテムはもうない...", font)
-                    pg.display.flip()
-                    time.sleep(gss.FRAME_DELAY)
+                    message = logic(engine.play_turn, state, a, b)
+            if bot.error is not None:
+                hint = f"オートバトル: {bot.error}"
+            elif bot.best is not None:
+                hint = f"オートバトル: {describe(bot.best, state)}（{bot.iterations} 回）"
 
-        elif (party["hp"] <= 0 and gameStarting == True and gameClear == False):
+    # 常時描画
+        prof.enter("draw")
+        # アニメーションとバーは 1/60 秒の刻みで進める（描画の間隔によらない）
+        steps = pacer.steps(dt)
+        for _ in range(steps):
+            BARS.advance(pacer.STEP)
+            view = timeline.update(pacer.STEP)
+        if not steps and not timeline.busy:
+            view = None
+        if view is not None:
+            # アニメーション中はそのコマを全画面で描く
+            renderer.scene("anim")
+
+            def draw_anim():
+                gss.draw_view(screen, view, font, weakFont)
+                if view["items"]:
+                    item.draw_item_surface(screen, font, itemList["name"], itemList["max_hold"])
+            renderer.invalidate()
+            renderer.draw([("anim", screen.get_rect(), None, prof.wrap("anim", draw_anim))])
+        elif (party["hp"] > 0 and gameStarting == True and state.cleared == False):
+            enemy = state.enemy
+            field = state.field
+            renderer.scene(("battle", state.enemy_idx))
+            allies = party["allies"]
+            # 上半分（敵・パーティ・スキル）は draw_top として測る
+            regions = [
+                ("enemy_img", gss.ENEMY_IMG_RECT, (enemy["name"],),
+                 prof.wrap("draw_top", lambda: gss.draw_enemy_image(screen, enemy))),
+                ("enemy_status", gss.ENEMY_STATUS_RECT, (enemy["name"], enemy["hp"], enemy["max_hp"], BARS.version),
+                 prof.wrap("draw_top", lambda: gss.draw_enemy_status(screen, enemy, font, weakFont))),
+                ("party", gss.PARTY_RECT, (party["hp"], party["max_hp"], BARS.version),
+                 prof.wrap("draw_top", lambda: gss.draw_party_hp(screen, party, font))),
+                ("skills", gss.SKILL_RECT, (tuple(a.get("sp") for a in allies), BARS.version),
+                 prof.wrap("draw_top", lambda: gss.draw_skill_bars(screen, party, font, weakFont))),
+                ("field", gss.FIELD_RECT, (tuple(field), hover_idx, drag_src),
+                 prof.wrap("draw_field", lambda: gss.draw_field(screen, field, font, hover_idx, drag_src))),
+                ("items", gss.ITEM_RECT, tuple(itemList["max_hold"].values()),
+                 prof.wrap("items", lambda: item.draw_item_surface(screen, font, itemList["name"], itemList["max_hold"]))),
+                ("hint", gss.MESSAGE_RECT, hint,
+                 lambda: hint and gss.draw_message(screen, hint, font)),
+            ]
+            overlay = None
+            if drag_elem is not None:
+                ghost = gss.ghost_rect()
+                overlay = ((drag_elem, ghost.topleft), ghost,
+                           prof.wrap("draw_field", lambda: gss.draw_drag_ghost(screen, drag_elem, font)))
+            renderer.draw(regions, overlay)
+
+            # アイテムはこのフレームの最後のイベントで判定する
+            def clicked_item() -> int:
+                last_e = events[-1] if events else None
+                if last_e is None:
+                    return 0
+                flags = [item.clickedItem(last_e, k) for k in range(item.number_of_item)]
+                return next((no for no, flag in enumerate(flags, 1) if flag), 0)
+            no = inputs.decide("item", clicked_item)
+            if no:
+                message = logic(engine.use_item, state, no)
+
+        elif (party["hp"] <= 0 and gameStarting == True and state.cleared == False):
             pass
-        elif (gameStarting == True and gameClear == True):
-            screen.fill((0, 0, 0))
+        elif (gameStarting == True and state.cleared == True):
+            renderer.scene("clear")
             message = "ダンジョン制覇！おめでとう！（ESCで終了）"
-            gss.draw_message(screen, message, clearFont, 75, 260)
+
+            def draw_clear():
+                screen.fill((0, 0, 0))
+                gss.draw_message(screen, message, clearFont, 75, 260)
+            renderer.draw([("clear", screen.get_rect(), message, draw_clear)])
 
         else:
-            screen.fill((0, 0, 0))
-            messag = "Puzzle AND Monsters"
-            gss.draw_message(screen, messag, titleFont, 110, 260)
-            msg = "（spaceでスタート）"
-            gss.draw_message(screen, msg, weakFont, 600, 360)
-        pg.display.flip()
-        clock.tick(60)
-        print(pow)
-        keys = pg.key.get_pressed()
+            renderer.scene("title")
+            big, small = (FONTS.peek(size) for size in gss.TITLE_FONT_SIZES)
+
+            def draw_title():
+                screen.fill((0, 0, 0))
+                if big is not None:
+                    messag = "Puzzle AND Monsters"
+                    gss.draw_message(screen, messag, big, 110, 260)
+                if loader.ready:
+                    msg = "（spaceでスタート）"
+                    gss.draw_message(screen, msg, small, 600, 360)
+                else:
+                    gss.draw_progress(screen, loader.progress, small)
+            renderer.draw([("title", screen.get_rect(), (big, small, loader.done), draw_title)])
+        if prof.visible:
+            bars = BARS.stats()
+            pace = pacer.stats()
+            rect = prof.draw(screen, FONTS.peek(17), [
+                f"bars: {bars['last_frame_allocations']} alloc / {bars['last_frame_repaints']} repaint",
+                f"pace: {pace.get('fps', 0):.0f} fps, idle {pace['idle_frames']}/{pace['frames']}"])
+            if rect is not None:
+                renderer.mark(rect)
+        prof.enter("present")
+        renderer.present()
+        prof.enter("draw")
+        if not loader.ready:
+            loader.poll()
+        if font is None and loader.ready:
+            font, titleFont, weakFont, clearFont = (
+                gss.get_jp_font(size) for size in (30, 73, 17, 40))
+        held = inputs.decide("keys", lambda: held_keys(pg.key.get_pressed(), loader.ready))
+        # 入力も動くものも無ければ次の入力まで眠る（タイトル・クリア・全滅・入力待ち）
+        idle = (not events and not held and not timeline.busy and not BARS.animating
+                and drag_src is None and loader.ready and not prof.visible
+                and not ((auto_play or auto_battle) and gameStarting and not state.finished))
+        prof.enter("wait")
+        dt = inputs.tick(pacer, idle)
+        prof.end()
         if len(secret) > 16:
             secret.clear()
 
-        if keys[pg.K_ESCAPE]:
+        if held & HELD_ESC:
             running = False
-        elif keys[pg.K_0]:
+        elif held & HELD_ZERO:
             party["hp"] = 300
 
-        elif (keys[pg.K_SPACE]):
+        elif held & HELD_START:
             gameStarting = True
 
+    inputs.close(state)
+    bot.close()
+    prof.close()
     pg.quit()
     sys.exit()
 